@@ -127,3 +127,10 @@ def pytest_runtest_setup(item: pytest.Item):
     if INTEGRATION_TEST_LOG_COLLECTION:
         sdk_diag.handle_test_setup(item)
     sdk_utils.check_dcos_min_version_mark(item)
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus: int):
+    """Hook to run after all tests have finished."""
+    if INTEGRATION_TEST_LOG_COLLECTION:
+        # Write out the last test suite's artifact manifest/archive.
+        sdk_diag.handle_session_finish()
@@ -39,7 +39,7 @@ def configure_package(configure_security):
 def test_service_overlay_health():
     tasks = sdk_tasks.check_task_count(config.SERVICE_NAME, config.DEFAULT_TASK_COUNT)
     for task in tasks:
-        sdk_networks.check_task_network(task.name)
+        sdk_networks.check_task_network(task.name, framework_id=task.framework_id)
 
 
 @pytest.mark.sanity
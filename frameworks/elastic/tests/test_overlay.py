@@ -65,7 +65,7 @@ def test_indexing(default_populated_index):
 def test_tasks_on_overlay():
     tasks = sdk_tasks.check_task_count(config.SERVICE_NAME, config.DEFAULT_TASK_COUNT)
     for task in tasks:
-        sdk_networks.check_task_network(task.name)
+        sdk_networks.check_task_network(task.name, framework_id=task.framework_id)
 
 
 @pytest.mark.sanity
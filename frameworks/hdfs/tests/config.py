@@ -181,11 +181,13 @@ def run_client_command(hdfs_command, success_check=lambda rc, stdout, stderr: rc
 
 
 def check_healthy(service_name, count=DEFAULT_TASK_COUNT, recovery_expected=False):
-    sdk_plan.wait_for_completed_deployment(service_name, timeout_seconds=25 * 60)
     if recovery_expected:
+        sdk_plan.wait_for_completed_deployment(service_name, timeout_seconds=25 * 60)
         # TODO(elezar): See INFINITY-2109 where we need to better handle recovery health checks
         sdk_plan.wait_for_kicked_off_recovery(service_name, timeout_seconds=25 * 60)
-    sdk_plan.wait_for_completed_recovery(service_name, timeout_seconds=25 * 60)
+        sdk_plan.wait_for_completed_recovery(service_name, timeout_seconds=25 * 60)
+    else:
+        sdk_plan.wait_for_quiescence(service_name, timeout_seconds=25 * 60)
     sdk_tasks.check_running(service_name, count)
 
 
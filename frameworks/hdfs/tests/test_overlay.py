@@ -51,7 +51,7 @@ def hdfs_client():
 def test_tasks_on_overlay():
     tasks = sdk_tasks.check_task_count(config.SERVICE_NAME, config.DEFAULT_TASK_COUNT)
     for task in tasks:
-        sdk_networks.check_task_network(task.name)
+        sdk_networks.check_task_network(task.name, framework_id=task.framework_id)
 
 
 @pytest.mark.overlay
@@ -59,14 +59,16 @@ def test_overlay_network():
             assert "ports" in task.resources.keys(), "Task {} should have port resources".format(
                 name
             )
-            sdk_networks.check_task_network(name, expected_network_name=None)
+            sdk_networks.check_task_network(
+                name, expected_network_name=None, framework_id=task.framework_id
+            )
         elif name.startswith("overlay-"):
             assert (
                 "ports" not in task.resources.keys()
             ), "Task {} should NOT have port resources".format(
                 name
             )
-            sdk_networks.check_task_network(name)
+            sdk_networks.check_task_network(name, framework_id=task.framework_id)
         else:
             assert False, "Unknown task {}".format(name)
 
@@ -43,7 +43,7 @@ def test_service_overlay_health():
     """
     tasks = sdk_tasks.check_task_count(config.SERVICE_NAME, config.DEFAULT_BROKER_COUNT)
     for task in tasks:
-        sdk_networks.check_task_network(task.name)
+        sdk_networks.check_task_network(task.name, framework_id=task.framework_id)
 
 
 @pytest.mark.smoke
@@ -0,0 +1,301 @@
+"""Sinks for the diagnostic artifacts which sdk_diag collects following a failed test.
+
+Each test suite's artifacts are written to a single sink, rooted at e.g. 'logs/test_sanity_py'.
+Artifacts are named relative to that root, e.g. '01__test_install/plan_hello-world_deploy.json'.
+The format is selected with DCOS_DIAG_ARTIFACTS:
+
+- 'dir' (default): Artifacts are written as individual files under the root directory.
+- 'tar.gz': Artifacts are streamed into a single compressed archive, e.g. 'logs/test_sanity_py.tar.gz'.
+- 'tar.zst': As with 'tar.gz', but compressed with zstd. Requires the 'zstandard' module, or else
+  falls back to 'tar.gz'.
+
+Every sink writes a 'manifest.json' listing each artifact's size and sha256. When
+DCOS_DIAG_ARTIFACT_DEDUPE is enabled (the default), artifacts whose content is identical to an
+earlier artifact in the suite are stored as hard links to the earlier copy.
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_artifacts IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT = os.environ.get("DCOS_DIAG_ARTIFACTS", "dir").lower()
+
+DEDUPE_ENABLED = os.environ.get("DCOS_DIAG_ARTIFACT_DEDUPE", "true").lower() in ["true", "1"]
+
+MANIFEST_NAME = "manifest.json"
+
+# Artifacts being streamed into an archive are buffered in memory up to this size, then on disk.
+_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+_COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def create_sink(root_dir: str):
+    """Returns a new sink for artifacts under root_dir (e.g. 'logs/test_sanity_py'), in the
+    format configured by DCOS_DIAG_ARTIFACTS. Any existing artifacts at that location are removed.
+    """
+    artifact_format = ARTIFACT_FORMAT
+    if artifact_format == "tar.zst" and zstandard is None:
+        log.warning("DCOS_DIAG_ARTIFACTS=tar.zst requires the zstandard module, using tar.gz")
+        artifact_format = "tar.gz"
+    if artifact_format in ("tar.gz", "tar.zst"):
+        sink = ArchiveSink(root_dir, artifact_format)
+    else:
+        if artifact_format != "dir":
+            log.warning("Unsupported DCOS_DIAG_ARTIFACTS={}, using dir".format(artifact_format))
+        sink = DirectorySink(root_dir)
+    sink.remove_existing()
+    return sink
+
+
+class ArtifactSink(object):
+    """Base class for sinks. Artifacts may be written concurrently from multiple threads."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self._lock = threading.Lock()
+        self._manifest = {}  # name => {"size": ..., "sha256": ..., ["link": name]}
+        self._names_by_digest = {}  # sha256 => first name with that content
+        self._closed = False
+
+    def describe(self, name: str) -> str:
+        """Returns a human-readable location for the named artifact, for logging."""
+        return os.path.join(self.root_dir, name)
+
+    def write(self, name: str, content):
+        """Writes the provided str or bytes content as the named artifact."""
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        with self.open(name) as f:
+            f.write(content)
+
+    def add_file(self, name: str, local_path: str):
+        """Moves an existing local file into the sink as the named artifact."""
+        with open(local_path, "rb") as src, self.open(name) as f:
+            shutil.copyfileobj(src, f, _COPY_CHUNK_BYTES)
+        os.remove(local_path)
+
+    def open(self, name: str):
+        """Returns a writable binary file object for the named artifact. The artifact is stored
+        when the file object is closed, so it should be used as a context manager."""
+        if self._closed:
+            raise ValueError("Artifact sink {} is already closed".format(self.root_dir))
+        return self._open(name)
+
+    def record_skipped(self, name: str, reason: str, size=None):
+        """Records an artifact which was deliberately not collected in the manifest."""
+        with self._lock:
+            self._manifest[name] = {"size": size, "skipped": reason}
+
+    def close(self):
+        """Writes the manifest and finalizes the sink. Subsequent writes are not allowed."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._finish()
+
+    def remove_existing(self):
+        raise NotImplementedError()
+
+    def _open(self, name: str):
+        raise NotImplementedError()
+
+    def _finish(self):
+        """Finalizes the sink. Called once, with the lock held."""
+        raise NotImplementedError()
+
+    def _get_manifest(self) -> bytes:
+        return json.dumps(
+            {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "artifacts": self._manifest,
+            },
+            indent=2,
+            sort_keys=True,
+        ).encode("utf-8")
+
+    def _record(self, name: str, size: int, digest: str):
+        """Adds the artifact to the manifest. Must be called with the lock held.
+        Returns the name of an earlier artifact with identical content, or None."""
+        entry = {"size": size, "sha256": digest}
+        link = self._names_by_digest.get(digest) if DEDUPE_ENABLED and size else None
+        if link is None:
+            self._names_by_digest.setdefault(digest, name)
+        else:
+            entry["link"] = link
+        self._manifest[name] = entry
+        return link
+
+
+class _HashingWriter(io.RawIOBase):
+    """Passes writes through to a file object while tracking their size and sha256."""
+
+    def __init__(self, fileobj, on_close):
+        self._fileobj = fileobj
+        self._on_close = on_close
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._fileobj.write(data)
+        self._sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self._on_close(self._fileobj, self.size, self._sha256.hexdigest())
+
+
+class DirectorySink(ArtifactSink):
+    """Writes artifacts as individual files under the root directory."""
+
+    def _open(self, name: str):
+        path = os.path.join(self.root_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        def _on_close(f, size, digest):
+            f.close()
+            with self._lock:
+                link = self._record(name, size, digest)
+            if link is not None:
+                try:
+                    os.link(os.path.join(self.root_dir, link), path + ".link")
+                    os.replace(path + ".link", path)
+                except OSError as e:
+                    log.info("Failed to link {} to {}: {}".format(path, link, e))
+
+        return _HashingWriter(open(path, "wb"), _on_close)
+
+    def remove_existing(self):
+        if os.path.exists(self.root_dir):
+            log.info("Deleting existing test suite logs: {}/".format(self.root_dir))
+            shutil.rmtree(self.root_dir)
+
+    def _finish(self):
+        if not self._manifest:
+            return  # nothing was written, don't leave a lone manifest behind
+        with open(os.path.join(self.root_dir, MANIFEST_NAME), "wb") as f:
+            f.write(self._get_manifest())
+
+
+class ArchiveSink(ArtifactSink):
+    """Streams artifacts into a compressed tar archive next to the root directory, e.g.
+    'logs/test_sanity_py.tar.gz'. The archive is only created once something is written to it.
+
+    Any files which other code wrote directly under the root directory (e.g. plan timelines) are
+    moved into the archive when the sink is closed.
+    """
+
+    def __init__(self, root_dir: str, artifact_format: str):
+        super().__init__(root_dir)
+        self.path = "{}.{}".format(root_dir.rstrip("/"), artifact_format)
+        self._format = artifact_format
+        self._archive_name = os.path.basename(root_dir.rstrip("/"))
+        self._fileobjs = []  # file, compressor, in the order to be closed
+        self._tar = None
+
+    def describe(self, name: str) -> str:
+        return "{}:{}".format(self.path, self._member_name(name))
+
+    def _open(self, name: str):
+        def _on_close(f, size, digest):
+            try:
+                f.seek(0)
+                with self._lock:
+                    link = self._record(name, size, digest)
+                    self._add_member(name, size, f, link)
+            finally:
+                f.close()
+
+        return _HashingWriter(tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES), _on_close)
+
+    def remove_existing(self):
+        if os.path.exists(self.path):
+            log.info("Deleting existing test suite logs: {}".format(self.path))
+            os.remove(self.path)
+        if os.path.exists(self.root_dir):
+            shutil.rmtree(self.root_dir)
+
+    def _member_name(self, name: str) -> str:
+        # Extracting 'test_sanity_py.tar.gz' produces 'test_sanity_py/...', as with DirectorySink.
+        return "{}/{}".format(self._archive_name, name)
+
+    def _add_member(self, name: str, size: int, fileobj, link):
+        """Adds an entry to the archive. Must be called with the lock held."""
+        if self._tar is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            raw = open(self.path, "wb")
+            if self._format == "tar.zst":
+                compressed = zstandard.ZstdCompressor().stream_writer(raw)
+            else:
+                compressed = gzip.GzipFile(
+                    filename="", mode="wb", fileobj=raw, compresslevel=6, mtime=0
+                )
+            self._fileobjs = [compressed, raw]
+            # Stream mode: Entries are written sequentially without seeking in the output.
+            self._tar = tarfile.open(fileobj=compressed, mode="w|")
+        info = tarfile.TarInfo(self._member_name(name))
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        if link is None:
+            info.size = size
+            self._tar.addfile(info, fileobj)
+        else:
+            info.type = tarfile.LNKTYPE
+            info.linkname = self._member_name(link)
+            self._tar.addfile(info)
+
+    def _finish(self):
+        # Sweep up any files which were written directly to the root directory.
+        if os.path.isdir(self.root_dir):
+            for dirpath, _, filenames in os.walk(self.root_dir):
+                for filename in sorted(filenames):
+                    local_path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(local_path, self.root_dir)
+                    size = os.path.getsize(local_path)
+                    sha256 = hashlib.sha256()
+                    with open(local_path, "rb") as f:
+                        for chunk in iter(lambda: f.read(_COPY_CHUNK_BYTES), b""):
+                            sha256.update(chunk)
+                        f.seek(0)
+                        link = self._record(name, size, sha256.hexdigest())
+                        self._add_member(name, size, f, link)
+            shutil.rmtree(self.root_dir)
+        if not self._manifest:
+            return  # nothing was written, don't leave an empty archive behind
+        manifest = self._get_manifest()
+        self._add_member(MANIFEST_NAME, len(manifest), io.BytesIO(manifest), None)
+        self._tar.close()
+        for fileobj in self._fileobjs:
+            fileobj.close()
+        log.info(
+            "Wrote {} artifacts to {} ({} bytes)".format(
+                len(self._manifest), self.path, os.path.getsize(self.path)
+            )
+        )
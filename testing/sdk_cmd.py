@@ -5,17 +5,24 @@ FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
 SHOULD ALSO BE APPLIED TO sdk_cmd IN ANY OTHER PARTNER REPOS
 ************************************************************************
 """
+import atexit
+import base64
+import codecs
+import collections
 import functools
 import json as jsonlib
 import os
 import logging
 import requests
 import retrying
+import shlex
 import subprocess
 import tempfile
+import threading
 import time
 import urllib.parse
 import urllib3
+import uuid
 
 import sdk_utils
 
@@ -25,6 +32,22 @@ log = logging.getLogger(__name__)
 DEFAULT_TIMEOUT_SECONDS = 30 * 60
 SSH_USERNAME = os.environ.get("DCOS_SSH_USERNAME", "core")
 
+# Whether task exec should use the Mesos agent API directly, instead of invoking `dcos task exec`.
+NATIVE_TASK_EXEC = os.environ.get("DCOS_NATIVE_TASK_EXEC", "true").lower() in ["true", "1"]
+
+# Settings for SSH connection reuse. When enabled, one connection is kept open per target host and
+# is shared by all commands sent to that host, until it has been idle for SSH_CONTROL_PERSIST_SECONDS.
+SSH_MULTIPLEX = os.environ.get("DCOS_SSH_MULTIPLEX", "true").lower() in ["true", "1"]
+SSH_CONTROL_PERSIST_SECONDS = int(os.environ.get("DCOS_SSH_CONTROL_PERSIST", "300"))
+# The control socket path used on the proxy node for nested (non-DCOS_SSH_DIRECT) connections.
+SSH_REMOTE_CONTROL_PATH = "/tmp/sdk-ssh-%r@%h:%p"
+
+# Host => _SSHHostStats, along with the local directory for control sockets.
+# Access must be guarded by _ssh_lock.
+_ssh_host_stats = {}
+_ssh_control_dir = None
+_ssh_lock = threading.Lock()
+
 # Silence this warning. We expect certs to be self-signed:
 # /usr/local/lib/python3.6/dist-packages/urllib3/connectionpool.py:857:
 #     InsecureRequestWarning: Unverified HTTPS request is being made.
@@ -32,6 +55,113 @@ SSH_USERNAME = os.environ.get("DCOS_SSH_USERNAME", "core")
 #     See: https://urllib3.readthedocs.io/en/latest/advanced-usage.html#ssl-warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Settings for the pooled HTTP sessions used by cluster_request(). Each cluster URL gets its own
+# session, whose connections are kept alive and reused across calls (and across threads).
+# - Pool size: Maximum number of connections to keep open against a given cluster host.
+# - Connect retries: Number of times to retry a failed connection attempt before giving up. This
+#   is separate from the retry=True behavior of cluster_request(), which covers HTTP errors.
+# - Keep-alive: Whether to reuse connections across requests. Can be disabled to debug issues
+#   with stale connections being dropped by adminrouter.
+HTTP_POOL_SIZE = int(os.environ.get("DCOS_HTTP_POOL_SIZE", "32"))
+HTTP_CONNECT_RETRIES = int(os.environ.get("DCOS_HTTP_CONNECT_RETRIES", "3"))
+HTTP_KEEP_ALIVE = os.environ.get("DCOS_HTTP_KEEP_ALIVE", "true").lower() in ["true", "1"]
+
+# Cluster paths whose GET responses may be reused for a short time, and for how long (in seconds).
+# These are heavy endpoints which are often polled by many concurrent waiters. Set a TTL to zero to
+# disable caching for a path.
+_default_cache_ttl_seconds = float(os.environ.get("DCOS_HTTP_CACHE_TTL_MS", "500")) / 1000
+HTTP_CACHE_TTL_SECONDS = {
+    "/mesos/frameworks": _default_cache_ttl_seconds,
+    "/mesos/slaves": _default_cache_ttl_seconds,
+    "/mesos/tasks": _default_cache_ttl_seconds,
+    "/dcos-history-service/history/last": _default_cache_ttl_seconds,
+}
+# The maximum number of distinct responses to keep in the cache, after which the least recently
+# used responses are evicted.
+HTTP_CACHE_MAX_ENTRIES = int(os.environ.get("DCOS_HTTP_CACHE_MAX_ENTRIES", "64"))
+
+# Cluster URL => requests.Session. Access must be guarded by _http_sessions_lock.
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+class _AuthHeader(requests.auth.AuthBase):
+    """Wraps the cluster token in a callback for the requests library to invoke."""
+
+    def __init__(self, token):
+        self._token = token
+
+    def __call__(self, r):
+        r.headers["Authorization"] = "token={}".format(self._token)
+        return r
+
+
+def configure_http_pool(pool_size=None, connect_retries=None, keep_alive=None):
+    """Updates the settings used for pooled HTTP sessions. Any existing sessions are closed, and
+    new sessions with the updated settings will be created on the next request.
+
+    : param pool_size: Maximum number of connections to keep open against each cluster.
+    : param connect_retries: Number of times to retry establishing a connection.
+    : param keep_alive: Whether connections should be reused across requests.
+    """
+    global HTTP_POOL_SIZE, HTTP_CONNECT_RETRIES, HTTP_KEEP_ALIVE
+    if pool_size is not None:
+        HTTP_POOL_SIZE = pool_size
+    if connect_retries is not None:
+        HTTP_CONNECT_RETRIES = connect_retries
+    if keep_alive is not None:
+        HTTP_KEEP_ALIVE = keep_alive
+    close_http_sessions()
+
+
+def close_http_sessions():
+    """Closes all pooled HTTP sessions, along with any connections they're holding open."""
+    with _http_sessions_lock:
+        sessions = list(_http_sessions.values())
+        _http_sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def get_http_session(cluster_url=None) -> requests.Session:
+    """Returns the shared HTTP session for the provided cluster URL, or for the configured cluster
+    if no URL is provided. The session is created on first use and is safe to share across threads.
+    """
+    if cluster_url is None:
+        cluster_url = sdk_utils.dcos_url()
+    with _http_sessions_lock:
+        session = _http_sessions.get(cluster_url)
+        if session is None:
+            session = _create_http_session()
+            _http_sessions[cluster_url] = session
+        return session
+
+
+def _create_http_session() -> requests.Session:
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,  # we only talk to a single host per session
+        pool_maxsize=HTTP_POOL_SIZE,
+        # Only retry on connection-level failures. Retries of HTTP errors and read timeouts are
+        # left to cluster_request(), where they're logged.
+        max_retries=urllib3.util.retry.Retry(
+            total=HTTP_CONNECT_RETRIES,
+            connect=HTTP_CONNECT_RETRIES,
+            read=0,
+            status=0,
+            redirect=False,
+            backoff_factor=0.5,
+            raise_on_status=False,
+        ),
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # We expect certs to be self-signed, see above.
+    session.verify = False
+    if not HTTP_KEEP_ALIVE:
+        session.headers["Connection"] = "close"
+    return session
+
 
 def service_request(
     method,
@@ -42,6 +172,7 @@ def service_request(
     log_args=True,
     log_response=False,
     timeout_seconds=60,
+    cache=True,
     **kwargs,
 ):
     """Used to query a service running on the cluster. See `cluster_request()` for arg meanings.
@@ -61,6 +192,7 @@ def service_request(
         log_args=log_args,
         log_response=log_response,
         timeout_seconds=timeout_seconds,
+        cache=cache,
         **kwargs,
     )
 
@@ -73,11 +205,15 @@ def cluster_request(
     log_args=True,
     log_response=False,
     timeout_seconds=60,
+    cache=True,
     **kwargs,
 ):
     """Queries the provided cluster HTTP path using the provided method, with the following handy features:
     - The DCOS cluster's URL is automatically applied to the provided path.
     - Auth headers are automatically added.
+    - Connections are pooled and kept alive across calls, see get_http_session().
+    - GETs of heavy cluster state endpoints are briefly cached and concurrent identical GETs are
+      coalesced into a single request, see HTTP_CACHE_TTL_SECONDS.
     - If the response code is >= 400, optionally retries and / or raises a `requests.exceptions.HTTPError`.
 
     : param method: Method to use for the query, such as `GET`, `POST`, `DELETE`, or `PUT`.
@@ -88,7 +224,10 @@ def cluster_request(
     : param log_args: Whether to log the contents of `kwargs`. Can be disabled to reduce noise.
     : param log_response: Whether to always log the response content.
                           Otherwise responses are only logged if the response code is >= 400.
-    : param kwargs: Additional arguments to requests.request(), such as `json = {"example": "content"}`
+    : param cache: Whether the response may be served from (and stored in) the response cache.
+                   Only applies to GETs of paths listed in HTTP_CACHE_TTL_SECONDS. Disable this
+                   when the request must observe a change which was made just beforehand.
+    : param kwargs: Additional arguments to requests.Session.request(), such as `json = {"example": "content"}`
                    or `params = {"example": "param"}`.
     : rtype: requests.Response
     """
@@ -97,26 +236,34 @@ def cluster_request(
     # consistently include slash prefix for clearer logging below
     cluster_path = "/" + cluster_path.lstrip("/")
 
-    # Wrap token in callback for requests library to invoke:
-    class AuthHeader(requests.auth.AuthBase):
-        def __init__(self, token):
-            self._token = token
-
-        def __call__(self, r):
-            r.headers["Authorization"] = "token={}".format(self._token)
-            return r
-
-    auth = AuthHeader(sdk_utils.dcos_token())
+    session = get_http_session()
+    auth = _AuthHeader(sdk_utils.dcos_token())
+    cache_ttl_seconds = _get_http_cache_ttl(method, cluster_path, kwargs) if cache else 0
 
     def _cluster_request():
+        if cache_ttl_seconds:
+            cache_key = (url, repr(sorted((kwargs.get("params") or {}).items())))
+            response, cache_result = _http_response_cache.get_or_fetch(
+                cluster_path.partition("?")[0], cache_key, cache_ttl_seconds, _send_request
+            )
+            if cache_result:
+                log.info(
+                    "(HTTP {}) {} => {} ({})".format(
+                        method.upper(), cluster_path, response.status_code, cache_result
+                    )
+                )
+            return response
+        return _send_request()
+
+    def _send_request():
         start = time.time()
 
         # check if we have verify key already exists.
         if kwargs is not None and kwargs.get('verify') is not None:
             kwargs['verify'] = False
-            response = requests.request(method, url, auth=auth, timeout=timeout_seconds, **kwargs)
+            response = session.request(method, url, auth=auth, timeout=timeout_seconds, **kwargs)
         else:
-            response = requests.request(method, url, auth=auth, verify=False, timeout=timeout_seconds, **kwargs)
+            response = session.request(method, url, auth=auth, verify=False, timeout=timeout_seconds, **kwargs)
 
         end = time.time()
 
@@ -155,6 +302,95 @@ def cluster_request(
         return _cluster_request()
 
 
+class _ResponseCache(object):
+    """A short-lived LRU cache of successful responses, which also coalesces concurrent requests
+    for the same resource: While a request is in flight, any identical requests wait for its
+    result rather than sending their own."""
+
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key => (expiration, response)
+        self._in_flight = {}  # key => threading.Event
+        self._stats = collections.defaultdict(lambda: {"hits": 0, "misses": 0, "coalesced": 0})
+
+    def get_or_fetch(self, stats_key, key, ttl_seconds, fetch_fn) -> tuple:
+        """Returns a (response, result) tuple, where result is "cached" or "coalesced" if the
+        response came from another request, or an empty string if fetch_fn() was invoked."""
+        while True:
+            with self._lock:
+                response = self._get_entry(key)
+                if response is not None:
+                    self._stats[stats_key]["hits"] += 1
+                    return response, "cached"
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    self._stats[stats_key]["misses"] += 1
+                    in_flight = threading.Event()
+                    self._in_flight[key] = in_flight
+                    break
+                self._stats[stats_key]["coalesced"] += 1
+
+            # Wait for the other request to finish. If it failed, try again ourselves.
+            in_flight.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[1], "coalesced"
+
+        try:
+            response = fetch_fn()
+            if response.ok:
+                with self._lock:
+                    self._entries[key] = (time.monotonic() + ttl_seconds, response)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self._max_entries:
+                        self._entries.popitem(last=False)
+            return response, ""
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.set()
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {path: dict(counts) for path, counts in self._stats.items()}
+
+
+_http_response_cache = _ResponseCache(HTTP_CACHE_MAX_ENTRIES)
+
+
+def _get_http_cache_ttl(method, cluster_path, kwargs) -> float:
+    if method.upper() != "GET" or kwargs.get("stream") or "data" in kwargs or "json" in kwargs:
+        return 0
+    return HTTP_CACHE_TTL_SECONDS.get(cluster_path.partition("?")[0], 0)
+
+
+def get_http_cache_stats() -> dict:
+    """Returns per-path hit/miss/coalesced counts for the response cache used by cluster_request().
+    Useful for tuning HTTP_CACHE_TTL_SECONDS."""
+    return _http_response_cache.stats()
+
+
+def clear_http_cache() -> None:
+    """Drops all cached responses, so that the next request to each path goes to the cluster."""
+    _http_response_cache.clear()
+
+
 def svc_cli(package_name, service_name, service_cmd, print_output=True, check=False):
     return run_cli(
         "{} --name={} {}".format(package_name, service_name, service_cmd),
@@ -346,6 +582,29 @@ def agent_scp(
 
 
 def _ssh(cmd: str, host: str, timeout_seconds: int, print_output: bool, check: bool) -> tuple:
+    connect_seconds = _ensure_ssh_connection(host, timeout_seconds)
+
+    ssh_cmd = _ssh_command(cmd, host, timeout_seconds)
+    log.info("SSH command: {}".format(ssh_cmd))
+    start = time.time()
+    rc, stdout, stderr = _run_cmd(ssh_cmd, print_output, check, timeout_seconds=timeout_seconds)
+    command_seconds = time.time() - start
+    _record_ssh_command(host, command_seconds)
+    log.info(
+        "SSH to {}: connect={} command={}".format(
+            host,
+            sdk_utils.pretty_duration(connect_seconds) if connect_seconds else "reused",
+            sdk_utils.pretty_duration(command_seconds),
+        )
+    )
+
+    if rc == 255 and stdout == "":
+        log.info("NOTE: Could be due to misconfigured SSH credentials. Configured keys are:")
+        _run_cmd("ssh-add -L", print_output=True, check=False)
+    return rc, stdout, stderr
+
+
+def _ssh_command(cmd: str, host: str, timeout_seconds: int, master: bool = False) -> str:
     common_args = " ".join(
         [
             # -oBatchMode=yes: Don't prompt for password if keyfile doesn't work.
@@ -367,19 +626,24 @@ def _ssh(cmd: str, host: str, timeout_seconds: int, print_output: bool, check: b
 
     if os.environ.get("DCOS_SSH_DIRECT", ""):
         # Direct SSH access to the node:
-        ssh_cmd = 'ssh {} {} -- "{}"'.format(common_args, host, cmd)
+        return 'ssh {}{} {} -- "{}"'.format(
+            common_args, _ssh_control_args(_local_ssh_control_path(), master), host, cmd
+        )
     else:
         # Nested SSH call via the proxy node. Be careful to nest quotes to match, and escape any
-        # command-internal double quotes as well:
-        ssh_cmd = 'ssh {} {} -- "ssh {} {} -- \\"{}\\""'.format(
-            common_args, _external_cluster_host(), common_args, host, cmd.replace('"', '\\\\\\"')
+        # command-internal double quotes as well. Both hops are multiplexed: the outer hop with a
+        # control socket on this machine, and the inner hop with a control socket on the proxy node.
+        return 'ssh {}{} {} -- "ssh {}{} {} -- \\"{}\\"{}"'.format(
+            common_args,
+            _ssh_control_args(_local_ssh_control_path(), master),
+            _external_cluster_host(),
+            common_args,
+            _ssh_control_args(SSH_REMOTE_CONTROL_PATH, master),
+            host,
+            cmd.replace('"', '\\\\\\"'),
+            # Detach the inner master from the outer session so that the outer session can exit:
+            " </dev/null >/dev/null 2>&1" if master else "",
         )
-    log.info("SSH command: {}".format(ssh_cmd))
-    rc, stdout, stderr = _run_cmd(ssh_cmd, print_output, check, timeout_seconds=timeout_seconds)
-    if rc == 255 and stdout == "":
-        log.info("NOTE: Could be due to misconfigured SSH credentials. Configured keys are:")
-        _run_cmd("ssh-add -L", print_output=True, check=False)
-    return rc, stdout, stderr
 
 
 def _scp(
@@ -400,29 +664,213 @@ def _scp(
         ]
     )
 
+    connect_seconds = _ensure_ssh_connection(host, timeout_seconds)
+
     if os.environ.get("DCOS_SSH_DIRECT", ""):
         # Direct SSH access to the node:
         proxy_arg = ""
     else:
-        # Nested SSH call via the proxy node. Be careful to nest quotes to match:
+        # Nested SSH call via the proxy node. Be careful to nest quotes to match. As with _ssh(),
+        # both hops reuse the shared connections: the outer hop to the proxy node via the control
+        # socket on this machine, and the inner hop via the control socket on the proxy node, which
+        # forwards the connection to the host's SSH port (-W).
         # -A: Forward the pubkey agent connection (required for nested access)
         # -q: Don't show banner, if any is configured, and suppress other warning/diagnostic messages.
         #     In particular, avoid messages that may mess up stdout/stderr output.
         # -l <user>: Username to log in as (depends on cluster OS, default to CoreOS)
-        proxy_arg = ' -oProxyCommand="ssh {} -A -q -l {} {}:22 {}"'.format(
-            common_args, SSH_USERNAME, host, _external_cluster_host()
+        proxy_cmd = 'ssh {}{} -A -q -l {} {} -- \\"ssh {}{} -q -l {} -W {}:22 {}\\"'.format(
+            common_args,
+            _ssh_control_args(_local_ssh_control_path()),
+            SSH_USERNAME,
+            _external_cluster_host(),
+            common_args,
+            _ssh_control_args(SSH_REMOTE_CONTROL_PATH),
+            SSH_USERNAME,
+            host,
+            host,
         )
+        # ssh expands %-tokens in ProxyCommand using the target host, so escape the ones in the
+        # control paths. They're then expanded by each hop's ssh for its own destination.
+        proxy_arg = ' -oProxyCommand="{}"'.format(proxy_cmd.replace("%", "%%"))
 
     with tempfile.NamedTemporaryFile("w") as upload_file:
         upload_file.write(file_content)
         upload_file.flush()
 
         dest = "{}@{}:{}".format(SSH_USERNAME, host, remote_path)
-        scp_cmd = "scp {}{} {} {}".format(common_args, proxy_arg, upload_file.name, dest)
+        scp_cmd = "scp {}{}{} {} {}".format(
+            common_args,
+            # The same control socket as _ssh() uses for direct connections to the host.
+            _ssh_control_args(_local_ssh_control_path())
+            if os.environ.get("DCOS_SSH_DIRECT", "")
+            else "",
+            proxy_arg,
+            upload_file.name,
+            dest,
+        )
+        start = time.time()
         rc, _, _ = _run_cmd(scp_cmd, print_output, check, timeout_seconds=timeout_seconds)
+        command_seconds = time.time() - start
+        _record_ssh_command(host, command_seconds)
+        log.info(
+            "SCP to {}: connect={} command={}".format(
+                host,
+                sdk_utils.pretty_duration(connect_seconds) if connect_seconds else "reused",
+                sdk_utils.pretty_duration(command_seconds),
+            )
+        )
         return rc
 
 
+def _ssh_control_args(control_path: str, master: bool = False) -> str:
+    """Returns the arguments for sharing a multiplexed connection via the provided control socket
+    path, or an empty string if multiplexing is disabled.
+
+    Only the no-op command in _ensure_ssh_connection() may become the master for the connection.
+    A master stays running in the background, and would otherwise keep the stdout/stderr pipes of
+    the command that created it open until it exits."""
+    if not SSH_MULTIPLEX:
+        return ""
+    return " " + " ".join(
+        [
+            # -oControlMaster=auto: Reuse an existing connection if one is available, or otherwise
+            #                       create a new one which later commands may reuse.
+            # -oControlMaster=no: Reuse an existing connection if one is available, or otherwise
+            #                     connect directly without sharing the connection.
+            "-oControlMaster={}".format("auto" if master else "no"),
+            # -oControlPath=<path>: Where the socket for the shared connection is located.
+            "-oControlPath={}".format(control_path),
+            # -oControlPersist=#: Close the shared connection after it's been idle for this long.
+            "-oControlPersist={}".format(SSH_CONTROL_PERSIST_SECONDS),
+        ]
+    )
+
+
+def _local_ssh_control_path() -> str:
+    global _ssh_control_dir
+    with _ssh_lock:
+        if _ssh_control_dir is None:
+            # Keep the directory name short: socket paths are limited to ~100 characters.
+            _ssh_control_dir = tempfile.mkdtemp(prefix="sdk-ssh-")
+            atexit.register(close_ssh_connections)
+        return os.path.join(_ssh_control_dir, "%r@%h:%p")
+
+
+class _SSHHostStats(object):
+    """Connection state and latency counters for a given SSH target host."""
+
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()  # held while (re)connecting to the host
+        self.last_used = 0.0
+        self.connect_count = 0
+        self.connect_seconds = 0.0
+        self.command_count = 0
+        self.command_seconds = 0.0
+
+    def is_connected(self, now):
+        # Shared connections are closed by ssh itself after being idle for ControlPersist seconds.
+        # Leave some margin so that we don't race against the connection being closed.
+        return self.last_used and now - self.last_used < SSH_CONTROL_PERSIST_SECONDS - 5
+
+    def summary(self):
+        return {
+            "connects": self.connect_count,
+            "connect_seconds": self.connect_seconds,
+            "commands": self.command_count,
+            "command_seconds": self.command_seconds,
+        }
+
+
+def _get_ssh_host_stats(host: str) -> _SSHHostStats:
+    with _ssh_lock:
+        stats = _ssh_host_stats.get(host)
+        if stats is None:
+            stats = _SSHHostStats(host)
+            _ssh_host_stats[host] = stats
+        return stats
+
+
+def _ensure_ssh_connection(host: str, timeout_seconds: int) -> float:
+    """Opens a shared connection to the provided host if one isn't already open.
+    Returns the time spent connecting, or zero if an existing connection was reused."""
+    if not SSH_MULTIPLEX:
+        return 0.0
+    stats = _get_ssh_host_stats(host)
+    with stats.lock:
+        if stats.is_connected(time.time()):
+            return 0.0
+        # Open the connection(s) by running a no-op command. Any subsequent commands will reuse it.
+        # The master process is detached from our pipes, see _ssh_control_args().
+        start = time.time()
+        try:
+            rc = subprocess.run(
+                [_ssh_command("true", host, timeout_seconds, master=True)],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                shell=True,
+                timeout=timeout_seconds,
+            ).returncode
+        except subprocess.TimeoutExpired:
+            rc = -1
+        connect_seconds = time.time() - start
+        if rc != 0:
+            # Leave it to the actual command to surface the error.
+            log.info("Failed to open shared SSH connection to {}: rc={}".format(host, rc))
+            return connect_seconds
+        stats.connect_count += 1
+        stats.connect_seconds += connect_seconds
+        stats.last_used = time.time()
+        return connect_seconds
+
+
+def _record_ssh_command(host: str, command_seconds: float) -> None:
+    stats = _get_ssh_host_stats(host)
+    with stats.lock:
+        stats.command_count += 1
+        stats.command_seconds += command_seconds
+        if SSH_MULTIPLEX and stats.last_used:
+            stats.last_used = time.time()
+
+
+def get_ssh_latency_summary() -> dict:
+    """Returns a breakdown of time spent connecting vs running commands, for each SSH host."""
+    with _ssh_lock:
+        return {host: stats.summary() for host, stats in _ssh_host_stats.items()}
+
+
+def close_ssh_connections() -> None:
+    """Closes any shared SSH connections which are held open on this machine, and logs a summary of
+    SSH latency per host. Connections are automatically reopened if needed by later commands."""
+    with _ssh_lock:
+        control_dir = _ssh_control_dir
+        all_stats = list(_ssh_host_stats.values())
+    for stats in all_stats:
+        log.info(
+            "SSH latency for {}: {} connects ({}), {} commands ({})".format(
+                stats.host,
+                stats.connect_count,
+                sdk_utils.pretty_duration(stats.connect_seconds),
+                stats.command_count,
+                sdk_utils.pretty_duration(stats.command_seconds),
+            )
+        )
+        stats.last_used = 0.0
+    if control_dir is None or not os.path.isdir(control_dir):
+        return
+    # Each socket is named "<user>@<host>:<port>", see _local_ssh_control_path().
+    for socket_name in os.listdir(control_dir):
+        _run_cmd(
+            "ssh -oControlPath={} -O exit {}".format(
+                os.path.join(control_dir, socket_name), socket_name.rpartition(":")[0]
+            ),
+            print_output=False,
+            check=False,
+            timeout_seconds=10,
+        )
+
+
 @functools.lru_cache()
 def _external_cluster_host():
     """Returns the internet-facing IP of the cluster frontend."""
@@ -439,30 +887,36 @@ def _internal_leader_host():
     return leader_hosts[0]["ip"]
 
 
-def marathon_task_exec(task_name: str, cmd: str, print_output=True) -> tuple:
+def marathon_task_exec(task_name: str, cmd: str, print_output=True, output_callback=None) -> tuple:
     """
-    Invokes the given command on the named Marathon task via `dcos task exec`.
+    Invokes the given command on the named Marathon task, see _task_exec().
     : param task_name: Name of task to run 'cmd' on.
     : param cmd: The command to execute.
+    : param output_callback: Optional function to be invoked with ("stdout"|"stderr", text) as
+                             output is produced by the command, e.g. for long-running commands.
     : return: a tuple consisting of the task exec's exit code, stdout, and stderr
-              NOTE: The exit code only is only for whether the task exec call itself succeeded,
-              NOT if the underlying command succeded! This is a side effect of how the CLI handles task exec.
-              To check for errors in underlying commands, check stderr.
+              NOTE: When the CLI is used, the exit code is only for whether the task exec call itself
+              succeeded, NOT if the underlying command succeded! This is a side effect of how the CLI
+              handles task exec. To check for errors in underlying commands, check stderr.
     """
     # Marathon TaskIDs are of the form "<name>.<uuid>"
-    return _task_exec(task_name, cmd, print_output=print_output)
+    return _task_exec(
+        task_name, cmd, print_output=print_output, output_callback=output_callback
+    )
 
 
-def service_task_exec(service_name: str, task_name: str, cmd: str) -> tuple:
+def service_task_exec(service_name: str, task_name: str, cmd: str, output_callback=None) -> tuple:
     """
-    Invokes the given command on the named SDK service task via `dcos task exec`.
+    Invokes the given command on the named SDK service task, see _task_exec().
     : param service_name: Name of the service running the task.
     : param task_name: Name of task to run 'cmd' on.
     : param cmd: The command to execute.
+    : param output_callback: Optional function to be invoked with ("stdout"|"stderr", text) as
+                             output is produced by the command, e.g. for long-running commands.
     : return: a tuple consisting of the task exec's exit code, stdout, and stderr
-              NOTE: The exit code only is only for whether the task exec call itself succeeded,
-              NOT if the underlying command succeded! This is a side effect of how the CLI handles task exec.
-              To check for errors in underlying commands, check stderr.
+              NOTE: When the CLI is used, the exit code is only for whether the task exec call itself
+              succeeded, NOT if the underlying command succeded! This is a side effect of how the CLI
+              handles task exec. To check for errors in underlying commands, check stderr.
     """
 
     # Contrary to CLI's help text for 'dcos task exec':
@@ -470,17 +924,23 @@ def service_task_exec(service_name: str, task_name: str, cmd: str) -> tuple:
     # - Regexes don't work at all.
     # Therefore, we need to provide a full TaskID prefix, including "servicename__taskname":
     task_id_prefix = "{}__{}__".format(sdk_utils.get_task_id_service_name(service_name), task_name)
-    rc, stdout, stderr = _task_exec(task_id_prefix, cmd)
+    rc, stdout, stderr = _task_exec(task_id_prefix, cmd, output_callback=output_callback)
 
     if "Cannot find a task with ID containing" in stderr:
         # If the service is doing an upgrade test, the old version may not use prefixed task ids.
         # Get around this by trying again without the service name prefix in the task id.
-        rc, stdout, stderr = _task_exec(task_name, cmd)
+        rc, stdout, stderr = _task_exec(task_name, cmd, output_callback=output_callback)
 
     return rc, stdout, stderr
 
 
-def _task_exec(task_id_prefix: str, cmd: str, print_output=True) -> tuple:
+def _task_exec(task_id_prefix: str, cmd: str, print_output=True, output_callback=None) -> tuple:
+    """Runs the provided command in the container of the task matching the provided TaskID prefix.
+
+    By default this talks to the Mesos agent directly, see _native_task_exec(). The `dcos task exec`
+    CLI is used on DC/OS 1.9 sandbox-relative commands, when DCOS_NATIVE_TASK_EXEC is disabled, or
+    when the agent API isn't available.
+    """
     if cmd.startswith("./") and sdk_utils.dcos_version_less_than("1.10"):
         # On 1.9 task exec is run relative to the host filesystem, not the container filesystem
         full_cmd = os.path.join(get_task_sandbox_path(task_id_prefix), cmd)
@@ -491,9 +951,175 @@ def _task_exec(task_id_prefix: str, cmd: str, print_output=True) -> tuple:
     else:
         full_cmd = cmd
 
+        if NATIVE_TASK_EXEC:
+            try:
+                return _native_task_exec(task_id_prefix, cmd, print_output, output_callback)
+            except _NativeTaskExecUnavailable as e:
+                log.info("Falling back to CLI for task exec: {}".format(e))
+
     return run_cli("task exec {} {}".format(task_id_prefix, cmd), print_output=print_output)
 
 
+class _NativeTaskExecUnavailable(Exception):
+    """The agent API can't be used for task exec, and the CLI should be used instead."""
+
+    pass
+
+
+def _native_task_exec(task_id_prefix: str, cmd: str, print_output, output_callback) -> tuple:
+    """Implements task exec against the Mesos agent operator API, via the pooled cluster session.
+
+    This is what the CLI does under the hood, minus the cost of starting a CLI process:
+    1. A nested container session is launched under the task's container. The response is a RecordIO
+       stream of ProcessIO messages containing the command's stdout/stderr.
+    2. Once the output stream ends, the nested container is waited on to get its exit status.
+
+    Like the CLI, the command is split into arguments locally and executed without a shell.
+    """
+    log.info("(EXEC) {} {}".format(task_id_prefix, cmd))
+
+    task, error = _find_task_for_exec(task_id_prefix)
+    if error:
+        # Match the CLI's error output, which some callers check for.
+        log.info("Task exec failed: {}".format(error))
+        return 1, "", error
+
+    agent_api_path = "/slave/{}/api/v1".format(task["slave_id"])
+    args = shlex.split(cmd)
+    container_id = {"parent": _get_task_container_id(task), "value": str(uuid.uuid4())}
+
+    response = cluster_request(
+        "POST",
+        agent_api_path,
+        retry=False,
+        raise_on_error=False,
+        log_args=False,
+        timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
+        stream=True,
+        headers={"Accept": "application/recordio", "Message-Accept": "application/json"},
+        json={
+            "type": "LAUNCH_NESTED_CONTAINER_SESSION",
+            "launch_nested_container_session": {
+                "container_id": container_id,
+                "command": {"shell": False, "value": args[0], "arguments": args},
+            },
+        },
+    )
+    if response.status_code in (401, 403, 404, 405, 501):
+        # Agent API is unavailable or we're not allowed to use it. Give the CLI a try.
+        response.close()
+        raise _NativeTaskExecUnavailable(
+            "Agent API returned {}: {}".format(response.status_code, response.reason)
+        )
+    if not response.ok:
+        return 1, "", "Failed to launch nested container session: {} {}".format(
+            response.status_code, response.text
+        )
+
+    output = {"stdout": bytearray(), "stderr": bytearray()}
+    decoders = {name: codecs.getincrementaldecoder("utf-8")("replace") for name in output}
+    for record in iter_recordio(response):
+        message = jsonlib.loads(record.decode("utf-8"))
+        if message.get("type") != "DATA":
+            continue  # e.g. CONTROL heartbeats
+        stream_name = message["data"]["type"].lower()  # "STDOUT" or "STDERR"
+        data = base64.b64decode(message["data"].get("data", ""))
+        output[stream_name] += data
+        if output_callback is not None:
+            text = decoders[stream_name].decode(data)
+            if text:
+                output_callback(stream_name, text)
+
+    wait_response = cluster_request(
+        "POST",
+        agent_api_path,
+        retry=False,
+        raise_on_error=False,
+        log_args=False,
+        timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
+        headers={"Accept": "application/json"},
+        json={
+            "type": "WAIT_NESTED_CONTAINER",
+            "wait_nested_container": {"container_id": container_id},
+        },
+    )
+    rc = 1
+    if wait_response.ok:
+        # This is a raw wait() status, which also says whether the command was killed by a signal.
+        exit_status = wait_response.json().get("wait_nested_container", {}).get("exit_status")
+        if exit_status is not None:
+            if os.WIFSIGNALED(exit_status):
+                rc = 128 + os.WTERMSIG(exit_status)
+            else:
+                rc = os.WEXITSTATUS(exit_status)
+
+    stdout = output["stdout"].decode("utf-8", "replace").strip()
+    stderr = output["stderr"].decode("utf-8", "replace").strip()
+    if rc != 0:
+        log.info("Got exit code {} to command: {}".format(rc, cmd))
+    if print_output:
+        if stdout:
+            log.info("STDOUT:\n{}".format(stdout))
+        if stderr:
+            log.info("STDERR:\n{}".format(stderr))
+    return rc, stdout, stderr
+
+
+def _find_task_for_exec(task_id_prefix: str) -> tuple:
+    """Returns the active task whose ID starts with the provided prefix, plus an error message
+    (matching what the CLI would have printed) if there wasn't exactly one match."""
+    frameworks = cluster_request("GET", "/mesos/frameworks").json()["frameworks"]
+    matches = [
+        task
+        for framework in frameworks
+        for task in framework["tasks"]
+        if task["id"].startswith(task_id_prefix)
+    ]
+    if len(matches) > 1:
+        # Prefer any running tasks, e.g. when an old instance of the task is still being killed.
+        running = [task for task in matches if task["state"] == "TASK_RUNNING"]
+        if running:
+            matches = running
+    if not matches:
+        return None, "Cannot find a task with ID containing '{}'".format(task_id_prefix)
+    if len(matches) > 1:
+        return (
+            None,
+            "There are multiple tasks with ID matching [{}]. Please choose one:\n{}".format(
+                task_id_prefix, "\n".join(sorted(task["id"] for task in matches))
+            ),
+        )
+    return matches[0], ""
+
+
+def _get_task_container_id(task: dict) -> dict:
+    """Returns the container ID of the provided task, as advertised in its most recent status."""
+    for status in sorted(task["statuses"], key=lambda s: s["timestamp"], reverse=True):
+        container_id = status.get("container_status", {}).get("container_id")
+        if container_id:
+            return container_id
+    raise _NativeTaskExecUnavailable("No container ID found for task {}".format(task["id"]))
+
+
+def iter_recordio(response: requests.Response):
+    """Yields each record, as bytes, from a streaming response in RecordIO format, as used by the
+    Mesos operator APIs. Each record is framed as '<length in bytes>\\n<record>'.
+    Records are yielded as soon as they have been fully received."""
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=None):
+        buf += chunk
+        while True:
+            newline = buf.find(b"\n")
+            if newline == -1:
+                break
+            record_end = newline + 1 + int(buf[:newline])
+            if len(buf) < record_end:
+                break
+            record = bytes(buf[newline + 1 : record_end])
+            del buf[:record_end]
+            yield record
+
+
 def resolve_hosts(marathon_task_name: str, hosts: list, bootstrap_cmd: str = "./bootstrap") -> bool:
     """
     Use bootstrap to resolve the specified list of hosts
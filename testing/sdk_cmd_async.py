@@ -0,0 +1,109 @@
+"""Asyncio counterparts to the HTTP helpers in sdk_cmd, for fanning out requests concurrently.
+
+The coroutines here run the blocking sdk_cmd functions on a bounded thread pool. Requests share the
+pooled cluster sessions from sdk_cmd.get_http_session(), so behavior (auth, retries, logging) is
+identical to the blocking API, which remains the primary interface. Callers can migrate individual
+hot paths, e.g.:
+
+    plans = sdk_cmd_async.run(
+        sdk_cmd_async.gather(
+            *[sdk_cmd_async.service_request("GET", name, "/v1/plans/deploy") for name in names]
+        )
+    )
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_cmd_async IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import threading
+
+import sdk_cmd
+
+log = logging.getLogger(__name__)
+
+# The default number of requests which may be in flight at once, across all callers.
+# This should not exceed sdk_cmd.HTTP_POOL_SIZE, or requests would open connections outside the pool.
+DEFAULT_CONCURRENCY = int(os.environ.get("DCOS_HTTP_CONCURRENCY", "16"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(DEFAULT_CONCURRENCY, sdk_cmd.HTTP_POOL_SIZE),
+                thread_name_prefix="sdk_cmd_async",
+            )
+        return _executor
+
+
+async def _run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def cluster_request(method, cluster_path, **kwargs):
+    """Coroutine version of sdk_cmd.cluster_request(), accepting the same arguments.
+    : rtype: requests.Response
+    """
+    return await _run_blocking(sdk_cmd.cluster_request, method, cluster_path, **kwargs)
+
+
+async def service_request(method, service_name, service_path, **kwargs):
+    """Coroutine version of sdk_cmd.service_request(), accepting the same arguments.
+    : rtype: requests.Response
+    """
+    return await _run_blocking(
+        sdk_cmd.service_request, method, service_name, service_path, **kwargs
+    )
+
+
+async def gather(*coros, concurrency=DEFAULT_CONCURRENCY, return_exceptions=False) -> list:
+    """Like asyncio.gather(), except that at most `concurrency` of the provided coroutines are
+    allowed to run at once. Results are returned in the same order as the provided coroutines.
+
+    : param concurrency: The maximum number of coroutines to run at the same time.
+    : param return_exceptions: Whether exceptions should be returned as results instead of raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(
+        *[_bounded(coro) for coro in coros], return_exceptions=return_exceptions
+    )
+
+
+async def map_blocking(fn, items, concurrency=DEFAULT_CONCURRENCY, return_exceptions=False) -> list:
+    """Invokes the blocking function `fn` against each of `items` on the shared thread pool, with at
+    most `concurrency` invocations at once. Useful for fanning out existing sdk_* helpers.
+    """
+    return await gather(
+        *[_run_blocking(fn, item) for item in items],
+        concurrency=concurrency,
+        return_exceptions=return_exceptions,
+    )
+
+
+def run(coro):
+    """Runs the provided coroutine to completion from blocking code, and returns its result.
+
+    Each call uses a fresh event loop, so this may be invoked from any thread which isn't already
+    running an event loop.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
@@ -0,0 +1,125 @@
+"""Client for the DC/OS package manager (Cosmos) HTTP API.
+
+This allows package and repository operations to be performed in-process via the pooled cluster
+session, instead of launching the CLI (which re-reads its config and re-authenticates every time).
+Callers in sdk_install, sdk_upgrade, and sdk_repository use this by default, and fall back to the
+equivalent CLI commands if a request fails for any reason. Set DCOS_PACKAGE_API_DIRECT=false to
+always use the CLI.
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_cosmos IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import logging
+import os
+
+import sdk_cmd
+
+log = logging.getLogger(__name__)
+
+# Whether sdk_* helpers should use this client, or go straight to the CLI.
+ENABLED = os.environ.get("DCOS_PACKAGE_API_DIRECT", "true").lower() in ["true", "1"]
+
+_MEDIA_TYPE = "application/vnd.dcos.package.{}+json;charset=utf-8;version={}"
+
+
+class CosmosException(Exception):
+    """A request to Cosmos was rejected. The error type (e.g. 'PackageNotFound') is in `type`."""
+
+    def __init__(self, action, response):
+        self.status_code = response.status_code
+        try:
+            content = response.json()
+            self.type = content.get("type", "")
+            self.message = content.get("message", response.text)
+        except ValueError:
+            self.type = ""
+            self.message = response.text
+        super().__init__(
+            "Cosmos {} failed with {}: {} {}".format(
+                action, self.status_code, self.type, self.message
+            )
+        )
+
+
+def install(package_name, package_version=None, options=None, app_id=None) -> dict:
+    """Installs the package's service (not its CLI). Returns e.g. {"appId": ..., ...}"""
+    request = {"packageName": package_name}
+    if package_version:
+        request["packageVersion"] = package_version
+    if options:
+        request["options"] = options
+    if app_id:
+        request["appId"] = app_id
+    return _cosmos_request("install", request, request_version="v1", response_version="v2")
+
+
+def uninstall(package_name, app_id=None, all_instances=False) -> dict:
+    request = {"packageName": package_name}
+    if app_id:
+        request["appId"] = app_id
+    if all_instances:
+        request["all"] = True
+    return _cosmos_request("uninstall", request)
+
+
+def describe(package_name, package_version=None) -> dict:
+    """Returns the package definition, equivalent to the output of 'dcos package describe'."""
+    request = {"packageName": package_name}
+    if package_version:
+        request["packageVersion"] = package_version
+    # v3 responses are returned by DC/OS 1.10+, while earlier versions only support v2.
+    return _cosmos_request("describe", request, response_version=["v3", "v2"])
+
+
+def list_versions(package_name) -> dict:
+    """Returns a mapping of package version => release version across all configured repos."""
+    return _cosmos_request(
+        "list-versions", {"packageName": package_name, "includePackageVersions": True}
+    )["results"]
+
+
+def list_repos() -> list:
+    """Returns the configured repositories in priority order, as [{"name": ..., "uri": ...}, ...]"""
+    return _cosmos_request("repository/list", {})["repositories"]
+
+
+def add_repo(name, uri, index=None) -> list:
+    """Adds a repository at the provided index, or at the end of the list if no index is provided.
+    Returns the updated list of repositories."""
+    request = {"name": name, "uri": uri}
+    if index is not None:
+        request["index"] = index
+    return _cosmos_request("repository/add", request)["repositories"]
+
+
+def remove_repo(name) -> list:
+    """Removes the named repository. Returns the updated list of repositories."""
+    return _cosmos_request("repository/delete", {"name": name})["repositories"]
+
+
+def _cosmos_request(action, request, request_version="v1", response_version="v1") -> dict:
+    # e.g. "repository/add" => "repository.add-request"
+    media_type_name = action.replace("/", ".")
+    if isinstance(response_version, str):
+        response_version = [response_version]
+    response = sdk_cmd.cluster_request(
+        "POST",
+        "/package/{}".format(action),
+        retry=False,
+        raise_on_error=False,
+        json=request,
+        headers={
+            "Content-Type": _MEDIA_TYPE.format(
+                "{}-request".format(media_type_name), request_version
+            ),
+            "Accept": ",".join(
+                _MEDIA_TYPE.format("{}-response".format(media_type_name), version)
+                for version in response_version
+            ),
+        },
+    )
+    if not response.ok:
+        raise CosmosException(action, response)
+    return response.json()
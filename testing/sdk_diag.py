@@ -6,28 +6,59 @@ SHOULD ALSO BE APPLIED TO sdk_diag IN ANY OTHER PARTNER REPOS
 """
 
 import collections
+import concurrent.futures
+import itertools
 import json
 import logging
 import os.path
 import re
 import shutil
+import tempfile
+import threading
 import time
 
 import pytest
 import retrying
 
+import sdk_artifacts
 import sdk_cmd
+import sdk_cmd_async
 import sdk_install
 import sdk_package_registry
 import sdk_plan
+import sdk_plan_timeline
 import sdk_tasks
+import sdk_utils
 
 log = logging.getLogger(__name__)
 
 
-# An arbitrary limit on the number of tasks that we fetch logs from following a failed test.
-# Ideally this should be scaled to the number of tasks that can be fetched within ~10min.
-_testlogs_task_id_limit = 250
+# Limits on the total bytes and time spent fetching task logs following a failed test.
+# Files are fetched in priority order (see _get_log_file_priority) until the budget is used up.
+# Files which don't fit in the budget are recorded as skipped in the artifact manifest.
+_log_fetch_byte_budget = int(
+    float(os.environ.get("DCOS_DIAG_BYTE_BUDGET_MIB", "1024")) * 1024 * 1024
+)
+_log_fetch_time_budget_seconds = int(os.environ.get("DCOS_DIAG_TIME_BUDGET", "600"))
+
+# Files larger than this are sampled: only the first and last halves of this size are fetched.
+_log_fetch_max_file_bytes = int(
+    float(os.environ.get("DCOS_DIAG_MAX_FILE_MIB", "64")) * 1024 * 1024
+)
+
+# The maximum number of log files to download at once, in total and from any one agent.
+_log_fetch_workers = int(os.environ.get("DCOS_DIAG_FETCH_WORKERS", "16"))
+_log_fetch_workers_per_agent = int(os.environ.get("DCOS_DIAG_FETCH_WORKERS_PER_AGENT", "4"))
+
+# The maximum time to spend downloading any one log file. Files are truncated at this point.
+_log_fetch_file_timeout_seconds = int(os.environ.get("DCOS_DIAG_FETCH_FILE_TIMEOUT", "120"))
+
+# Whether tasks whose logs were collected following an earlier failure in the suite should have
+# their new log output collected following later failures. See _testlogs_file_offsets.
+_testlogs_incremental = os.environ.get("DCOS_DIAG_INCREMENTAL", "true").lower() in ["true", "1"]
+
+# If non-zero, only the last N MiB of each log file is collected. Useful with very large logs.
+_testlogs_tail_bytes = int(float(os.environ.get("DCOS_DIAG_TAIL_MIB", "0")) * 1024 * 1024)
 
 # Keep track of task ids to collect logs at the correct times. Example scenario:
 # 1 Test suite test_sanity_py starts with 2 tasks to ignore: [test_placement-0, test_placement-1]
@@ -39,8 +70,9 @@ _testlogs_task_id_limit = 250
 # 5 test_sanity_py.restart_1 fails, with 1 new task: [pod-1-task-NEWUUID2]
 #   Upon failure, the following task logs should be collected: [pod-1-task-NEWUUID, pod-1-task-NEWUUID2]
 #   These are the tasks which were newly created following the prior failure.
-#   Previously-collected tasks are not collected again, even though they may have additional log content.
-#   In practice this is fine -- e.g. Scheduler would restart with a new task id if it was reconfigured anyway.
+#   Additionally, any log output which previously-collected tasks (e.g. test-scheduler) have written
+#   since the prior failure is collected, using the offsets in _testlogs_file_offsets.
+#   With DCOS_DIAG_INCREMENTAL=false, previously-collected tasks are not collected again.
 
 # The name of current test suite (e.g. 'test_sanity_py'), or an empty string if no test suite has
 # started yet. This is used to determine when the test suite has changed in a test run.
@@ -49,10 +81,26 @@ _testlogs_current_test_suite = ""
 # The list of all task ids to ignore when fetching task logs in future test failures:
 # - Task ids that already existed at the start of a test suite.
 #   (ignore tasks unrelated to this test suite)
-# - Task ids which have been logged following a prior failure in the current test suite.
+# - If incremental collection is disabled: Task ids which have been logged following a prior
+#   failure in the current test suite.
 #   (ignore task ids which were already collected before, even if there's new content)
 _testlogs_ignored_task_ids = set([])
 
+# (agent id, path on agent) => number of bytes of the file which have been collected so far in
+# the current test suite. Following a failure, only content past this offset is collected.
+_testlogs_file_offsets = {}
+_testlogs_file_offsets_lock = threading.Lock()
+
+# Where artifacts for the current test suite are written, see sdk_artifacts.
+_testlogs_artifact_sink = None
+
+# Whether the slower parts of post-failure collection should run in the background, concurrently
+# with subsequent tests. Pending collections are finished before a new suite starts, and before the
+# session ends.
+_testlogs_background = os.environ.get("DCOS_DIAG_BACKGROUND", "true").lower() in ["true", "1"]
+_collection_executor = None
+_pending_collections = []
+
 # The index of the current test, which increases as tests are run, and resets when a new test suite
 # is started. This is used to sort test logs in the order that they were executed, and is useful
 # when tracing a chain of failed tests.
@@ -78,38 +126,59 @@ def handle_test_setup(item: pytest.Item):
     test_suite = get_test_suite_name(item)
     if test_suite != _testlogs_current_test_suite:
         # New test suite:
+        # 0 Finish any background collection for the prior suite, which uses the state below.
+        _wait_for_background_collection()
         # 1 Store all the task ids which already exist as of this point.
         _testlogs_current_test_suite = test_suite
         global _testlogs_ignored_task_ids
         _testlogs_ignored_task_ids = _testlogs_ignored_task_ids.union(
-            [task.id for task in sdk_tasks.get_summary(with_completed=True)]
+            sdk_tasks.get_snapshot(with_completed=True).ids()
         )
         log.info(
             "Entering new test suite {}: {} preexisting tasks will be ignored on test failure.".format(
                 test_suite, len(_testlogs_ignored_task_ids)
             )
         )
+        _testlogs_file_offsets.clear()
         # 2 Reset the test index.
         _testlogs_test_index = 0
-        # 3 Remove any prior logs for the test suite.
-        test_log_dir = _test_suite_artifact_directory(item)
-        if os.path.exists(test_log_dir):
-            log.info("Deleting existing test suite logs: {}/".format(test_log_dir))
-            shutil.rmtree(test_log_dir)
+        # 3 Finish writing the prior suite's artifacts, and remove any prior logs for this suite.
+        _open_artifact_sink(item)
 
     # Increment the test index (to 1, if this is a new suite)
     _testlogs_test_index += 1
 
+    # Record plan timelines for this test alongside its other artifacts.
+    sdk_plan_timeline.set_output_dir(_test_artifact_directory(item))
+
+
+def handle_session_finish():
+    """Finishes writing any collected artifacts, e.g. the current suite's archive and manifest.
+
+    This should be called in a pytest_sessionfinish() hook."""
+    _wait_for_background_collection()
+    global _testlogs_artifact_sink
+    if _testlogs_artifact_sink is not None:
+        _testlogs_artifact_sink.close()
+        _testlogs_artifact_sink = None
+
 
 def handle_test_report(item: pytest.Item, result):  # _pytest.runner.TestReport
     """Collects information from the cluster following a failed test.
 
+    Time-sensitive state (plans, thread dumps, and the list of tasks) is collected immediately. The
+    slower collection of task logs, Mesos state, and the cluster diagnostics bundle is then queued
+    to run in the background while subsequent tests proceed, unless DCOS_DIAG_BACKGROUND=false.
+
     This should be called in a hookimpl fixture.
     See also handle_test_setup() which must be called in a pytest_runtest_setup() hook."""
 
     if not result.failed or os.environ.get('DISABLE_DIAG'):
         return  # passed, nothing to do, or diagnostics collection disabled
 
+    # Capture where this test's artifacts go now, before subsequent tests change it.
+    artifacts = _TestArtifacts(item)
+
     # Fetch all state from all currently-installed services.
     # We do this retrieval first in order to be closer to the actual test failure.
     # Services may still be installed when e.g. we're still in the middle of a test suite.
@@ -125,53 +194,154 @@ def handle_test_report(item: pytest.Item, result):  # _pytest.runner.TestReport
                 len(service_names), ", ".join(service_names)
             )
         )
-        for service_name in service_names:
+
+        def _dump_service_state(service_name):
             try:
                 # Skip thread retrieval if plan retrieval fails:
-                _dump_plans(item, service_name)
-                _dump_threads(item, service_name)
+                _dump_plans(artifacts, service_name)
+                _dump_threads(artifacts, service_name)
             except Exception:
                 log.exception("Plan/thread collection from service {} failed!".format(service_name))
 
-    # Fetch all logs from tasks created since the last failure, or since the start of the suite.
+        sdk_cmd_async.run(sdk_cmd_async.map_blocking(_dump_service_state, service_names))
+
+    # Fetch all new logs from tasks created since the start of the suite (or since the last failure,
+    # if incremental collection is disabled).
     global _testlogs_ignored_task_ids
-    new_task_ids = [
-        task.id
-        for task in sdk_tasks.get_summary(with_completed=True)
-        if task.id not in _testlogs_ignored_task_ids
-    ]
-    _testlogs_ignored_task_ids = _testlogs_ignored_task_ids.union(new_task_ids)
-    # Enforce limit on how many tasks we will fetch logs from, to avoid unbounded log fetching.
-    if len(new_task_ids) > _testlogs_task_id_limit:
-        log.warning(
-            "Truncating list of {} new tasks to size {} to avoid fetching logs forever: {}".format(
-                len(new_task_ids), _testlogs_task_id_limit, new_task_ids
-            )
-        )
-        del new_task_ids[_testlogs_task_id_limit:]
+    new_tasks = sdk_tasks.get_snapshot(with_completed=True).difference(_testlogs_ignored_task_ids)
+    new_task_ids = [task.id for task in new_tasks]
+    if not _testlogs_incremental:
+        _testlogs_ignored_task_ids = _testlogs_ignored_task_ids.union(new_task_ids)
+    tasks_by_agent = {}
     try:
         log.info(
-            "Fetching logs for {} tasks launched in this suite since last failure: {}".format(
-                len(new_task_ids), ", ".join(new_task_ids)
+            "Listing {}logs for {} tasks launched in this suite: {}".format(
+                "new " if _testlogs_incremental else "",
+                len(new_task_ids),
+                ", ".join(new_task_ids),
             )
         )
-        _dump_task_logs(item, new_task_ids)
+        tasks_by_agent = _get_tasks_by_agent(new_tasks)
+    except Exception:
+        log.exception("Task listing failed!")
+
+    if _testlogs_background:
+        _pending_collections.append(
+            _get_collection_executor().submit(_collect_slow_state, artifacts, tasks_by_agent)
+        )
+        log.info(
+            "Queued background collection of logs, mesos state, and diagnostics bundle for {} "
+            "({} pending)".format(artifacts.test_dir, len(_pending_collections))
+        )
+    else:
+        _collect_slow_state(artifacts, tasks_by_agent)
+
+
+class _TestArtifacts(object):
+    """Writes the artifacts for a test to the test suite's sink.
+
+    The destination is captured when this is created, so that artifacts which are collected in the
+    background still go to the right place after subsequent tests have started."""
+
+    def __init__(self, item: pytest.Item):
+        self.sink = _get_artifact_sink(item)
+        # e.g. "05__test_placement_rules"
+        self.test_dir = os.path.basename(_test_artifact_directory(item))
+
+    def name(self, artifact_name: str) -> str:
+        """Returns the name of the artifact relative to the test suite's sink."""
+        return os.path.join(self.test_dir, artifact_name)
+
+    def write(self, artifact_name: str, content):
+        """Writes the provided str or bytes content as an artifact for the test."""
+        artifact_name = self.name(artifact_name)
+        log.info("=> Writing {} ({} bytes)".format(self.sink.describe(artifact_name), len(content)))
+        self.sink.write(artifact_name, content)
+
+    def add_file(self, artifact_name: str, local_path: str):
+        """Moves the local file into the sink as an artifact for the test."""
+        artifact_name = self.name(artifact_name)
+        log.info("=> Writing {}".format(self.sink.describe(artifact_name)))
+        self.sink.add_file(artifact_name, local_path)
+
+
+def _test_artifact_directory(item: pytest.Item):
+    """Returns the directory for the artifacts of a test. The directory may not exist yet."""
+
+    # full item.listchain() is e.g.:
+    # - ['build', 'frameworks/template/tests/test_sanity.py', 'test_install']
+    # - ['build', 'tests/test_sanity.py', 'test_install']
+    # we want to turn both cases into: 'logs/test_sanity_py/test_install'
+    if _testlogs_test_index > 0:
+        # test_index is defined: get name like "05__test_placement_rules"
+        test_name = "{:02d}__{}".format(_testlogs_test_index, item.name)
+    else:
+        # test_index is not defined: fall back to just "test_placement_rules"
+        test_name = item.name
+
+    return os.path.join(_test_suite_artifact_directory(item), test_name)
+
+
+def _test_suite_artifact_directory(item: pytest.Item):
+    """Returns the parent directory for the artifacts across a suite of tests."""
+    return os.path.join("logs", get_test_suite_name(item))
+
+
+def _collect_slow_state(artifacts: _TestArtifacts, tasks_by_agent: dict):
+    """Collects task logs, Mesos state, and the cluster diagnostics bundle following a failure."""
+    start = time.time()
+    try:
+        _dump_task_logs(artifacts, tasks_by_agent)
     except Exception:
         log.exception("Task log collection failed!")
     try:
         log.info("Fetching mesos state:")
-        _dump_mesos_state(item)
+        _dump_mesos_state(artifacts)
     except Exception:
         log.exception("Mesos state collection failed!")
     try:
         log.info("Creating/fetching cluster diagnostics bundle:")
-        _dump_diagnostics_bundle(item)
+        _dump_diagnostics_bundle(artifacts)
     except Exception:
         log.exception("Diagnostics bundle creation failed")
-    log.info("Post-failure collection complete")
+    log.info(
+        "Post-failure collection for {} complete after {}".format(
+            artifacts.test_dir, sdk_utils.pretty_duration(time.time() - start)
+        )
+    )
+
+
+def _get_collection_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _collection_executor
+    if _collection_executor is None:
+        # A single worker: Collections run in the order of the failures, and don't compete with
+        # each other for the cluster (e.g. only one diagnostics bundle can be created at a time).
+        _collection_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sdk_diag_collect"
+        )
+    return _collection_executor
+
+
+def _wait_for_background_collection():
+    """Waits for any queued background collections to finish."""
+    if not _pending_collections:
+        return
+    log.info("Waiting for {} pending post-failure collections...".format(len(_pending_collections)))
+    start = time.time()
+    for future in _pending_collections:
+        try:
+            future.result()
+        except Exception:
+            log.exception("Background post-failure collection failed!")
+    del _pending_collections[:]
+    log.info(
+        "Pending post-failure collections finished after {}".format(
+            sdk_utils.pretty_duration(time.time() - start)
+        )
+    )
 
 
-def _dump_plans(item: pytest.Item, service_name: str):
+def _dump_plans(artifacts: _TestArtifacts, service_name: str):
     """If the test had failed, writes the plan state(s) to log file(s)."""
 
     # Use brief timeouts, we just want a best-effort attempt here:
@@ -179,28 +349,23 @@ def _dump_plans(item: pytest.Item, service_name: str):
     for plan_name in plan_names:
         plan = sdk_plan.get_plan(service_name, plan_name, 5)
         # Include service name in plan filename, but be careful about folders...
-        out_path = _setup_artifact_path(
-            item, "plan_{}_{}.json".format(service_name.replace("/", "_"), plan_name)
+        artifacts.write(
+            "plan_{}_{}.json".format(service_name.replace("/", "_"), plan_name),
+            json.dumps(plan, indent=2) + "\n",  # ... and a trailing newline
         )
-        out_content = json.dumps(plan, indent=2)
-        log.info("=> Writing {} ({} bytes)".format(out_path, len(out_content)))
-        with open(out_path, "w") as f:
-            f.write(out_content)
-            f.write("\n")  # ... and a trailing newline
 
 
-def _dump_threads(item: pytest.Item, service_name: str):
+def _dump_threads(artifacts: _TestArtifacts, service_name: str):
     threads = sdk_cmd.service_request(
         "GET", service_name, "v1/debug/threads", timeout_seconds=5
     ).text
-    out_path = _setup_artifact_path(item, "threads_{}.txt".format(service_name.replace("/", "_")))
-    log.info("=> Writing {} ({} bytes)".format(out_path, len(threads)))
-    with open(out_path, "w") as f:
-        f.write(threads)
-        f.write("\n")  # ... and a trailing newline
+    artifacts.write(
+        "threads_{}.txt".format(service_name.replace("/", "_")),
+        threads + "\n",  # ... and a trailing newline
+    )
 
 
-def _dump_diagnostics_bundle(item: pytest.Item):
+def _dump_diagnostics_bundle(artifacts: _TestArtifacts):
     """Creates and downloads a DC/OS diagnostics bundle, and saves it to the artifact path for this test."""
     rc, _, _ = sdk_cmd.run_cli("node diagnostics create all")
     if rc:
@@ -227,45 +392,73 @@ def _dump_diagnostics_bundle(item: pytest.Item):
 
     bundle_filename = wait_for_bundle_file()
     if bundle_filename:
-        sdk_cmd.run_cli(
-            "node diagnostics download {} --location={}".format(
-                bundle_filename, _setup_artifact_path(item, bundle_filename)
+        # The CLI needs a local path to download to, which we then move into the sink.
+        download_dir = tempfile.mkdtemp(prefix="sdk_diag_bundle_")
+        try:
+            download_path = os.path.join(download_dir, bundle_filename)
+            sdk_cmd.run_cli(
+                "node diagnostics download {} --location={}".format(bundle_filename, download_path)
             )
-        )
+            if os.path.exists(download_path):
+                artifacts.add_file(bundle_filename, download_path)
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
     else:
         log.error("Diagnostics bundle didnt finish in time, giving up.")
 
 
-def _dump_mesos_state(item: pytest.Item):
+def _dump_mesos_state(artifacts: _TestArtifacts):
     """Downloads state from the Mesos master and saves it to the artifact path for this test."""
     for name in ["state.json", "slaves"]:
         r = sdk_cmd.cluster_request("GET", "/mesos/{}".format(name), raise_on_error=False)
         if r.ok:
             if name.endswith(".json"):
                 name = name[: -len(".json")]  # avoid duplicate '.json'
-            with open(_setup_artifact_path(item, "mesos_{}.json".format(name)), "w") as f:
-                f.write(r.text)
+            artifacts.write("mesos_{}.json".format(name), r.content)
+
+
+def _get_tasks_by_agent(tasks: list) -> dict:
+    """Returns a mapping of agent id => [_TaskEntry, ...] for the provided sdk_tasks.Tasks.
+    Only the frameworks which launched the tasks are listed, rather than every task in the cluster."""
+    task_ids_by_framework = collections.defaultdict(set)
+    for task in tasks:
+        task_ids_by_framework[task.framework_id].add(task.id)
+    matching_tasks_by_agent = {}
+    for framework_id, task_ids in task_ids_by_framework.items():
+        for cluster_task in sdk_tasks.iter_cluster_tasks(framework_id=framework_id):
+            task_entry = _TaskEntry(cluster_task)
+            if task_entry.task_id in task_ids:
+                agent_tasks = matching_tasks_by_agent.get(task_entry.agent_id, [])
+                agent_tasks.append(task_entry)
+                matching_tasks_by_agent[task_entry.agent_id] = agent_tasks
+    return matching_tasks_by_agent
 
 
-def _dump_task_logs(item: pytest.Item, task_ids: list):
+def _dump_task_logs(artifacts: _TestArtifacts, tasks_by_agent: dict):
     """
-    For all of the provided tasks, downloads their task, executor, and agent logs to the artifact path for this test.
+    For all of the provided tasks (agent id => [_TaskEntry, ...]), downloads their task, executor,
+    and agent logs to the artifact path for this test.
+
+    This is done in three passes: First, the candidate log files and their sizes are listed across
+    all agents. Then the files to fetch are picked in priority order within the byte budget, with
+    oversized files sampled. Finally the files are downloaded using a pool of workers, with at most
+    _log_fetch_workers downloads in flight overall, and at most _log_fetch_workers_per_agent
+    downloads from any one agent, until the time budget runs out.
     """
-    task_ids_set = set(task_ids)
-    cluster_tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks").json()
-    matching_tasks_by_agent = {}
-    for cluster_task in cluster_tasks["tasks"]:
-        task_entry = _TaskEntry(cluster_task)
-        if task_entry.task_id in task_ids_set:
-            agent_tasks = matching_tasks_by_agent.get(task_entry.agent_id, [])
-            agent_tasks.append(task_entry)
-            matching_tasks_by_agent[task_entry.agent_id] = agent_tasks
-
-    for agent_id, agent_tasks in matching_tasks_by_agent.items():
+
+    def _list_agent(agent_id):
         try:
-            _dump_task_logs_for_agent(item, agent_id, agent_tasks)
+            return _list_log_files_for_agent(artifacts, agent_id, tasks_by_agent[agent_id])
         except Exception:
             log.exception("Failed to get logs for agent {}".format(agent_id))
+            return []
+
+    agent_log_files = sdk_cmd_async.run(
+        sdk_cmd_async.map_blocking(
+            _list_agent, list(tasks_by_agent.keys()), concurrency=_log_fetch_workers
+        )
+    )
+    _fetch_log_files(artifacts.sink, _schedule_log_files(artifacts.sink, agent_log_files))
 
 
 class _TaskEntry(object):
@@ -273,6 +466,11 @@ class _TaskEntry(object):
         self.task_id = cluster_task["id"]
         self.executor_id = cluster_task["executor_id"]
         self.agent_id = cluster_task["slave_id"]
+        self.state = cluster_task.get("state", "")
+        # Time of the latest status update, used to favor recently failed tasks.
+        self.updated = max(
+            [status.get("timestamp", 0) for status in cluster_task.get("statuses", [])] or [0]
+        )
 
     def __repr__(self):
         return "Task[task_id={} executor_id={} agent_id={}]".format(
@@ -280,47 +478,251 @@ class _TaskEntry(object):
         )
 
 
-def _dump_task_logs_for_agent(item: pytest.Item, agent_id: str, agent_tasks: list):
+class _LogFile(object):
+    """A file, or a range of bytes within a file, to be downloaded from an agent sandbox."""
+
+    __slots__ = (
+        "agent_id",
+        "path",
+        "size",
+        "offset",
+        "length",
+        "base_name",
+        "artifact_name",
+        "source",
+    )
+
+    def __init__(
+        self,
+        agent_id: str,
+        path: str,
+        size: int,
+        artifact_name: str,
+        source,
+        offset: int = None,
+        length: int = None,
+    ):
+        self.agent_id = agent_id
+        self.path = path  # path on the agent, as returned by files/browse
+        self.size = size  # expected size in bytes, or None if unknown
+        self.source = source  # the _TaskEntry which the file belongs to, or None for the agent log
+        self.base_name = artifact_name  # artifact name for the whole file
+
+        if offset is None:
+            # Start where the last collection of this file left off, or at the tail if configured.
+            with _testlogs_file_offsets_lock:
+                offset = _testlogs_file_offsets.get((agent_id, path), 0)
+                if size is not None and offset > size:
+                    # The file was rotated or truncated since it was collected: Start over.
+                    offset = 0
+                    _testlogs_file_offsets.pop((agent_id, path), None)
+            if _testlogs_tail_bytes and size is not None:
+                offset = max(offset, size - _testlogs_tail_bytes)
+        self.offset = offset
+        self.length = length  # the maximum number of bytes to fetch, or None for all of them
+
+        # e.g. "[...].stdout.log" => "[...].stdout.from_12345.log" or "[...].stdout.from_0_to_100.log"
+        root, ext = os.path.splitext(artifact_name)
+        if length is not None:
+            artifact_name = "{}.from_{}_to_{}{}".format(root, offset, offset + length, ext)
+        elif offset:
+            artifact_name = "{}.from_{}{}".format(root, offset, ext)
+        self.artifact_name = artifact_name
+
+    def segment(self, offset: int, length: int):
+        """Returns a _LogFile for a range of bytes within this file."""
+        return _LogFile(
+            self.agent_id, self.path, self.size, self.base_name, self.source, offset, length
+        )
+
+    def expected_bytes(self) -> int:
+        """Returns the number of bytes which are expected to be fetched, or None if unknown."""
+        if self.size is None:
+            return self.length
+        remaining = max(self.size - self.offset, 0)
+        return remaining if self.length is None else min(remaining, self.length)
+
+    def is_collected(self) -> bool:
+        """Returns whether everything in the file has already been collected."""
+        return self.size is not None and self.offset >= self.size
+
+    def __repr__(self):
+        return "{}:{}".format(self.agent_id, self.path)
+
+
+# A parsed executor sandbox path from an agent's files/debug listing, see AgentSandboxIndex.
+SandboxPath = collections.namedtuple(
+    "SandboxPath", ["layout", "framework_id", "executor_id", "run", "browse_path"]
+)
+
+
+class AgentSandboxIndex(object):
+    """Maps executor ids to their sandbox directories on an agent, as listed by files/debug.
+
+    The index is built once per files/debug response, after which lookups by executor or task id
+    don't depend on the number of (possibly thousands of) executors which have run on the agent.
+
+    Mesos has changed its schema for executor directories with each DC/OS release:
+    - 1.9: There are only '/var/lib/mesos/...' paths. There are no '/runs/latest' paths, only '/runs/<UUID>'.
+    - 1.10: There are only '/var/lib/mesos/...' paths, but '/runs/latest' paths are available in addition to
+                           '/runs/<UUID>'.
+    - 1.11: There are both '/frameworks/...' paths and '/var/lib/mesos/...' paths. Both have '/runs/latest' as well as
+                           '/runs/<UUID>'.
+    (and Mesos folks tell me that '/frameworks/...' is the way forward, so '/var/lib/mesos/...' may be going away)
+    SEE ALSO: https://issues.apache.org/jira/browse/MESOS-7899
+
+    So when an executor has several paths, they're used in order of preference:
+    1. (1.11) '/frameworks/.../executors/<executor_id>/runs/latest'
+       Metronome: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0000/executors/test_cassandra_delete-data-retry_20180125024336zu3iM.8a893b4a-0179-11e8-ba9e-ee0228673934/runs/latest
+       Marathon: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0001/executors/test_integration_cassandra.57705baf-0176-11e8-94e4-ee0228673934/runs/latest
+       Default Executor: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0002/executors/node__bfa9751b-b7c4-45ae-b6d3-efdb9f851ca7/runs/latest
+                         (executor logs here. tasks are then under .../tasks/<task_id>/)
+    2. (1.10) '/var/lib/mesos/.../executors/<executor_id>/runs/latest'
+       Marathon: /var/lib/mesos/slave/slaves/6354b62c-7200-4458-8d7d-0dd11b281743-S1/frameworks/6354b62c-7200-4458-8d7d-0dd11b281743-0001/executors/hello-world.a80b075e-02d3-11e8-aceb-e2e215e145ce/runs/latest
+       Default Executor: /var/lib/mesos/slave/slaves/6354b62c-7200-4458-8d7d-0dd11b281743-S1/frameworks/6354b62c-7200-4458-8d7d-0dd11b281743-0002/executors/hello__090b3ef4-27c3-44c7-a39a-bad65620b982/runs/latest
+                         (executor logs here. tasks are then under .../tasks/<task_id>/)
+    3. (1.9) '/var/lib/mesos/.../executors/<executor_id>/runs/<some_uuid>'
+       Marathon: /var/lib/mesos/slave/slaves/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-S2/frameworks/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-0000/executors/hello-world.bb47e080-02c6-11e8-88f6-760584c8e399/runs/f8de4bc4-620b-4687-a032-3e34c378708f
+       Custom Executor: /var/lib/mesos/slave/slaves/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-S2/frameworks/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-0002/executors/hello__22a1ee97-23cf-407f-a1d1-7d6a0e325774/runs/5b6831b0-a9b1-482e-8595-8f800c32bdf6
+                        (tasks share stdout/stderr with the executor)
+    """
+
+    # e.g. '[/var/lib/mesos/slave/slaves/<agent_id>]/frameworks/<fw>/executors/<executor>/runs/<run>'
+    _PATH_PATTERN = re.compile(
+        r"^(?P<prefix>.*?)/frameworks/(?P<framework_id>[^/]+)"
+        r"/executors/(?P<executor_id>[^/]+)/runs/(?P<run>[^/]+)$"
+    )
+    _RUN_UUID_PATTERN = re.compile(r"^[a-f0-9-]+$")
+
+    def __init__(self, agent_executor_paths):
+        """Builds the index from the agent's files/debug response (a mapping of browse path => host
+        path), or any other iterable of browse paths."""
+        self.browse_paths = sorted(agent_executor_paths)
+        self.sandbox_paths = []
+        self._by_executor_id = {}  # executor id => (preference, SandboxPath)
+        for browse_path in agent_executor_paths:
+            sandbox_path = self._parse(browse_path)
+            if sandbox_path is None:
+                continue
+            self.sandbox_paths.append(sandbox_path)
+            preference = self._get_preference(sandbox_path)
+            if preference is None:
+                continue
+            existing = self._by_executor_id.get(sandbox_path.executor_id)
+            # On a tie, keep the first path listed by the agent.
+            if existing is None or preference < existing[0]:
+                self._by_executor_id[sandbox_path.executor_id] = (preference, sandbox_path)
+
+    @classmethod
+    def _parse(cls, browse_path: str):
+        match = cls._PATH_PATTERN.match(browse_path)
+        if not match:
+            return None
+        prefix = match.group("prefix")
+        if not prefix:
+            layout = "frameworks"
+        elif prefix.startswith("/var/lib/mesos/"):
+            layout = "varlib"
+        else:
+            return None
+        return SandboxPath(
+            layout,
+            match.group("framework_id"),
+            match.group("executor_id"),
+            match.group("run"),
+            browse_path,
+        )
+
+    @classmethod
+    def _get_preference(cls, sandbox_path: SandboxPath):
+        """Returns the rank of the path in the order of preference (lower is better), or None if the
+        path shouldn't be used."""
+        if sandbox_path.run == "latest":
+            return 0 if sandbox_path.layout == "frameworks" else 1
+        if sandbox_path.layout == "varlib" and cls._RUN_UUID_PATTERN.match(sandbox_path.run):
+            return 2
+        return None
+
+    def get_executor_path(self, executor_id: str) -> str:
+        """Returns the preferred sandbox directory for the executor, or an empty string if none."""
+        entry = self._by_executor_id.get(executor_id)
+        return entry[1].browse_path if entry else ""
+
+    def get_task_executor_path(self, task_id: str, executor_id: str = "") -> str:
+        """Returns the preferred executor sandbox directory for the task, or an empty string if none.
+
+        There are differences depending on the task/executor type:
+        - Marathon/Metronome: The task id is used as the 'executor id'. Logs are at the advertised directory.
+        - Custom executor: 'executor id' + 'task id' are both used. Executor+Task logs are all combined into the same
+                           file(s) at the advertised directory.
+        - Default executor: 'executor id' + 'task id' are both used. Executor logs are at the advertised directory,
+                            while task logs are under 'tasks/<task_id>/' relative to the advertised directory.
+        """
+        # When executor_id is empty (as in Marathon/Metronome tasks), we use the task_id:
+        return self.get_executor_path(executor_id if executor_id else task_id)
+
+
+def _list_log_files_for_agent(
+    artifacts: _TestArtifacts, agent_id: str, agent_tasks: list
+) -> list:
+    """Returns a list of _LogFiles to be fetched for the provided tasks on an agent."""
     agent_executor_paths = sdk_cmd.cluster_request(
         "GET", "/slave/{}/files/debug".format(agent_id)
     ).json()
-    task_byte_count = 0
+    sandbox_index = AgentSandboxIndex(agent_executor_paths)
+    log_files = []
     for task_entry in agent_tasks:
         try:
-            task_byte_count += _dump_task_logs_for_task(
-                item, agent_id, agent_executor_paths, task_entry
-            )
+            log_files += _list_log_files_for_task(artifacts, agent_id, sandbox_index, task_entry)
         except Exception:
             log.exception("Failed to get logs for task {}".format(task_entry))
-    log.info(
-        "Downloaded {} bytes of logs from {} tasks on agent {}".format(
-            task_byte_count, len(agent_tasks), agent_id
-        )
-    )
 
     # fetch agent log separately due to its totally different fetch semantics vs the task/executor logs
     if "/slave/log" in agent_executor_paths:
-        out_path = _setup_artifact_path(item, "agent_{}.log".format(agent_id))
-        stream = sdk_cmd.cluster_request(
-            "GET", "/slave/{}/files/download?path=/slave/log".format(agent_id), stream=True
+        log_files.append(
+            _LogFile(
+                agent_id,
+                "/slave/log",
+                _get_agent_log_size(agent_id),
+                artifacts.name("agent_{}.log".format(agent_id)),
+                None,
+            )
         )
-        with open(out_path, "wb") as f:
-            for chunk in stream.iter_content(chunk_size=8192):
-                f.write(chunk)
+    return log_files
 
 
-def _dump_task_logs_for_task(
-    item: pytest.Item, agent_id: str, agent_executor_paths: dict, task_entry: _TaskEntry
-) -> int:
-    executor_browse_path = _find_matching_executor_path(agent_executor_paths, task_entry)
+def _get_agent_log_size(agent_id: str):
+    """Returns the size of the agent's own log, which isn't listed by files/browse, or None if
+    unknown. A files/read with an offset of -1 returns the file size as the offset."""
+    try:
+        return sdk_cmd.cluster_request(
+            "GET",
+            "/slave/{}/files/read".format(agent_id),
+            params={"path": "/slave/log", "offset": -1},
+            retry=False,
+        ).json()["offset"]
+    except Exception as e:
+        log.info("Failed to get size of agent {} log: {}".format(agent_id, e))
+        return None
+
+
+def _list_log_files_for_task(
+    artifacts: _TestArtifacts,
+    agent_id: str,
+    sandbox_index: AgentSandboxIndex,
+    task_entry: _TaskEntry,
+) -> list:
+    executor_browse_path = sandbox_index.get_task_executor_path(
+        task_entry.task_id, task_entry.executor_id
+    )
     if not executor_browse_path:
         # Expected executor path was not found on this agent. Did Mesos move their files around again?
         log.warning(
             "Unable to find any paths matching task {} in agent {}:\n  {}".format(
-                task_entry, agent_id, "\n  ".join(sorted(agent_executor_paths.keys()))
+                task_entry, agent_id, "\n  ".join(sandbox_index.browse_paths)
             )
         )
-        return 0
+        return []
 
     # Fetch paths under the executor.
     executor_file_infos = sdk_cmd.cluster_request(
@@ -348,111 +750,271 @@ def _dump_task_logs_for_task(
     if task_file_infos:
         # Include 'task' and 'executor' annotations in filenames to differentiate between them:
         _select_log_files(
-            item, task_entry.task_id, executor_file_infos, "executor.", selected_file_infos
+            artifacts, task_entry.task_id, executor_file_infos, "executor.", selected_file_infos
+        )
+        _select_log_files(
+            artifacts, task_entry.task_id, task_file_infos, "task.", selected_file_infos
         )
-        _select_log_files(item, task_entry.task_id, task_file_infos, "task.", selected_file_infos)
     else:
         # No annotation needed:
-        _select_log_files(item, task_entry.task_id, executor_file_infos, "", selected_file_infos)
+        _select_log_files(
+            artifacts, task_entry.task_id, executor_file_infos, "", selected_file_infos
+        )
     if not selected_file_infos:
         log.warning(
             "Unable to find any stdout/stderr files in above paths for task {}".format(task_entry)
         )
-        return 0
+        return []
 
     byte_count = sum([f["size"] for f in selected_file_infos.values()])
     log.info(
-        "Downloading {} files ({} bytes) for task {}:{}".format(
+        "Found {} files ({} bytes) for task {}:{}".format(
             len(selected_file_infos),
             byte_count,
             task_entry,
             "".join(
                 [
                     "\n  {} ({} bytes)\n    => {}".format(
-                        file_info["path"], file_info["size"], path
+                        file_info["path"], file_info["size"], artifact_name
                     )
-                    for path, file_info in selected_file_infos.items()
+                    for artifact_name, file_info in selected_file_infos.items()
                 ]
             ),
         )
     )
-
-    # Fetch files
-    for out_path, file_info in selected_file_infos.items():
-        try:
-            stream = sdk_cmd.cluster_request(
-                "GET",
-                "/slave/{}/files/download?path={}".format(agent_id, file_info["path"]),
-                stream=True,
-            )
-            with open(out_path, "wb") as f:
-                for chunk in stream.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        except Exception:
-            log.exception("Failed to get file for task {}: {}".format(task_entry, file_info))
-    return byte_count
+    log_files = [
+        _LogFile(agent_id, file_info["path"], file_info["size"], artifact_name, task_entry)
+        for artifact_name, file_info in selected_file_infos.items()
+    ]
+    return [log_file for log_file in log_files if not log_file.is_collected()]
 
 
-def _find_matching_executor_path(agent_executor_paths: dict, task_entry: _TaskEntry) -> str:
-    """Finds and returns the executor directory for the provided task on the agent.
+_FAILED_TASK_STATES = frozenset(
+    ["TASK_FAILED", "TASK_ERROR", "TASK_LOST", "TASK_DROPPED", "TASK_GONE", "TASK_UNREACHABLE"]
+)
 
-    Mesos has changed its schema for executor directories with each DC/OS release:
-    - 1.9: There are only '/var/lib/mesos/...' paths. There are no '/runs/latest' paths, only '/runs/<UUID>'.
-    - 1.10: There are only '/var/lib/mesos/...' paths, but '/runs/latest' paths are available in addition to
-                           '/runs/<UUID>'.
-    - 1.11: There are both '/frameworks/...' paths and '/var/lib/mesos/...' paths. Both have '/runs/latest' as well as
-                           '/runs/<UUID>'.
-    (and Mesos folks tell me that '/frameworks/...' is the way forward, so '/var/lib/mesos/...' may be going away)
-    SEE ALSO: https://issues.apache.org/jira/browse/MESOS-7899
 
-    Additionally, given the correct path, there are also differences depending on the task/executor type:
-    - Marathon/Metronome: The task id is used as the 'executor id'. Logs are at the advertised directory.
-    - Custom executor: 'executor id' + 'task id' are both used. Executor+Task logs are all combined into the same
-                       file(s) at the advertised directory.
-    - Default executor: 'executor id' + 'task id' are both used. Executor logs are at the advertised directory,
-                        while task logs are under 'tasks/<task_id>/' relative to the advertised directory.
+def _get_log_file_priority(log_file: _LogFile) -> tuple:
+    """Returns a sort key for the order in which log files should be fetched, highest priority first:
+    - Tasks launched by Marathon/Metronome (e.g. service schedulers), then failed tasks, then all
+      other tasks, then agent logs. Within each group, recently updated tasks come first.
+    - Within a task, stderr before stdout, and current files before rotated ones (e.g. 'stdout.1').
     """
+    task_entry = log_file.source
+    if task_entry is None:
+        group, updated = 3, 0
+    elif not task_entry.executor_id:
+        group, updated = 0, task_entry.updated
+    elif task_entry.state in _FAILED_TASK_STATES:
+        group, updated = 1, task_entry.updated
+    else:
+        group, updated = 2, task_entry.updated
+    filename = os.path.basename(log_file.path)
+    return (
+        group,
+        -updated,
+        task_entry.task_id if task_entry else log_file.agent_id,
+        not filename.startswith("stderr"),
+        filename not in ("stdout", "stderr"),
+        filename,
+    )
 
-    # When executor_id is empty (as in Marathon/Metronome tasks), we use the task_id:
-    path_id = task_entry.executor_id if task_entry.executor_id else task_entry.task_id
 
-    # - 1.11: '/frameworks/.../executors/<executor_id>/runs/latest'
-    # Metronome: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0000/executors/test_cassandra_delete-data-retry_20180125024336zu3iM.8a893b4a-0179-11e8-ba9e-ee0228673934/runs/latest
-    # Marathon: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0001/executors/test_integration_cassandra.57705baf-0176-11e8-94e4-ee0228673934/runs/latest
-    # Default Executor: /frameworks/a31a2d3d-76a2-4d4b-82a3-a7e70e02c69c-0002/executors/node__bfa9751b-b7c4-45ae-b6d3-efdb9f851ca7/runs/latest
-    #                   (executor logs here. tasks are then under .../tasks/<task_id>/)
-    frameworks_latest_pattern = re.compile(
-        "^/frameworks/.*/executors/{}/runs/latest$".format(path_id)
+def _schedule_log_files(sink: sdk_artifacts.ArtifactSink, agent_log_files: list) -> list:
+    """Given lists of candidate _LogFiles (one list per agent), returns the _LogFiles to be fetched
+    in priority order, with a total expected size within _log_fetch_byte_budget. Files larger than
+    _log_fetch_max_file_bytes are replaced by segments from their head and tail. Files which are
+    skipped or sampled are recorded in the sink's manifest."""
+    candidates = sorted(
+        [log_file for agent_files in agent_log_files for log_file in agent_files],
+        key=_get_log_file_priority,
     )
-    for browse_path in agent_executor_paths.keys():
-        if frameworks_latest_pattern.match(browse_path):
-            return browse_path
-    # - 1.10: '/var/lib/mesos/.../executors/<executor_id>/runs/latest'
-    # Marathon: /var/lib/mesos/slave/slaves/6354b62c-7200-4458-8d7d-0dd11b281743-S1/frameworks/6354b62c-7200-4458-8d7d-0dd11b281743-0001/executors/hello-world.a80b075e-02d3-11e8-aceb-e2e215e145ce/runs/latest
-    # Default Executor: /var/lib/mesos/slave/slaves/6354b62c-7200-4458-8d7d-0dd11b281743-S1/frameworks/6354b62c-7200-4458-8d7d-0dd11b281743-0002/executors/hello__090b3ef4-27c3-44c7-a39a-bad65620b982/runs/latest
-    #                   (executor logs here. tasks are then under .../tasks/<task_id>/)
-    varlib_latest_pattern = re.compile(
-        "^/var/lib/mesos/.*/executors/{}/runs/latest$".format(path_id)
+    half_max_bytes = _log_fetch_max_file_bytes // 2
+    remaining_bytes = _log_fetch_byte_budget
+    scheduled = []
+    skipped_count = 0
+    skipped_bytes = 0
+    sampled_count = 0
+    for log_file in candidates:
+        expected_bytes = log_file.expected_bytes()
+        if expected_bytes is None:
+            # Unknown size: fetch up to the limit from the current offset.
+            segments = [log_file.segment(log_file.offset, _log_fetch_max_file_bytes)]
+        elif expected_bytes > _log_fetch_max_file_bytes:
+            segments = [
+                log_file.segment(log_file.offset, half_max_bytes),
+                log_file.segment(log_file.size - half_max_bytes, half_max_bytes),
+            ]
+        else:
+            segments = [log_file]
+        cost = sum(segment.expected_bytes() for segment in segments)
+        if cost > remaining_bytes:
+            skipped_count += 1
+            skipped_bytes += expected_bytes or 0
+            sink.record_skipped(log_file.base_name, "byte budget", log_file.size)
+            continue
+        if len(segments) > 1:
+            sampled_count += 1
+            sink.record_skipped(
+                log_file.base_name,
+                "sampled first and last {} bytes from offset {}".format(
+                    half_max_bytes, log_file.offset
+                ),
+                log_file.size,
+            )
+        remaining_bytes -= cost
+        scheduled += segments
+    log.info(
+        "Scheduled {} log files ({} of {} byte budget): {} sampled, {} skipped ({} bytes)".format(
+            len(candidates) - skipped_count,
+            _log_fetch_byte_budget - remaining_bytes,
+            _log_fetch_byte_budget,
+            sampled_count,
+            skipped_count,
+            skipped_bytes,
+        )
     )
-    for browse_path in agent_executor_paths.keys():
-        if varlib_latest_pattern.match(browse_path):
-            return browse_path
-    # - 1.9: '/var/lib/mesos/.../executors/<executor_id>/runs/<some_uuid>'
-    # Marathon: /var/lib/mesos/slave/slaves/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-S2/frameworks/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-0000/executors/hello-world.bb47e080-02c6-11e8-88f6-760584c8e399/runs/f8de4bc4-620b-4687-a032-3e34c378708f
-    # Custom Executor: /var/lib/mesos/slave/slaves/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-S2/frameworks/b9bbd073-4f4f-4a4d-bdee-68021b7a4c1e-0002/executors/hello__22a1ee97-23cf-407f-a1d1-7d6a0e325774/runs/5b6831b0-a9b1-482e-8595-8f800c32bdf6
-    #                  (tasks share stdout/stderr with the executor)
-    varlib_uuid_pattern = re.compile(
-        "^/var/lib/mesos/.*/executors/{}/runs/[a-f0-9-]+$".format(path_id)
+    return scheduled
+
+
+def _fetch_log_files(sink: sdk_artifacts.ArtifactSink, log_files: list):
+    """Downloads the provided _LogFiles into the sink using a pool of workers, starting with the
+    first files in the list, until _log_fetch_time_budget_seconds have passed."""
+    if not log_files:
+        return
+    agent_log_files = collections.OrderedDict()
+    for log_file in log_files:
+        agent_log_files.setdefault(log_file.agent_id, []).append(log_file)
+    # Interleave the agents' files, so that workers aren't all waiting on the same agent's limit.
+    # Each agent's files are still fetched in priority order.
+    log_files = [
+        log_file
+        for agent_files in itertools.zip_longest(*agent_log_files.values())
+        for log_file in agent_files
+        if log_file is not None
+    ]
+    agent_semaphores = {
+        agent_id: threading.BoundedSemaphore(_log_fetch_workers_per_agent)
+        for agent_id in agent_log_files
+    }
+    budget_deadline = time.time() + _log_fetch_time_budget_seconds
+
+    def _fetch(log_file):
+        with agent_semaphores[log_file.agent_id]:
+            if time.time() > budget_deadline:
+                sink.record_skipped(log_file.artifact_name, "time budget", log_file.size)
+                return 0
+            deadline = min(time.time() + _log_fetch_file_timeout_seconds, budget_deadline)
+            try:
+                with sink.open(log_file.artifact_name) as f:
+                    if log_file.offset:
+                        byte_count = _read_log_file(log_file, f, deadline)
+                    else:
+                        byte_count = _download_log_file(log_file, f, deadline)
+            except Exception:
+                log.exception("Failed to get file {}".format(log_file))
+                return 0
+        with _testlogs_file_offsets_lock:
+            key = (log_file.agent_id, log_file.path)
+            _testlogs_file_offsets[key] = max(
+                _testlogs_file_offsets.get(key, 0), log_file.offset + byte_count
+            )
+        return byte_count
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=_log_fetch_workers, thread_name_prefix="sdk_diag_fetch"
+    ) as executor:
+        byte_count = sum(executor.map(_fetch, log_files))
+    duration = time.time() - start
+    log.info(
+        "Downloaded {} bytes in {} files from {} agents in {} ({:.2f} MB/s)".format(
+            byte_count,
+            len(log_files),
+            len(agent_semaphores),
+            sdk_utils.pretty_duration(duration),
+            byte_count / max(duration, 0.001) / 1024 / 1024,
+        )
     )
-    for browse_path in agent_executor_paths.keys():
-        if varlib_uuid_pattern.match(browse_path):
-            return browse_path
 
-    return ""
+
+def _download_log_file(log_file: _LogFile, f, deadline: float) -> int:
+    """Downloads a file from an agent into f, stopping at the deadline or after the expected number
+    of bytes, so that content appended since the file was listed doesn't exceed the byte budget.
+    Returns the number of bytes written."""
+    expected_bytes = log_file.expected_bytes()
+    stream = sdk_cmd.cluster_request(
+        "GET",
+        "/slave/{}/files/download".format(log_file.agent_id),
+        params={"path": log_file.path},
+        stream=True,
+        timeout_seconds=_log_fetch_file_timeout_seconds,
+    )
+    byte_count = 0
+    try:
+        for chunk in stream.iter_content(chunk_size=_get_chunk_size(expected_bytes)):
+            if expected_bytes is not None:
+                chunk = chunk[: expected_bytes - byte_count]
+            f.write(chunk)
+            byte_count += len(chunk)
+            if expected_bytes is not None and byte_count >= expected_bytes:
+                break
+            if time.time() > deadline:
+                log.warning(
+                    "Timed out downloading {}, keeping the first {} bytes".format(
+                        log_file, byte_count
+                    )
+                )
+                break
+    finally:
+        stream.close()
+    return byte_count
+
+
+def _read_log_file(log_file: _LogFile, f, deadline: float) -> int:
+    """Fetches the content of a file on an agent starting at log_file.offset into f, using the
+    agent's files/read API. Stops after log_file.length bytes (if set) or at the deadline. Returns
+    the number of bytes written."""
+    offset = log_file.offset
+    expected_bytes = log_file.expected_bytes()
+    end = None if expected_bytes is None else offset + expected_bytes
+    chunk_size = _get_chunk_size(expected_bytes)
+    while end is None or offset < end:
+        length = chunk_size
+        if end is not None:
+            length = min(length, end - offset)
+        response = sdk_cmd.cluster_request(
+            "GET",
+            "/slave/{}/files/read".format(log_file.agent_id),
+            params={"path": log_file.path, "offset": offset, "length": length},
+            timeout_seconds=_log_fetch_file_timeout_seconds,
+        )
+        # The file's raw bytes are returned as a string with one character per byte.
+        data = response.json()["data"].encode("latin-1")
+        if not data:
+            break  # reached end of file
+        f.write(data)
+        offset += len(data)
+        if time.time() > deadline:
+            log.warning(
+                "Timed out reading {}, keeping {} bytes from offset {}".format(
+                    log_file, offset - log_file.offset, log_file.offset
+                )
+            )
+            break
+    return offset - log_file.offset
+
+
+def _get_chunk_size(file_size) -> int:
+    """Returns a download chunk size for a file of the provided size (or None if unknown): Large
+    enough to keep per-chunk overhead low for big files, without overallocating for small ones."""
+    if file_size is None:
+        return 1024 * 1024
+    return min(max(file_size // 8, 64 * 1024), 4 * 1024 * 1024)
 
 
 def _select_log_files(
-    item: pytest.Item,
+    artifacts: _TestArtifacts,
     task_id: str,
     file_infos: list,
     source: str,
@@ -476,31 +1038,19 @@ def _select_log_files(
             source,
             os.path.basename(file_info["path"]),
         )
-        selected[_setup_artifact_path(item, out_filename)] = file_info
-
-
-def _setup_artifact_path(item: pytest.Item, artifact_name: str):
-    """Given the pytest item and an artifact_name,
-    Returns the path to write an artifact with that name."""
-
-    # full item.listchain() is e.g.:
-    # - ['build', 'frameworks/template/tests/test_sanity.py', 'test_install']
-    # - ['build', 'tests/test_sanity.py', 'test_install']
-    # we want to turn both cases into: 'logs/test_sanity_py/test_install'
-    if _testlogs_test_index > 0:
-        # test_index is defined: get name like "05__test_placement_rules"
-        test_name = "{:02d}__{}".format(_testlogs_test_index, item.name)
-    else:
-        # test_index is not defined: fall back to just "test_placement_rules"
-        test_name = item.name
+        selected[artifacts.name(out_filename)] = file_info
 
-    output_dir = os.path.join(_test_suite_artifact_directory(item), test_name)
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
 
-    return os.path.join(output_dir, artifact_name)
+def _open_artifact_sink(item: pytest.Item):
+    """Closes the sink for any prior test suite, and opens a new one for the provided test's suite."""
+    global _testlogs_artifact_sink
+    handle_session_finish()
+    _testlogs_artifact_sink = sdk_artifacts.create_sink(_test_suite_artifact_directory(item))
 
 
-def _test_suite_artifact_directory(item: pytest.Item):
-    """Returns the parent directory for the artifacts across a suite of tests."""
-    return os.path.join("logs", get_test_suite_name(item))
+def _get_artifact_sink(item: pytest.Item) -> sdk_artifacts.ArtifactSink:
+    """Returns the sink for the current test suite's artifacts."""
+    if _testlogs_artifact_sink is None:
+        # handle_test_setup() wasn't called for this suite, e.g. the failure was in collection.
+        _open_artifact_sink(item)
+    return _testlogs_artifact_sink
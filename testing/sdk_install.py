@@ -12,6 +12,7 @@ import retrying
 import tempfile
 
 import sdk_cmd
+import sdk_cosmos
 import sdk_marathon
 import sdk_plan
 import sdk_tasks
@@ -25,6 +26,10 @@ TIMEOUT_SECONDS = 15 * 60
 Used by post - test diagnostics to retrieve stuff from currently running services."""
 _installed_service_names = set([])
 
+"""Package name => version of the package CLI which was most recently installed via install_cli().
+Used to avoid reinstalling the same CLI version every time a package is installed."""
+_installed_package_clis = {}
+
 """List of dead agents which should be ignored when checking for orphaned resources.
 Used by uninstall when validating that an uninstall completed successfully."""
 _dead_agent_hosts = set([])
@@ -53,19 +58,48 @@ def _retried_install_impl(
 
     # Trigger package install, but only if it's not already installed.
     # We expect upstream to have confirmed that it wasn't already installed beforehand.
-    install_cmd = ["package", "install", package_name, "--yes"]
-
-    if package_version:
-        install_cmd.append("--package-version={}".format(package_version))
-
     if sdk_marathon.app_exists(service_name):
         log.info(
             "Marathon app={} exists, ensuring CLI for package={} is installed".format(
                 service_name, package_name
             )
         )
-        install_cmd.append("--cli")
-    elif options:
+        install_cli(package_name, package_version)
+    else:
+        _install_package(package_name, service_name, options, package_version)
+
+    # Wait for expected tasks to come up
+    if expected_running_tasks > 0 and wait_for_all_conditions:
+        sdk_tasks.check_running(service_name, expected_running_tasks, timeout_seconds)
+
+    # Wait for completed marathon deployment
+    if wait_for_all_conditions:
+        sdk_marathon.wait_for_deployment(service_name, timeout_seconds, None)
+
+
+def _install_package(package_name, service_name, options, package_version):
+    """Installs the package's service via the package manager API, followed by the package's CLI.
+    Falls back to a single 'dcos package install' if the API request fails."""
+    if sdk_cosmos.ENABLED:
+        try:
+            response = sdk_cosmos.install(package_name, package_version, options)
+        except Exception:
+            log.exception(
+                "Failed to install package={} via package API, falling back to CLI".format(
+                    package_name
+                )
+            )
+        else:
+            # Install the CLI for the exact version that was resolved for the service:
+            install_cli(package_name, response.get("packageVersion", package_version))
+            return
+
+    install_cmd = ["package", "install", package_name, "--yes"]
+
+    if package_version:
+        install_cmd.append("--package-version={}".format(package_version))
+
+    if options:
         # Write options to a temporary json file to be accessed by the CLI:
         options_file = tempfile.NamedTemporaryFile("w")
         json.dump(options, options_file)
@@ -73,14 +107,30 @@ def _retried_install_impl(
         install_cmd.append("--options={}".format(options_file.name))
 
     sdk_cmd.run_cli(" ".join(install_cmd), check=True)
+    _installed_package_clis[package_name] = package_version
 
-    # Wait for expected tasks to come up
-    if expected_running_tasks > 0 and wait_for_all_conditions:
-        sdk_tasks.check_running(service_name, expected_running_tasks, timeout_seconds)
 
-    # Wait for completed marathon deployment
-    if wait_for_all_conditions:
-        sdk_marathon.wait_for_deployment(service_name, timeout_seconds, None)
+def install_cli(package_name, package_version=None, check=True):
+    """Installs the package's CLI subcommand, unless this exact version was already installed in
+    this session. This is a local operation which can only be performed by the CLI itself."""
+    if package_version and _installed_package_clis.get(package_name) == package_version:
+        log.info(
+            "CLI for package={} version={} is already installed".format(
+                package_name, package_version
+            )
+        )
+        return
+
+    install_cmd = ["package", "install", package_name, "--cli", "--yes"]
+
+    if package_version:
+        install_cmd.append("--package-version={}".format(package_version))
+
+    rc, _, _ = sdk_cmd.run_cli(" ".join(install_cmd), check=check)
+    if rc == 0:
+        _installed_package_clis[package_name] = package_version
+    else:
+        _installed_package_clis.pop(package_name, None)
 
 
 def install(
@@ -174,6 +224,27 @@ def _retried_run_janitor(service_name):
     assert rc == 0, "Janitor command failed"
 
 
+def _uninstall_package(package_name, service_name):
+    """Triggers uninstall of the service via the package manager API.
+    Falls back to 'dcos package uninstall' if the API request fails."""
+    # 'dcos package uninstall' also removes the package's CLI subcommand, so it must be installed
+    # again by the next install_cli().
+    _installed_package_clis.pop(package_name, None)
+    if sdk_cosmos.ENABLED:
+        try:
+            sdk_cosmos.uninstall(package_name, app_id=service_name)
+            return
+        except Exception:
+            log.exception(
+                "Failed to uninstall service={} via package API, falling back to CLI".format(
+                    service_name
+                )
+            )
+    sdk_cmd.run_cli(
+        "package uninstall {} --app-id={} --yes".format(package_name, service_name), check=True
+    )
+
+
 @retrying.retry(
     stop_max_attempt_number=5,
     wait_fixed=5000,
@@ -182,15 +253,13 @@ def _retried_run_janitor(service_name):
 def _retried_uninstall_package_and_wait(package_name, service_name):
     if sdk_marathon.app_exists(service_name):
         log.info("Uninstalling package {} with service name {}".format(package_name, service_name))
-        sdk_cmd.run_cli(
-            "package uninstall {} --app-id={} --yes".format(package_name, service_name), check=True
-        )
+        _uninstall_package(package_name, service_name)
 
         # Wait on the app no longer being listed in Marathon, at which point it is uninstalled.
         # At the same time, log the deploy plan state as we wait for the app to finish uninstalling.
         @retrying.retry(
             stop_max_delay=TIMEOUT_SECONDS * 1000,
-            wait_fixed=5000,
+            wait_func=sdk_marathon.get_app_wait_func(service_name, poll_interval_seconds=5),
             retry_on_result=lambda result: not result,
         )
         def wait_for_removal_log_deploy_plan():
@@ -5,7 +5,12 @@ FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
 SHOULD ALSO BE APPLIED TO sdk_marathon IN ANY OTHER PARTNER REPOS
 ************************************************************************
 """
+import collections
+import json
 import logging
+import os
+import threading
+import time
 import retrying
 import requests
 import typing
@@ -15,6 +20,24 @@ import sdk_tasks
 
 TIMEOUT_SECONDS = 15 * 60
 
+# Whether deployment waits should be driven by Marathon's event stream, with polling as a fallback.
+EVENTS_ENABLED = os.environ.get("DCOS_MARATHON_EVENTS", "true").lower() in ["true", "1"]
+
+# Events which may indicate a change in an app's deployment state.
+_WATCHED_EVENT_TYPES = [
+    "deployment_success",
+    "deployment_failed",
+    "deployment_step_success",
+    "status_update_event",
+    "health_status_changed_event",
+    "instance_health_changed_event",
+    "app_terminated_event",
+]
+
+# How long to wait for an event before re-checking an app anyway.
+# This is a safety net: apps are normally re-checked as soon as a relevant event arrives.
+_EVENT_MAX_WAIT_SECONDS = 10
+
 log = logging.getLogger(__name__)
 
 
@@ -107,7 +130,9 @@ class MarathonDeploymentsResponse(MarathonDeploymentResponse):
 
 def wait_for_deployment(app_name: str, timeout: int, expected_version: str) -> None:
     @retrying.retry(
-        stop_max_delay=timeout * 1000, wait_fixed=2000, retry_on_result=lambda result: not result
+        stop_max_delay=timeout * 1000,
+        wait_func=get_app_wait_func(app_name),
+        retry_on_result=lambda result: not result,
     )
     def _wait_for_deployment() -> bool:
         app = _get_config(app_name)
@@ -249,7 +274,9 @@ def destroy_app(app_name: str, timeout=TIMEOUT_SECONDS) -> None:
     # This check is different from the other deployment checks.
     # When it's complete, the app is gone entirely.
     @retrying.retry(
-        stop_max_delay=timeout * 1000, wait_fixed=2000, retry_on_result=lambda result: not result
+        stop_max_delay=timeout * 1000,
+        wait_func=get_app_wait_func(app_name),
+        retry_on_result=lambda result: not result,
     )
     def _wait_for_app_destroyed():
         if app_exists(app_name, timeout):
@@ -277,6 +304,203 @@ def restart_app(app_name: str, timeout=TIMEOUT_SECONDS) -> None:
     wait_for_deployment(app_name, timeout, result.get_version())
 
 
+class _MarathonEventWatcher(object):
+    """Follows Marathon's /v2/events server-sent event stream in a background thread, and keeps a
+    per-app count of the deployment, task status and health events seen for each app.
+
+    Waiters use this to re-check an app as soon as something happens to it, rather than every few
+    seconds. The counts themselves are only used to detect changes: the app's state is always
+    fetched from Marathon, so missed or unexpected events can only delay a check, never skip one.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._live = False
+        self._stopped = False
+        self._app_generations = collections.Counter()  # app id => number of events
+        self._generation = 0  # events which could not be attributed to specific apps
+        self._thread = threading.Thread(target=self._run, name="sdk_marathon_events", daemon=True)
+        self._thread.start()
+
+    def is_live(self) -> bool:
+        return self._live
+
+    def generation(self, app_id) -> int:
+        with self._condition:
+            return self._generation + self._app_generations[app_id]
+
+    def wait_for_change(self, app_id, generation, timeout_seconds) -> int:
+        """Waits until an event for the app has arrived since `generation`, the stream is no longer
+        live, or the timeout has passed. Returns the app's current generation."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._generation + self._app_generations[app_id] != generation
+                or not self._live,
+                timeout=timeout_seconds,
+            )
+            return self._generation + self._app_generations[app_id]
+
+    def wait_for_subscription(self, timeout_seconds) -> bool:
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._live or self._stopped, timeout=timeout_seconds
+            ) and self._live
+
+    def _run(self):
+        retry_delay_seconds = 1
+        while True:
+            try:
+                response = sdk_cmd.cluster_request(
+                    "GET",
+                    _api_url("events"),
+                    retry=False,
+                    raise_on_error=False,
+                    # Marathon doesn't send heartbeats, so an idle stream is re-established every
+                    # few minutes. Conditions are re-checked when that happens.
+                    timeout_seconds=5 * 60,
+                    stream=True,
+                    params={"event_type": _WATCHED_EVENT_TYPES},
+                    headers={"Accept": "text/event-stream"},
+                )
+                if response.status_code in (401, 403, 404, 405, 501):
+                    response.close()
+                    log.info(
+                        "Marathon event stream unavailable, falling back to polling: {} {}".format(
+                            response.status_code, response.reason
+                        )
+                    )
+                    break
+                response.raise_for_status()
+                try:
+                    self._follow(response)
+                finally:
+                    response.close()
+                error = "event stream ended"
+            except Exception as e:
+                error = e
+            with self._condition:
+                if self._live:
+                    retry_delay_seconds = 1
+                self._live = False
+                self._condition.notify_all()
+            log.info(
+                "Marathon event stream lost, retrying in {}s: {}".format(retry_delay_seconds, error)
+            )
+            time.sleep(retry_delay_seconds)
+            retry_delay_seconds = min(retry_delay_seconds * 2, 60)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _follow(self, response):
+        with self._condition:
+            self._live = True
+            # We may have missed events while (re)connecting, so any waiters should check again.
+            self._generation += 1
+            self._condition.notify_all()
+        for event_type, data in _iter_server_sent_events(response):
+            if event_type not in _WATCHED_EVENT_TYPES:
+                continue
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            app_ids = _get_event_app_ids(event)
+            if event_type == "deployment_failed":
+                log.info(
+                    "Marathon reported failed deployment {} for apps: {}".format(
+                        event.get("id", "???"), ", ".join(sorted(app_ids)) or "???"
+                    )
+                )
+            with self._condition:
+                if app_ids:
+                    for app_id in app_ids:
+                        self._app_generations[app_id] += 1
+                else:
+                    self._generation += 1
+                self._condition.notify_all()
+
+
+def _iter_server_sent_events(response):
+    """Yields (event type, data) for each event in a text/event-stream response."""
+    buf = b""
+    event_type = ""
+    data = []
+    for chunk in response.iter_content(chunk_size=None):
+        buf += chunk
+        lines = buf.split(b"\n")
+        buf = lines.pop()
+        for line in lines:
+            line = line.decode("utf-8").rstrip("\r")
+            if not line:
+                if data:
+                    yield event_type or "message", "\n".join(data)
+                event_type = ""
+                data = []
+            elif line.startswith("event:"):
+                event_type = line[len("event:") :].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:") :].strip())
+
+
+def _get_event_app_ids(event) -> set:
+    """Returns the IDs of the apps affected by a Marathon event, or an empty set if unknown."""
+    app_ids = set()
+    for key in ("appId", "runSpecId"):
+        if event.get(key):
+            app_ids.add(event[key])
+    # Deployment events list the affected apps in the steps of the deployment plan.
+    for step in event.get("plan", {}).get("steps", []):
+        for action in step.get("actions", []):
+            if action.get("app"):
+                app_ids.add(action["app"])
+    return app_ids
+
+
+_event_watcher = None
+_event_watcher_lock = threading.Lock()
+
+
+def _get_live_event_watcher():
+    global _event_watcher
+    if not EVENTS_ENABLED:
+        return None
+    with _event_watcher_lock:
+        started = False
+        if _event_watcher is None:
+            _event_watcher = _MarathonEventWatcher()
+            started = True
+        watcher = _event_watcher
+    if started:
+        watcher.wait_for_subscription(10)
+    return watcher if watcher.is_live() else None
+
+
+def get_app_wait_func(app_name, poll_interval_seconds=2):
+    """Returns a `wait_func` for retrying.retry(), which blocks until the next Marathon event for the
+    app when the event stream is live, or otherwise waits `poll_interval_seconds`."""
+    app_id = "/" + app_name.lstrip("/")
+    watcher = _get_live_event_watcher()
+    # Events from before the first attempt are visible to that attempt, so start from here.
+    last_generation = [watcher.generation(app_id) if watcher else None]
+
+    def wait_func(attempt_number, delay_since_first_attempt_ms):
+        watcher = _get_live_event_watcher()
+        if watcher is None:
+            last_generation[0] = None
+            return poll_interval_seconds * 1000
+        if last_generation[0] is None:
+            # Stream was just (re)established, so check again now.
+            last_generation[0] = watcher.generation(app_id)
+            return 0
+        last_generation[0] = watcher.wait_for_change(
+            app_id, last_generation[0], _EVENT_MAX_WAIT_SECONDS
+        )
+        return 0
+
+    return wait_func
+
+
 def _get_config(app_name):
     return sdk_cmd.cluster_request("GET", _api_url("apps/{}".format(app_name))).json()["app"]
 
@@ -74,10 +74,15 @@ def get_endpoint_string(package_name: str, service_name: str, endpoint_name: str
     return info.strip()
 
 
-def check_task_network(task_name, expected_network_name="dcos"):
+def check_task_network(task_name, expected_network_name="dcos", framework_id=None):
     """Tests whether a task (and it's parent pod) is on a given network
+
+    : param framework_id: The ID of the framework which launched the task. Recommended, as otherwise
+                          every task in the cluster is checked for a matching name.
     """
-    statuses = sdk_tasks.get_all_status_history(task_name, with_completed_tasks=False)
+    statuses = sdk_tasks.get_all_status_history(
+        task_name, with_completed_tasks=False, framework_id=framework_id
+    )
     assert len(statuses) != 0, "Unable to find any statuses for running task_name={}".format(
         task_name
     )
@@ -9,8 +9,11 @@ SHOULD ALSO BE APPLIED TO sdk_plan IN ANY OTHER PARTNER REPOS
 import datetime
 import logging
 import retrying
+import time
 
 import sdk_cmd
+import sdk_cmd_async
+import sdk_plan_timeline
 import sdk_tasks
 
 TIMEOUT_SECONDS = 15 * 60
@@ -55,7 +58,7 @@ def get_plan_once(service_name, plan, multiservice_name=None):
 
     response = sdk_cmd.service_request("GET", service_name, path, retry=False, raise_on_error=False)
     if response.status_code == 417:
-        return response  # Plan has errors: Avoid throwing an exception, return plan as-is.
+        return response.json()  # Plan has errors: Avoid throwing an exception, return plan as-is.
     response.raise_for_status()
     return response.json()
 
@@ -144,17 +147,133 @@ def wait_for_plan_status(
     else:
         statuses = status
 
-    initial_failures = sdk_tasks.get_failed_task_count(service_name, retry=True)
-    wait_start = datetime.datetime.utcnow()
+    check_failures = _get_failure_check(service_name, plan_name, statuses)
+    watcher = PlanWatcher(service_name, plan_name, multiservice_name=multiservice_name)
+    return watcher.wait(
+        lambda plan: plan["status"] in statuses,
+        "{} {} plan".format(status, plan_name),
+        timeout_seconds,
+        before_poll=check_failures,
+    )
+
+
+def wait_for_phase_status(
+    service_name, plan_name, phase_name, status, timeout_seconds=TIMEOUT_SECONDS
+):
+    def phase_has_status(plan):
+        phase = get_phase(plan, phase_name)
+        return phase and phase["status"] == status
+
+    return PlanWatcher(service_name, plan_name).wait(
+        phase_has_status, "{} {}.{} phase".format(status, plan_name, phase_name), timeout_seconds
+    )
+
+
+def wait_for_step_status(
+    service_name, plan_name, phase_name, step_name, status, timeout_seconds=TIMEOUT_SECONDS
+):
+    def step_has_status(plan):
+        step = get_step(get_phase(plan, phase_name), step_name)
+        return step and step["status"] == status
+
+    return PlanWatcher(service_name, plan_name).wait(
+        step_has_status,
+        "{} {}.{}.{} step".format(status, plan_name, phase_name, step_name),
+        timeout_seconds,
+    )
+
+
+def wait_for_quiescence(
+    services, plans=("deploy", "recovery"), timeout_seconds=TIMEOUT_SECONDS, multiservice_name=None
+) -> dict:
+    """Waits for all of the specified plans in all of the specified services to be COMPLETE at the
+    same time. This is equivalent to calling wait_for_completed_plan() for each plan in turn, except
+    that the plans are all polled concurrently, so the wait takes as long as the slowest plan rather
+    than the sum of all of them.
+
+    Returns a dict of (service name, plan name) => seconds until that plan was last seen to become
+    COMPLETE, for reporting.
+
+    : param services: A service name, or a list of service names.
+    : param plans: The names of the plans to wait for in each service.
+    """
+    if isinstance(services, str):
+        services = [services]
+    watchers = [
+        PlanWatcher(service_name, plan_name, multiservice_name=multiservice_name)
+        for service_name in services
+        for plan_name in plans
+    ]
+    failure_checks = {
+        service_name: _get_failure_check(service_name, ", ".join(plans), ["COMPLETE"])
+        for service_name in services
+    }
+    wait_start = time.time()
+    completion_times = {}
+    log.info("Waiting for COMPLETE plans: {}".format(_watcher_names(watchers)))
+
+    def poll(watcher):
+        failure_checks[watcher.service_name]()
+        return watcher.poll()
+
+    def wait_func(attempt_number, delay_since_first_attempt_ms):
+        return min(w._poll_interval_seconds for w in watchers) * 1000
 
     @retrying.retry(
-        wait_fixed=1000,
+        wait_func=wait_func,
         stop_max_delay=timeout_seconds * 1000,
         retry_on_result=lambda res: not res,
         retry_on_exception=lambda e: not isinstance(e, TaskFailuresExceededException),
     )
     def fn():
-        failures = sdk_tasks.get_failed_task_count(service_name)
+        results = sdk_cmd_async.run(
+            sdk_cmd_async.map_blocking(poll, watchers, return_exceptions=True)
+        )
+        for result in results:
+            if isinstance(result, TaskFailuresExceededException):
+                raise result
+        now = time.time()
+        pending = []
+        for watcher, result in zip(watchers, results):
+            key = (watcher.service_name, watcher.plan_name)
+            if isinstance(result, Exception) or not result or result["status"] != "COMPLETE":
+                # Not complete (anymore): the plan must be seen to complete (again)
+                completion_times.pop(key, None)
+                pending.append(watcher)
+            elif key not in completion_times:
+                completion_times[key] = now - wait_start
+        if pending:
+            if any(watcher.changed for watcher in watchers):
+                log.info("Still waiting for COMPLETE plans: {}".format(_watcher_names(pending)))
+            return False
+        return True
+
+    fn()
+    for watcher in watchers:
+        watcher.finish()
+    log.info(
+        "All plans COMPLETE after %ds: %s",
+        time.time() - wait_start,
+        ", ".join(
+            "{}/{}={:.1f}s".format(service_name, plan_name, seconds)
+            for (service_name, plan_name), seconds in sorted(completion_times.items())
+        ),
+    )
+    return completion_times
+
+
+def _watcher_names(watchers) -> str:
+    return ", ".join("{}/{}".format(w.service_name, w.plan_name) for w in watchers)
+
+
+def _get_failure_check(service_name, plan_name, statuses):
+    """Returns a function which raises TaskFailuresExceededException if tasks in the service have
+    failed more than MAX_NEW_TASK_FAILURES times since this was called."""
+    initial_failures = sdk_tasks.get_tracked_failed_task_count(service_name)
+    wait_start = datetime.datetime.utcnow()
+
+    def check_failures():
+        failures = sdk_tasks.get_tracked_failed_task_count(service_name)
         if failures - initial_failures > MAX_NEW_TASK_FAILURES:
             log.error(
                 "Tasks in service %s failed %d times since starting %ds ago to wait for %s to reach %s, aborting.",
@@ -166,63 +285,181 @@ def wait_for_plan_status(
             )
             raise TaskFailuresExceededException("Service not recoverable: {}".format(service_name))
 
-        plan = get_plan(
-            service_name,
-            plan_name,
-            timeout_seconds=SHORT_TIMEOUT_SECONDS,
-            multiservice_name=multiservice_name,
-        )
-        log.info("Waiting for %s %s plan:\n%s", status, plan_name, plan_string(plan_name, plan))
-        if plan and plan["status"] in statuses:
-            return plan
-        else:
-            return False
+    return check_failures
 
-    return fn()
 
+class PlanWatcher(object):
+    """Polls a service's plan, and logs only what changed between polls.
 
-def wait_for_phase_status(
-    service_name, plan_name, phase_name, status, timeout_seconds=TIMEOUT_SECONDS
-):
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
-    )
-    def fn():
-        plan = get_plan(service_name, plan_name, SHORT_TIMEOUT_SECONDS)
-        phase = get_phase(plan, phase_name)
-        log.info(
-            "Waiting for {} {}.{} phase:\n{}".format(
-                status, plan_name, phase_name, plan_string(plan_name, plan)
-            )
+    Polling is adaptive: the plan is polled every MIN_POLL_INTERVAL_SECONDS while it's changing,
+    backing off to MAX_POLL_INTERVAL_SECONDS while it isn't. If the scheduler returns an ETag, polls
+    are conditional GETs, and an unchanged plan costs a 304 response.
+    """
+
+    MIN_POLL_INTERVAL_SECONDS = 0.5
+    MAX_POLL_INTERVAL_SECONDS = 2
+    # How often to log a reminder of what we're waiting for, when the plan isn't changing.
+    UNCHANGED_LOG_INTERVAL_SECONDS = 60
+
+    def __init__(self, service_name, plan_name, multiservice_name=None):
+        self.service_name = service_name
+        self.plan_name = plan_name
+        if multiservice_name is None:
+            self._path = "/v1/plans/{}".format(plan_name)
+        else:
+            self._path = "/v1/service/{}/plans/{}".format(multiservice_name, plan_name)
+        self.plan = None  # the latest plan, or None if it hasn't been fetched yet
+        self.changed = False  # whether the latest poll() returned a different plan
+        self.last_change = None  # when the latest change was observed, in seconds since the epoch
+        self._etag = None
+        self._poll_interval_seconds = self.MIN_POLL_INTERVAL_SECONDS
+        self.timeline = sdk_plan_timeline.create(service_name, plan_name)
+
+    def poll(self) -> dict:
+        """Fetches the plan, logs any transitions since the previous poll, and returns the plan.
+
+        Plans with errors (HTTP 417) are returned like any other plan. Other errors are raised."""
+        headers = {"If-None-Match": self._etag} if self._etag and self.plan else {}
+        response = sdk_cmd.service_request(
+            "GET", self.service_name, self._path, retry=False, raise_on_error=False, headers=headers
         )
-        if phase and phase["status"] == status:
-            return plan
+        if response.status_code == 304:
+            self._on_unchanged()
+            return self.plan
+        if response.status_code != 417:  # Plan has errors: Avoid throwing an exception.
+            response.raise_for_status()
+        plan = response.json()
+        self._etag = response.headers.get("ETag")
+
+        if plan == self.plan:
+            self._on_unchanged()
+            return self.plan
+
+        if self.plan is None:
+            log.info("%s: %s", self.service_name, plan_string(self.plan_name, plan))
         else:
-            return False
+            for transition in diff_plans(self.plan, plan, self.plan_name):
+                log.info("%s: %s", self.service_name, transition)
+        self.plan = plan
+        self.changed = True
+        self.last_change = time.time()
+        self._poll_interval_seconds = self.MIN_POLL_INTERVAL_SECONDS
+        if self.timeline:
+            self.timeline.record(plan, self.last_change)
+            eta_seconds = self.timeline.eta_seconds() if plan.get("status") != "COMPLETE" else None
+            if eta_seconds is not None:
+                log.info("%s: %s plan ETA ~%ds", self.service_name, self.plan_name, eta_seconds)
+        return plan
+
+    def finish(self):
+        """Records a summary of the plan's timeline, if any. Invoked when a wait has completed."""
+        if self.timeline:
+            self.timeline.finish()
+
+    def _on_unchanged(self):
+        self.changed = False
+        self._poll_interval_seconds = min(
+            self._poll_interval_seconds * 2, self.MAX_POLL_INTERVAL_SECONDS
+        )
 
-    return fn()
+    def wait(self, predicate, description, timeout_seconds=TIMEOUT_SECONDS, before_poll=None):
+        """Polls the plan until predicate(plan) returns a true value, then returns the plan.
 
+        The predicate is only re-evaluated when the plan has changed. Errors fetching the plan are
+        retried until the timeout has passed.
 
-def wait_for_step_status(
-    service_name, plan_name, phase_name, step_name, status, timeout_seconds=TIMEOUT_SECONDS
-):
-    @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
-    )
-    def fn():
-        plan = get_plan(service_name, plan_name, SHORT_TIMEOUT_SECONDS)
-        step = get_step(get_phase(plan, phase_name), step_name)
-        log.info(
-            "Waiting for {} {}.{}.{} step:\n{}".format(
-                status, plan_name, phase_name, step_name, plan_string(plan_name, plan)
-            )
+        : param predicate: Function accepting a plan, returning whether the wait is over.
+        : param description: What is being waited for, used in log messages.
+        : param before_poll: Optional function to invoke before each poll, which may raise
+                             TaskFailuresExceededException to abort the wait.
+        """
+        wait_start = time.time()
+        last_log = [wait_start]
+        evaluated_plan = [None]
+        log.info("Waiting for %s of %s", description, self.service_name)
+
+        def wait_func(attempt_number, delay_since_first_attempt_ms):
+            return self._poll_interval_seconds * 1000
+
+        @retrying.retry(
+            wait_func=wait_func,
+            stop_max_delay=timeout_seconds * 1000,
+            retry_on_result=lambda res: not res,
+            retry_on_exception=lambda e: not isinstance(e, TaskFailuresExceededException),
         )
-        if step and step["status"] == status:
-            return plan
-        else:
+        def fn():
+            if before_poll is not None:
+                before_poll()
+            plan = self.poll()
+            if plan is evaluated_plan[0]:
+                now = time.time()
+                if now - last_log[0] >= self.UNCHANGED_LOG_INTERVAL_SECONDS:
+                    last_log[0] = now
+                    log.info(
+                        "Still waiting for %s after %ds:\n%s",
+                        description,
+                        now - wait_start,
+                        plan_string(self.plan_name, plan),
+                    )
+                return False
+            evaluated_plan[0] = plan
+            last_log[0] = time.time()
+            if plan and predicate(plan):
+                log.info(
+                    "Done waiting for %s after %ds", description, time.time() - wait_start
+                )
+                self.finish()
+                return plan
             return False
 
-    return fn()
+        return fn()
+
+
+def diff_plans(old_plan, new_plan, plan_name="plan") -> list:
+    """Returns a list of human-readable status transitions between two versions of the named plan,
+    e.g. "deploy.node-deploy.node-1:[server]: PENDING => STARTING"."""
+    transitions = []
+
+    def diff_status(name, old, new):
+        if old is None:
+            transitions.append("{}: added with status {}".format(name, new["status"]))
+        elif new is None:
+            transitions.append("{}: removed".format(name))
+        elif old["status"] != new["status"]:
+            transitions.append("{}: {} => {}".format(name, old["status"], new["status"]))
+
+    diff_status(plan_name, old_plan, new_plan)
+    old_phases = {phase["name"]: phase for phase in old_plan.get("phases", [])}
+    new_phases = {phase["name"]: phase for phase in new_plan.get("phases", [])}
+    for phase_name in _merged_names(old_plan.get("phases", []), new_plan.get("phases", [])):
+        old_phase = old_phases.get(phase_name)
+        new_phase = new_phases.get(phase_name)
+        phase_prefix = "{}.{}".format(plan_name, phase_name)
+        diff_status(phase_prefix, old_phase, new_phase)
+        if old_phase is None or new_phase is None:
+            continue
+        old_steps = {step["name"]: step for step in old_phase["steps"]}
+        new_steps = {step["name"]: step for step in new_phase["steps"]}
+        for step_name in _merged_names(old_phase["steps"], new_phase["steps"]):
+            diff_status(
+                "{}.{}".format(phase_prefix, step_name),
+                old_steps.get(step_name),
+                new_steps.get(step_name),
+            )
+
+    old_errors = old_plan.get("errors", [])
+    new_errors = new_plan.get("errors", [])
+    if old_errors != new_errors:
+        transitions.append("{}: errors: {}".format(plan_name, ", ".join(new_errors) or "none"))
+    return transitions
+
+
+def _merged_names(old_children, new_children) -> list:
+    """Returns the names of all children across both lists, in order."""
+    names = [child["name"] for child in new_children]
+    new_names = set(names)
+    names += [child["name"] for child in old_children if child["name"] not in new_names]
+    return names
 
 
 def recovery_plan_is_empty(service_name):
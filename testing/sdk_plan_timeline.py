@@ -0,0 +1,278 @@
+"""Records the timing of plan rollouts, as observed while waiting on plans in sdk_plan.
+
+Each sdk_plan.PlanWatcher has a PlanTimeline, which timestamps every phase and step status
+transition and appends it to a JSON lines file alongside the current test's other artifacts, e.g.:
+
+    logs/test_sanity_py/01__test_install/plan_timeline_hello-world_deploy.jsonl
+
+When a wait completes, a summary line is appended with the duration of each step and the plan's
+critical path. Step durations are also added to a history file (HISTORY_FILE), which persists across
+test suites and runs, and is used to estimate how much longer an in-progress plan will take.
+
+Set DCOS_PLAN_TIMELINE=false to disable recording.
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_plan_timeline IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import json
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("DCOS_PLAN_TIMELINE", "true").lower() in ["true", "1"]
+
+# Historical step durations, used for ETAs.
+HISTORY_FILE = os.environ.get(
+    "DCOS_PLAN_TIMELINE_HISTORY", os.path.join("logs", "plan_history.json")
+)
+
+# The number of most recent durations to keep for each kind of step.
+_HISTORY_SAMPLES = 50
+
+# Where to write timelines when not running within a test, see set_output_dir().
+_DEFAULT_OUTPUT_DIR = os.path.join("logs", "plan_timelines")
+
+_output_dir = _DEFAULT_OUTPUT_DIR
+_history = None  # step key => [seconds, ...], loaded on first use
+_history_lock = threading.Lock()
+
+
+def set_output_dir(output_dir):
+    """Sets the directory which timelines for subsequent waits are written to, e.g. the artifact
+    directory for the current test. The directory is only created if something is written to it."""
+    global _output_dir
+    _output_dir = output_dir or _DEFAULT_OUTPUT_DIR
+
+
+def create(service_name, plan_name):
+    """Returns a new PlanTimeline for the plan, or None if recording is disabled."""
+    if not ENABLED:
+        return None
+    return PlanTimeline(service_name, plan_name)
+
+
+class PlanTimeline(object):
+    """Timestamps the status transitions of a plan's phases and steps."""
+
+    def __init__(self, service_name, plan_name):
+        self.service_name = service_name
+        self.plan_name = plan_name
+        self._path = os.path.join(
+            _output_dir,
+            "plan_timeline_{}_{}.jsonl".format(
+                service_name.strip("/").replace("/", "_"), plan_name
+            ),
+        )
+        self._plan = None
+        self._step_statuses = {}  # (phase, step) => last seen status
+        self._step_starts = {}  # (phase, step) => when the step was first seen to leave PENDING
+        self._step_ends = {}  # (phase, step) => when the step was seen to become COMPLETE
+        self._recorded_to_history = set()  # (phase, step) which were already added to history
+
+    def record(self, plan, timestamp=None):
+        """Records any transitions between the previously recorded plan and this one."""
+        timestamp = timestamp or time.time()
+        entries = []
+        if self._plan is None or self._plan.get("status") != plan.get("status"):
+            entries.append(
+                self._entry(timestamp, None, None, self._plan and self._plan.get("status"), plan)
+            )
+        for phase in plan.get("phases", []):
+            for step in phase.get("steps", []):
+                key = (phase["name"], step["name"])
+                old_status = self._step_statuses.get(key)
+                status = step["status"]
+                if old_status == status:
+                    continue
+                self._step_statuses[key] = status
+                entries.append(
+                    self._entry(timestamp, phase["name"], step["name"], old_status, step)
+                )
+                if status != "PENDING" and key not in self._step_starts:
+                    # Steps which had already left PENDING when first seen (e.g. when attaching to
+                    # a plan mid-deploy) have an unknown start time.
+                    self._step_starts[key] = timestamp if old_status == "PENDING" else None
+                if status == "COMPLETE":
+                    self._step_ends.setdefault(key, timestamp)
+                else:
+                    # e.g. restarted by a 'plan force-restart'
+                    self._step_ends.pop(key, None)
+        self._plan = plan
+        self._write(entries)
+
+    def _entry(self, timestamp, phase_name, step_name, old_status, element) -> dict:
+        entry = {"time": round(timestamp, 3), "service": self.service_name, "plan": self.plan_name}
+        if phase_name:
+            entry["phase"] = phase_name
+            entry["step"] = step_name
+        entry["from"] = old_status
+        entry["to"] = element.get("status")
+        return entry
+
+    def step_durations(self) -> dict:
+        """Returns (phase, step) => seconds from leaving PENDING to COMPLETE, for completed steps.
+        Steps which weren't seen leaving PENDING, so have an unknown start time, are excluded."""
+        durations = {}
+        for key, end in self._step_ends.items():
+            start = self._step_starts.get(key)
+            if start is not None and end >= start:
+                durations[key] = end - start
+        return durations
+
+    def critical_path(self) -> tuple:
+        """Returns (seconds, [(phase, step), ...]): the longest chain of observed step durations
+        through the plan, given the plan's and phases' serial/parallel strategies."""
+        durations = self.step_durations()
+        return _plan_path(self._plan or {}, lambda phase, step: durations.get((phase, step), 0))
+
+    def eta_seconds(self):
+        """Returns an estimate of the seconds until the plan completes, or None if there's no
+        historical data for the remaining steps."""
+        if self._plan is None:
+            return None
+        history = _load_history()
+        now = time.time()
+        missing = [False]
+
+        def remaining(phase_name, step_name):
+            key = (phase_name, step_name)
+            if self._step_statuses.get(key) == "COMPLETE":
+                return 0
+            samples = history.get(
+                _history_key(self.service_name, self.plan_name, phase_name, step_name)
+            )
+            if not samples:
+                missing[0] = True
+                return 0
+            start = self._step_starts.get(key)
+            elapsed = now - start if start else 0
+            return max(statistics.median(samples) - elapsed, 0)
+
+        seconds, _ = _plan_path(self._plan, remaining)
+        return None if missing[0] else seconds
+
+    def finish(self):
+        """Appends a summary of the plan's step durations and critical path to the timeline, and
+        adds any newly completed steps to the history used for ETAs."""
+        durations = self.step_durations()
+        if not durations:
+            return
+        path_seconds, path_steps = self.critical_path()
+        self._write(
+            [
+                {
+                    "time": round(time.time(), 3),
+                    "service": self.service_name,
+                    "plan": self.plan_name,
+                    "summary": {
+                        "status": self._plan.get("status"),
+                        "step_seconds": {
+                            "{}.{}".format(phase, step): round(seconds, 3)
+                            for (phase, step), seconds in durations.items()
+                        },
+                        "critical_path_seconds": round(path_seconds, 3),
+                        "critical_path": [
+                            "{}.{}".format(phase, step) for phase, step in path_steps
+                        ],
+                    },
+                }
+            ]
+        )
+        log.info(
+            "%s: %s plan critical path took %.1fs: %s",
+            self.service_name,
+            self.plan_name,
+            path_seconds,
+            ", ".join("{}.{}".format(phase, step) for phase, step in path_steps),
+        )
+        new_durations = {
+            _history_key(self.service_name, self.plan_name, phase, step): seconds
+            for (phase, step), seconds in durations.items()
+            if (phase, step) not in self._recorded_to_history
+        }
+        self._recorded_to_history.update(durations.keys())
+        _add_to_history(new_durations)
+
+    def _write(self, entries):
+        if not entries:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with open(self._path, "a") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            log.info("Failed to write plan timeline to {}: {}".format(self._path, e))
+
+
+def _plan_path(plan, step_seconds) -> tuple:
+    """Returns (seconds, [(phase, step), ...]) for the longest path through the plan, where each
+    step takes step_seconds(phase_name, step_name)."""
+
+    def combine(strategy, paths):
+        if not paths:
+            return 0, []
+        if _is_parallel(strategy):
+            return max(paths, key=lambda path: path[0])
+        return sum(path[0] for path in paths), [step for path in paths for step in path[1]]
+
+    phase_paths = []
+    for phase in plan.get("phases", []):
+        step_paths = [
+            (step_seconds(phase["name"], step["name"]), [(phase["name"], step["name"])])
+            for step in phase.get("steps", [])
+        ]
+        phase_paths.append(combine(phase.get("strategy"), step_paths))
+    return combine(plan.get("strategy"), phase_paths)
+
+
+def _is_parallel(strategy) -> bool:
+    return bool(strategy) and strategy.lower() == "parallel"
+
+
+def _history_key(service_name, plan_name, phase_name, step_name) -> str:
+    # Keep durations separate for each service (different packages may have identically named
+    # steps), while pooling them across pod instances: "node-2:[server]" => "node-#:[server]"
+    return "{}:{}.{}.{}".format(
+        service_name.strip("/"), plan_name, phase_name, re.sub(r"\d+", "#", step_name)
+    )
+
+
+def _load_history() -> dict:
+    global _history
+    with _history_lock:
+        if _history is None:
+            try:
+                with open(HISTORY_FILE) as f:
+                    _history = json.load(f)
+            except (OSError, ValueError):
+                _history = {}
+        return _history
+
+
+def _add_to_history(durations):
+    if not durations:
+        return
+    history = _load_history()
+    with _history_lock:
+        for key, seconds in durations.items():
+            samples = history.setdefault(key, [])
+            samples.append(round(seconds, 3))
+            del samples[:-_HISTORY_SAMPLES]
+        try:
+            history_dir = os.path.dirname(HISTORY_FILE)
+            if history_dir:
+                os.makedirs(history_dir, exist_ok=True)
+            tmp_path = HISTORY_FILE + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(history, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, HISTORY_FILE)
+        except OSError as e:
+            log.info("Failed to update plan history in {}: {}".format(HISTORY_FILE, e))
@@ -36,8 +36,7 @@ def check_permanent_recovery(
     """
     LOG.info("Testing pod replace operation for %s:%s", service_name, pod_name)
 
-    sdk_plan.wait_for_completed_deployment(service_name)
-    sdk_plan.wait_for_completed_recovery(service_name)
+    sdk_plan.wait_for_quiescence(service_name)
 
     rc, stdout, _ = sdk_cmd.svc_cli(package_name, service_name, "pod list")
     assert rc == 0, "Pod list failed"
@@ -10,6 +10,7 @@ import logging
 import os
 
 import sdk_cmd
+import sdk_cosmos
 import sdk_utils
 
 log = logging.getLogger(__name__)
@@ -53,7 +54,29 @@ def get_repos() -> list:
     return parse_stub_universe_url_string(stub_universe_url_string)
 
 
+def list_repos() -> list:
+    """Returns the cluster's package repositories, as [{"name": ..., "uri": ...}, ...]"""
+    if sdk_cosmos.ENABLED:
+        try:
+            return sdk_cosmos.list_repos()
+        except Exception:
+            log.exception("Failed to list repos via package API, falling back to CLI")
+    _, stdout, _ = sdk_cmd.run_cli("package repo list --json")
+    return json.loads(stdout)["repositories"]
+
+
 def remove_repo(repo_name) -> bool:
+    if sdk_cosmos.ENABLED:
+        try:
+            sdk_cosmos.remove_repo(repo_name)
+            return True
+        except sdk_cosmos.CosmosException as e:
+            if e.type == "RepositoryNotPresent":
+                # tried to remove something that wasn't there, move on.
+                return True
+            log.exception(
+                "Failed to remove repo {} via package API, falling back to CLI".format(repo_name)
+            )
     rc, stdout, stderr = sdk_cmd.run_cli("package repo remove {}".format(repo_name))
     if stderr.endswith("is not present in the list"):
         # tried to remove something that wasn't there, move on.
@@ -62,6 +85,14 @@ def remove_repo(repo_name) -> bool:
 
 
 def add_repo(repo_name, repo_url, index=None) -> bool:
+    if sdk_cosmos.ENABLED:
+        try:
+            sdk_cosmos.add_repo(repo_name, repo_url, index)
+            return True
+        except Exception:
+            log.exception(
+                "Failed to add repo {} via package API, falling back to CLI".format(repo_name)
+            )
     index_arg = "" if index is None else " --index={}".format(index)
     rc, _, _ = sdk_cmd.run_cli(
         "package repo add{} {} {}".format(index_arg, repo_name, repo_url)
@@ -76,8 +107,7 @@ def add_stub_universe_urls(stub_universe_urls: list) -> dict:
         return stub_urls
 
     # clean up any duplicate repositories
-    _, current_universes, _ = sdk_cmd.run_cli("package repo list --json")
-    for repo in json.loads(current_universes)["repositories"]:
+    for repo in list_repos():
         if repo["uri"] in stub_universe_urls:
             log.info("Removing duplicate stub URL: {}".format(repo["uri"]))
             assert remove_repo(repo["name"])
@@ -0,0 +1,387 @@
+"""Background watcher of cluster tasks, fed by the Mesos master operator API event stream.
+
+Rather than fetching every framework and task in the cluster once per second, a single background
+thread SUBSCRIBEs to the leading master and keeps an in-memory table of frameworks, tasks and agents
+up to date as events arrive. Helpers in sdk_tasks read from this table when the watcher is live, and
+block on get_wait_func() between checks so that they are re-evaluated as soon as a task changes.
+
+If the subscription can't be established or is lost, get_live_watcher() returns None until it has
+been re-established, and callers fall back to polling the master. Set DCOS_TASK_WATCHER=false to
+disable the watcher entirely.
+
+************************************************************************
+FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
+SHOULD ALSO BE APPLIED TO sdk_task_watcher IN ANY OTHER PARTNER REPOS
+************************************************************************
+"""
+import collections
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+import sdk_cmd
+
+log = logging.getLogger(__name__)
+
+# Whether the watcher should be used at all.
+ENABLED = os.environ.get("DCOS_TASK_WATCHER", "true").lower() in ["true", "1"]
+
+# The most completed tasks to remember per framework. Mesos itself defaults to keeping 1000.
+MAX_COMPLETED_TASKS_PER_FRAMEWORK = int(
+    os.environ.get("DCOS_TASK_WATCHER_MAX_COMPLETED_TASKS", "1000")
+)
+
+# How long to wait for a new event before re-checking a condition anyway.
+# This is a safety net: conditions are normally re-checked as soon as an event arrives.
+MAX_WAIT_SECONDS = 10
+
+# How long waiters pause after an event arrives, so that bursts of events result in a single check.
+_EVENT_SETTLE_SECONDS = 0.1
+
+# How long get_live_watcher() waits for the initial snapshot after starting the watcher.
+_STARTUP_TIMEOUT_SECONDS = 10
+
+# Responses to a SUBSCRIBE call which mean that the operator API isn't going to work for us.
+_UNSUPPORTED_STATUS_CODES = (401, 403, 404, 405, 501)
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+class TaskWatcher(object):
+    """Keeps a table of cluster frameworks, tasks and agents in sync with the Mesos master.
+
+    The table contents are returned in the same format as the master's /frameworks, /tasks and
+    /slaves endpoints (for the fields used by sdk_tasks), so that callers can use either source.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._live = False
+        self._stopped = False
+        self._generation = 0  # incremented on every change to the table
+        self._response = None
+
+        self._frameworks = {}  # framework id => {"id", "name", "active"}
+        self._tasks = {}  # task id => task entry, see _parse_task()
+        # framework id => completed task ids, oldest first
+        self._completed_task_ids = collections.defaultdict(collections.deque)
+        self._agents = {}  # agent id => hostname
+
+        self._thread = threading.Thread(target=self._run, name="sdk_task_watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._live = False
+            response = self._response
+            self._condition.notify_all()
+        if response is not None:
+            response.close()
+
+    def is_live(self) -> bool:
+        return self._live
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def wait_for_subscription(self, timeout_seconds) -> bool:
+        """Waits until the initial snapshot has been received. Returns whether the watcher is
+        live."""
+        with self._condition:
+            return (
+                self._condition.wait_for(
+                    lambda: self._live or self._stopped, timeout=timeout_seconds
+                )
+                and self._live
+            )
+
+    def wait_for_change(self, generation, timeout_seconds) -> int:
+        """Waits until the table has changed since `generation`, the watcher is no longer live, or
+        the timeout has passed. Returns the current generation."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._generation != generation or not self._live, timeout=timeout_seconds
+            )
+            return self._generation
+
+    def get_frameworks(self) -> list:
+        """Returns active and inactive frameworks, in the format of /mesos/frameworks."""
+        with self._condition:
+            frameworks = {
+                framework_id: dict(framework, tasks=[], unreachable_tasks=[], completed_tasks=[])
+                for framework_id, framework in self._frameworks.items()
+            }
+            for task in self._tasks.values():
+                framework = frameworks.get(task["framework_id"])
+                if framework is None:
+                    continue
+                if task["state"] in _UNREACHABLE_TASK_STATES:
+                    task_list = "unreachable_tasks"
+                elif task["state"] in _COMPLETED_TASK_STATES:
+                    task_list = "completed_tasks"
+                else:
+                    task_list = "tasks"
+                framework[task_list].append(copy.deepcopy(task))
+            return list(frameworks.values())
+
+    def get_tasks(self) -> list:
+        """Returns all tasks across all frameworks, in the format of /mesos/tasks."""
+        with self._condition:
+            return [copy.deepcopy(task) for task in self._tasks.values()]
+
+    def get_agentid_to_hostname(self) -> dict:
+        with self._condition:
+            return dict(self._agents)
+
+    def _run(self):
+        retry_delay_seconds = 1
+        while not self._stopped:
+            try:
+                self._subscribe()
+                error = "event stream ended"
+            except _SubscribeUnsupported as e:
+                log.info("Task watcher disabled, falling back to polling: {}".format(e))
+                self.stop()
+                return
+            except Exception as e:
+                error = e
+            with self._condition:
+                if self._live:
+                    # We had been subscribed, so this is a fresh failure (e.g. master failover).
+                    retry_delay_seconds = 1
+                self._live = False
+                self._condition.notify_all()
+            if self._stopped:
+                return
+            log.info(
+                "Task watcher subscription lost, retrying in {}s: {}".format(
+                    retry_delay_seconds, error
+                )
+            )
+            time.sleep(retry_delay_seconds)
+            retry_delay_seconds = min(retry_delay_seconds * 2, 60)
+
+    def _subscribe(self):
+        # Heartbeats arrive every 15s by default, so a read timeout well beyond that means that the
+        # connection has been lost (e.g. due to a master failover) and should be re-established.
+        response = sdk_cmd.cluster_request(
+            "POST",
+            "/mesos/api/v1",
+            retry=False,
+            raise_on_error=False,
+            timeout_seconds=60,
+            stream=True,
+            headers={"Accept": "application/json"},
+            json={"type": "SUBSCRIBE"},
+        )
+        if response.status_code in _UNSUPPORTED_STATUS_CODES:
+            response.close()
+            raise _SubscribeUnsupported(
+                "Operator API returned {}: {}".format(response.status_code, response.reason)
+            )
+        response.raise_for_status()
+        with self._condition:
+            if self._stopped:
+                response.close()
+                return
+            self._response = response
+        try:
+            for record in sdk_cmd.iter_recordio(response):
+                self._handle_event(json.loads(record.decode("utf-8")))
+                if self._stopped:
+                    return
+        finally:
+            response.close()
+
+    def _handle_event(self, event):
+        event_type = event.get("type")
+        if event_type == "HEARTBEAT":
+            return
+        with self._condition:
+            if event_type == "SUBSCRIBED":
+                self._reset(event["subscribed"]["get_state"])
+                self._live = True
+                log.info(
+                    "Task watcher subscribed: {} frameworks, {} tasks, {} agents".format(
+                        len(self._frameworks), len(self._tasks), len(self._agents)
+                    )
+                )
+            elif event_type == "TASK_ADDED":
+                self._update_task(_parse_task(event["task_added"]["task"]))
+            elif event_type == "TASK_UPDATED":
+                self._update_task_status(event["task_updated"])
+            elif event_type in ("FRAMEWORK_ADDED", "FRAMEWORK_UPDATED"):
+                self._update_framework(event[event_type.lower()]["framework"])
+            elif event_type == "FRAMEWORK_REMOVED":
+                framework_id = event["framework_removed"]["framework_info"]["id"]["value"]
+                if framework_id in self._frameworks:
+                    self._frameworks[framework_id]["active"] = False
+            elif event_type == "AGENT_ADDED":
+                agent_info = event["agent_added"]["agent"]["agent_info"]
+                self._agents[agent_info["id"]["value"]] = agent_info["hostname"]
+            elif event_type == "AGENT_REMOVED":
+                self._agents.pop(event["agent_removed"]["agent_id"]["value"], None)
+            else:
+                return
+            self._generation += 1
+            self._condition.notify_all()
+
+    def _reset(self, state):
+        self._frameworks.clear()
+        self._tasks.clear()
+        self._completed_task_ids.clear()
+        self._agents.clear()
+        for framework in state.get("get_frameworks", {}).get("frameworks", []):
+            self._update_framework(framework)
+        for agent in state.get("get_agents", {}).get("agents", []):
+            self._agents[agent["agent_info"]["id"]["value"]] = agent["agent_info"]["hostname"]
+        get_tasks = state.get("get_tasks", {})
+        for task_list in ("tasks", "unreachable_tasks", "completed_tasks"):
+            for task in get_tasks.get(task_list, []):
+                self._update_task(_parse_task(task))
+
+    def _update_framework(self, framework):
+        framework_info = framework["framework_info"]
+        self._frameworks[framework_info["id"]["value"]] = {
+            "id": framework_info["id"]["value"],
+            "name": framework_info["name"],
+            "active": framework.get("active", False),
+        }
+
+    def _update_task(self, task):
+        self._tasks[task["id"]] = task
+        if task["state"] in _TERMINAL_TASK_STATES:
+            self._add_completed_task(task)
+
+    def _update_task_status(self, task_updated):
+        status = task_updated["status"]
+        task = self._tasks.get(status["task_id"]["value"])
+        if task is None:
+            return
+        if task["state"] in _TERMINAL_TASK_STATES:
+            return
+        task["state"] = task_updated["state"]
+        task["statuses"].append(_parse_status(status))
+        if task["state"] in _TERMINAL_TASK_STATES:
+            self._add_completed_task(task)
+
+    def _add_completed_task(self, task):
+        completed_ids = self._completed_task_ids[task["framework_id"]]
+        completed_ids.append(task["id"])
+        while len(completed_ids) > MAX_COMPLETED_TASKS_PER_FRAMEWORK:
+            self._tasks.pop(completed_ids.popleft(), None)
+
+
+class _SubscribeUnsupported(Exception):
+    pass
+
+
+# Duplicated from sdk_tasks.COMPLETED_TASK_STATES, which imports this module.
+_COMPLETED_TASK_STATES = set(
+    [
+        "TASK_KILLED",
+        "TASK_FINISHED",
+        "TASK_LOST",
+        "TASK_GONE_BY_OPERATOR",
+        "TASK_UNREACHABLE",
+        "TASK_UNKNOWN",
+        "TASK_FAILED",
+        "TASK_ERROR",
+        "TASK_DROPPED",
+        "TASK_GONE",
+    ]
+)
+
+# A TASK_UNREACHABLE or TASK_UNKNOWN task may return to TASK_RUNNING once its agent reconnects, so
+# it keeps receiving updates. Like /mesos/frameworks, these are listed under "unreachable_tasks".
+_UNREACHABLE_TASK_STATES = set(["TASK_UNREACHABLE", "TASK_UNKNOWN"])
+
+# Completed states which a task never leaves.
+_TERMINAL_TASK_STATES = _COMPLETED_TASK_STATES - _UNREACHABLE_TASK_STATES
+
+
+def _parse_task(task) -> dict:
+    """Converts a v1 operator API task to the format returned by the master's /tasks endpoint."""
+    resources = {}
+    for resource in task.get("resources", []):
+        if resource.get("type") == "SCALAR":
+            name = resource["name"]
+            resources[name] = resources.get(name, 0) + resource["scalar"]["value"]
+    return {
+        "id": task["task_id"]["value"],
+        "name": task["name"],
+        "framework_id": task["framework_id"]["value"],
+        "executor_id": task.get("executor_id", {}).get("value", ""),
+        "slave_id": task["agent_id"]["value"],
+        "state": task["state"],
+        "resources": resources,
+        "statuses": [_parse_status(status) for status in task.get("statuses", [])],
+    }
+
+
+def _parse_status(status) -> dict:
+    return {"state": status["state"], "timestamp": status.get("timestamp", 0)}
+
+
+def get_live_watcher():
+    """Returns the shared TaskWatcher if it's enabled and currently in sync with the cluster, or
+    None if callers should fetch state from the master themselves. Starts the watcher on first use.
+    """
+    global _watcher
+    if not ENABLED:
+        return None
+    with _watcher_lock:
+        started = False
+        if _watcher is None:
+            _watcher = TaskWatcher()
+            _watcher.start()
+            started = True
+        watcher = _watcher
+    if started:
+        watcher.wait_for_subscription(_STARTUP_TIMEOUT_SECONDS)
+    return watcher if watcher.is_live() else None
+
+
+def stop():
+    """Stops the shared TaskWatcher, if any. It will be restarted on the next get_live_watcher()."""
+    global _watcher
+    with _watcher_lock:
+        watcher = _watcher
+        _watcher = None
+    if watcher is not None:
+        watcher.stop()
+
+
+def get_wait_func(poll_interval_seconds=1):
+    """Returns a `wait_func` for retrying.retry(), which blocks until the next task change when the
+    watcher is live, or otherwise waits `poll_interval_seconds` as wait_fixed would. For example:
+
+        @retrying.retry(wait_func=sdk_task_watcher.get_wait_func(), stop_max_delay=...)
+    """
+    watcher = get_live_watcher()
+    # Changes from before the first attempt are visible to that attempt, so start from here.
+    last_generation = [watcher.generation if watcher else None]
+
+    def wait_func(attempt_number, delay_since_first_attempt_ms):
+        watcher = get_live_watcher()
+        if watcher is None:
+            last_generation[0] = None
+            return poll_interval_seconds * 1000
+        if last_generation[0] is None:
+            # Just (re)subscribed: the table may have changed arbitrarily, so check again now.
+            last_generation[0] = watcher.generation
+            return 0
+        watcher.wait_for_change(last_generation[0], MAX_WAIT_SECONDS)
+        time.sleep(_EVENT_SETTLE_SECONDS)
+        last_generation[0] = watcher.generation
+        return 0
+
+    return wait_func
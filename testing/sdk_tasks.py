@@ -5,17 +5,29 @@ FOR THE TIME BEING WHATEVER MODIFICATIONS ARE APPLIED TO THIS FILE
 SHOULD ALSO BE APPLIED TO sdk_tasks IN ANY OTHER PARTNER REPOS
 ************************************************************************
 """
+import bisect
+import collections
 import logging
+import os
 import retrying
+import threading
+import time
 
 import sdk_agents
 import sdk_cmd
 import sdk_package_registry
 import sdk_plan
+import sdk_task_watcher
 
 
 DEFAULT_TIMEOUT_SECONDS = 30 * 60
 
+# How often task failure counts are sampled for get_tracked_failed_task_count(), in seconds.
+FAILURE_SAMPLE_INTERVAL_SECONDS = float(os.environ.get("DCOS_FAILURE_SAMPLE_INTERVAL", "5"))
+
+# The number of tasks to request at a time when paging through the master's /tasks endpoint.
+TASKS_PAGE_SIZE = int(os.environ.get("DCOS_TASKS_PAGE_SIZE", "1000"))
+
 
 FATAL_TERMINAL_TASK_STATES = set(["TASK_FAILED", "TASK_ERROR", "TASK_DROPPED", "TASK_GONE"])
 
@@ -43,7 +55,9 @@ def check_running(
     agentid_to_hostname = _get_agentid_to_hostname()
 
     @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+        wait_func=sdk_task_watcher.get_wait_func(),
+        stop_max_delay=timeout_seconds * 1000,
+        retry_on_result=lambda res: not res,
     )
     def _check_running():
         tasks = _get_service_tasks(service_name, agentid_to_hostname)
@@ -77,6 +91,18 @@ def check_running(
 class Task(object):
     """Entry value returned by get_summary() and get_service_tasks()"""
 
+    __slots__ = (
+        "name",
+        "host",
+        "state",
+        "is_completed",
+        "id",
+        "executor_id",
+        "framework_id",
+        "agent_id",
+        "resources",
+    )
+
     @staticmethod
     def parse(task_entry, agentid_to_hostname):
         agent_id = task_entry["slave_id"]
@@ -113,17 +139,162 @@ class Task(object):
         )
 
 
-def get_all_status_history(task_name: str, with_completed_tasks=True) -> list:
+class TaskSnapshot(object):
+    """An immutable set of tasks as of a single fetch, indexed for lookups by ID, name, name prefix,
+    agent, host, framework and state. Lookups return lists of Task objects in fetch order, except
+    for with_name_prefix(), which returns tasks sorted by name.
+
+    Build one snapshot per fetch with get_snapshot() and query it repeatedly, rather than filtering
+    a task list once per query. Two snapshots (or a snapshot and a set of task IDs) may be compared
+    with difference().
+    """
+
+    __slots__ = (
+        "_tasks",
+        "_by_id",
+        "_by_name",
+        "_sorted_names",
+        "_by_agent",
+        "_by_host",
+        "_by_framework",
+        "_by_state",
+    )
+
+    def __init__(self, tasks):
+        self._tasks = list(tasks)
+        self._by_id = {}
+        self._by_name = collections.defaultdict(list)
+        self._by_agent = collections.defaultdict(list)
+        self._by_host = collections.defaultdict(list)
+        self._by_framework = collections.defaultdict(list)
+        self._by_state = collections.defaultdict(list)
+        for task in self._tasks:
+            self._by_id[task.id] = task
+            self._by_name[task.name].append(task)
+            self._by_agent[task.agent_id].append(task)
+            self._by_host[task.host].append(task)
+            self._by_framework[task.framework_id].append(task)
+            self._by_state[task.state].append(task)
+        self._sorted_names = sorted(self._by_name.keys())
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __iter__(self):
+        return iter(self._tasks)
+
+    def __contains__(self, task_id):
+        return task_id in self._by_id
+
+    def __repr__(self):
+        return "TaskSnapshot[{} tasks]".format(len(self._tasks))
+
+    def get(self, task_id):
+        """Returns the Task with the provided ID, or None if it isn't in this snapshot."""
+        return self._by_id.get(task_id)
+
+    def ids(self) -> set:
+        return set(self._by_id.keys())
+
+    def with_name(self, name) -> list:
+        return list(self._by_name.get(name, []))
+
+    def with_name_prefix(self, prefix) -> list:
+        if not prefix:
+            return list(self._tasks)
+        tasks = []
+        for i in range(bisect.bisect_left(self._sorted_names, prefix), len(self._sorted_names)):
+            name = self._sorted_names[i]
+            if not name.startswith(prefix):
+                break
+            tasks += self._by_name[name]
+        return tasks
+
+    def on_agent(self, agent_id) -> list:
+        return list(self._by_agent.get(agent_id, []))
+
+    def on_host(self, host) -> list:
+        return list(self._by_host.get(host, []))
+
+    def in_framework(self, framework_id) -> list:
+        return list(self._by_framework.get(framework_id, []))
+
+    def in_state(self, *states) -> list:
+        if len(states) == 1:
+            return list(self._by_state.get(states[0], []))
+        states = set(states)
+        return [task for task in self._tasks if task.state in states]
+
+    def active(self) -> list:
+        return [task for task in self._tasks if not task.is_completed]
+
+    def completed(self) -> list:
+        return [task for task in self._tasks if task.is_completed]
+
+    def difference(self, other) -> list:
+        """Returns the tasks in this snapshot whose IDs are not in `other`, which may be another
+        TaskSnapshot or a collection of task IDs. For example, new_snapshot.difference(old_snapshot)
+        returns the tasks which were launched between the two snapshots."""
+        other_ids = other._by_id if isinstance(other, TaskSnapshot) else other
+        return [task for task in self._tasks if task.id not in other_ids]
+
+
+def get_snapshot(with_completed=False, framework_id=None) -> TaskSnapshot:
+    """Returns an indexed snapshot of all tasks in the cluster.
+
+    : param with_completed: Whether to include tasks which have exited.
+    : param framework_id: Only include tasks from the framework with this ID.
+    """
+    agentid_to_hostname = _get_agentid_to_hostname()
+    tasks = []
+    for entry in _get_cluster_tasks(framework_id):
+        if with_completed or entry["state"] not in COMPLETED_TASK_STATES:
+            tasks.append(Task.parse(entry, agentid_to_hostname))
+    return TaskSnapshot(tasks)
+
+
+def iter_cluster_tasks(framework_id=None, order="asc", page_size=None):
+    """Yields all tasks in the cluster from the master's /tasks endpoint, including completed tasks,
+    as raw task entries. Tasks are fetched a page at a time, so memory use is bounded by the page
+    size regardless of how many tasks the cluster has accumulated.
+
+    : param framework_id: Only fetch tasks from the framework with this ID.
+    : param order: "asc" or "desc", the order in which the master returns tasks.
+    : param page_size: The number of tasks to request at a time, default TASKS_PAGE_SIZE.
+    """
+    page_size = page_size or TASKS_PAGE_SIZE
+    params = {"limit": page_size, "order": order}
+    if framework_id:
+        params["framework_id"] = framework_id
+    offset = 0
+    # Tasks may shift into the next page if the cluster changes while we're paging through them, so
+    # skip any which were already returned in the previous page.
+    previous_page_task_ids = set()
+    while True:
+        params["offset"] = offset
+        tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks", params=params).json()["tasks"]
+        page_task_ids = set()
+        for task in tasks:
+            if task["id"] not in previous_page_task_ids and task["id"] not in page_task_ids:
+                page_task_ids.add(task["id"])
+                yield task
+        previous_page_task_ids = page_task_ids
+        if len(tasks) < page_size:
+            return
+        offset += len(tasks)
+
+
+def get_all_status_history(task_name: str, with_completed_tasks=True, framework_id=None) -> list:
     """Returns a list of task status values(of the form 'TASK_STARTING', 'TASK_KILLED', etc) for
     all instances of a given task. The returned values are ordered chronologically from first to
     last.
 
     : param task_name: The name of the task whose history should be retrieved.
     : param with_completed_tasks: Whether to include the status history of previous versions of the task which had since exited. Unlike with get_service_tasks(), this may include tasks from previous versions of the service.
+    : param framework_id: Only include tasks from the framework with this ID.
     """
-    cluster_tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks").json()["tasks"]
     statuses = []
-    for cluster_task in cluster_tasks:
+    for cluster_task in iter_cluster_tasks(framework_id=framework_id):
         if cluster_task["name"] != task_name:
             # Skip task: wrong name
             continue
@@ -141,18 +312,87 @@ def get_all_status_history(task_name: str, with_completed_tasks=True) -> list:
 
 
 def get_failed_task_count(service_name: str, retry: bool = False) -> int:
-    history_response = sdk_cmd.cluster_request(
-        "GET", "/dcos-history-service/history/last", retry=retry
-    )
-    history_response.raise_for_status()
-    history = history_response.json()
-    service_history = [h for h in history["frameworks"] if h.get("name") == service_name]
+    service_history = [h for h in _get_history(retry) if h.get("name") == service_name]
     if not service_history:
         return 0
 
     assert len(service_history) == 1
 
-    return sum(service_history[0].get(status, 0) for status in FATAL_TERMINAL_TASK_STATES)
+    return _count_failed_tasks(service_history[0])
+
+
+def get_tracked_failed_task_count(service_name: str) -> int:
+    """Like get_failed_task_count(), except that the count is served from a sample which is shared
+    across all callers, and refreshed every FAILURE_SAMPLE_INTERVAL_SECONDS by a background thread.
+    Use this when repeatedly checking failure counts, e.g. while waiting on a plan.
+    """
+    return _failure_tracker.get_count(service_name)
+
+
+def _get_history(retry: bool = False) -> list:
+    history_response = sdk_cmd.cluster_request(
+        "GET", "/dcos-history-service/history/last", retry=retry
+    )
+    history_response.raise_for_status()
+    return history_response.json()["frameworks"]
+
+
+def _count_failed_tasks(framework_history: dict) -> int:
+    return sum(framework_history.get(status, 0) for status in FATAL_TERMINAL_TASK_STATES)
+
+
+class _FailureTracker(object):
+    """Periodically samples task failure counts for all services from the history service, using a
+    single background thread regardless of how many callers there are. The thread exits when there
+    have been no callers for a while, and is restarted on demand."""
+
+    # How long to wait for the first sample before giving up.
+    _FIRST_SAMPLE_TIMEOUT_SECONDS = 60
+    # How long the sampler keeps running after the last call to get_count().
+    _IDLE_TIMEOUT_SECONDS = 60
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._counts = None  # service name => failure count, or None if not sampled yet
+        self._last_used = 0
+        self._running = False
+
+    def get_count(self, service_name: str) -> int:
+        with self._condition:
+            self._last_used = time.monotonic()
+            if not self._running:
+                self._running = True
+                threading.Thread(
+                    target=self._run, name="sdk_tasks_failure_tracker", daemon=True
+                ).start()
+            if not self._condition.wait_for(
+                lambda: self._counts is not None, timeout=self._FIRST_SAMPLE_TIMEOUT_SECONDS
+            ):
+                raise Exception("Unable to retrieve task failure counts from history service")
+            return self._counts.get(service_name, 0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if time.monotonic() - self._last_used > self._IDLE_TIMEOUT_SECONDS:
+                    # Idle: stop sampling. Drop the (increasingly stale) sample too.
+                    self._running = False
+                    self._counts = None
+                    return
+            try:
+                counts = collections.Counter()
+                for framework_history in _get_history():
+                    counts[framework_history.get("name")] += _count_failed_tasks(framework_history)
+                with self._condition:
+                    self._counts = counts
+                    self._condition.notify_all()
+            except Exception as e:
+                # Keep the previous sample, if any. Callers may keep waiting for the first one.
+                log.info("Failed to sample task failure counts: {}".format(e))
+            time.sleep(FAILURE_SAMPLE_INTERVAL_SECONDS)
+
+
+_failure_tracker = _FailureTracker()
 
 
 def check_task_count(service_name: str, expected_task_count: int) -> list:
@@ -199,7 +439,7 @@ def _get_service_tasks(
 
     Returns a list of Task objects.
     """
-    cluster_frameworks = sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()["frameworks"]
+    cluster_frameworks = _get_cluster_frameworks()
     service_tasks = []
     for fwk in cluster_frameworks:
         if not fwk["name"] == service_name or not fwk["active"]:
@@ -214,22 +454,14 @@ def _get_service_tasks(
     return service_tasks
 
 
-def get_summary(with_completed=False, task_name=None) -> list:
+def get_summary(with_completed=False, task_name=None, framework_id=None) -> list:
     """Returns a summary of all cluster tasks in the cluster, or just a specified task.
     This may be used instead of invoking 'dcos task [--all]' directly.
 
     Returns a list of Task objects.
     """
-    cluster_tasks = sdk_cmd.cluster_request("GET", "/mesos/tasks").json()["tasks"]
-    agentid_to_hostname = _get_agentid_to_hostname()
-    all_tasks = [Task.parse(entry, agentid_to_hostname) for entry in cluster_tasks]
-    output = (
-        all_tasks
-        if with_completed
-        else list(filter(lambda t: t.state not in COMPLETED_TASK_STATES, all_tasks))
-    )
-    if task_name:
-        output = list(filter(lambda t: t.name == task_name, output))
+    snapshot = get_snapshot(with_completed, framework_id=framework_id)
+    output = snapshot.with_name(task_name) if task_name else list(snapshot)
     log.info(
         "Task summary (with_completed={}, task_name=[{}]):\n- {}".format(
             with_completed, task_name, "\n- ".join([str(e) for e in output])
@@ -239,9 +471,33 @@ def get_summary(with_completed=False, task_name=None) -> list:
 
 
 def _get_agentid_to_hostname() -> dict:
+    watcher = sdk_task_watcher.get_live_watcher()
+    if watcher:
+        return watcher.get_agentid_to_hostname()
     return {agent["id"]: agent["hostname"] for agent in sdk_agents.get_agents()}
 
 
+def _get_cluster_frameworks() -> list:
+    """Returns all frameworks in the cluster, in the format of the master's /frameworks endpoint.
+    Served from the task watcher when it's live, otherwise fetched from the master."""
+    watcher = sdk_task_watcher.get_live_watcher()
+    if watcher:
+        return watcher.get_frameworks()
+    return sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()["frameworks"]
+
+
+def _get_cluster_tasks(framework_id=None):
+    """Returns all tasks in the cluster, in the format of the master's /tasks endpoint.
+    Served from the task watcher when it's live, otherwise paged from the master."""
+    watcher = sdk_task_watcher.get_live_watcher()
+    if watcher:
+        tasks = watcher.get_tasks()
+        if framework_id:
+            tasks = [t for t in tasks if t["framework_id"] == framework_id]
+        return tasks
+    return iter_cluster_tasks(framework_id=framework_id)
+
+
 def get_tasks_avoiding_scheduler(service_name, task_name_pattern) -> list:
     """Returns a list of tasks which are not located on the Scheduler's machine.
 
@@ -254,25 +510,20 @@ def get_tasks_avoiding_scheduler(service_name, task_name_pattern) -> list:
     skip_tasks = {sdk_package_registry.PACKAGE_REGISTRY_SERVICE_NAME}
     server_tasks = [
         task
-        for task in get_summary()
+        for task in get_snapshot()
         if task.name not in skip_tasks and task_name_pattern.match(task.name)
     ]
 
-    agentid_to_hostname = _get_agentid_to_hostname()
+    marathon_tasks = TaskSnapshot(_get_service_tasks("marathon", _get_agentid_to_hostname()))
 
-    scheduler_ips = [
-        t.host
-        for t in _get_service_tasks("marathon", agentid_to_hostname, task_prefix=service_name)
-    ]
+    scheduler_ips = [t.host for t in marathon_tasks.with_name_prefix(service_name)]
     log.info("Scheduler [{}] IPs: {}".format(service_name, scheduler_ips))
 
     # Always avoid package registry (if present)
     registry_ips = [
         t.host
-        for t in _get_service_tasks(
-            "marathon",
-            agentid_to_hostname,
-            task_prefix=sdk_package_registry.PACKAGE_REGISTRY_SERVICE_NAME,
+        for t in marathon_tasks.with_name_prefix(
+            sdk_package_registry.PACKAGE_REGISTRY_SERVICE_NAME
         )
     ]
     log.info(
@@ -304,25 +555,27 @@ def check_task_relaunched(
     )
 
     @retrying.retry(
-        wait_fixed=1000,
+        wait_func=sdk_task_watcher.get_wait_func(),
         stop_max_delay=timeout_seconds * 1000,
         retry_on_exception=lambda e: isinstance(e, Exception),
     )
     def _check_task_relaunched():
-        tasks = get_summary(with_completed=True, task_name=task_name)
+        snapshot = get_snapshot(with_completed=True)
+        tasks = snapshot.with_name(task_name)
+        log.info("Tasks named {}:\n- {}".format(task_name, "\n- ".join([str(t) for t in tasks])))
         assert len(tasks) > 0, "No tasks were found with the given task name {}".format(task_name)
+        old_task = snapshot.get(old_task_id)
         assert (
-            len(list(filter(lambda t: t.is_completed and t.id == old_task_id, tasks))) > 0
+            old_task is not None and old_task.name == task_name and old_task.is_completed
         ), "Unable to find any completed tasks with id {}".format(old_task_id)
         assert (
             len(
-                list(
-                    filter(
-                        lambda t: t.id != old_task_id
-                        and (not t.is_completed if ensure_new_task_not_completed else True),
-                        tasks,
-                    )
-                )
+                [
+                    t
+                    for t in tasks
+                    if t.id != old_task_id
+                    and (not t.is_completed if ensure_new_task_not_completed else True)
+                ]
             )
             > 0
         ), "Unable to find any new tasks with name {} with (ensure_new_task_not_completed:{})".format(
@@ -341,7 +594,9 @@ def check_scheduler_relaunched(
     """
 
     @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+        wait_func=sdk_task_watcher.get_wait_func(),
+        stop_max_delay=timeout_seconds * 1000,
+        retry_on_result=lambda res: not res,
     )
     def fn():
         task_ids = set([t.id for t in get_service_tasks("marathon", task_prefix=service_name)])
@@ -359,10 +614,9 @@ def check_task_not_relaunched(
             task_name, old_task_id
         )
     )
-    sdk_plan.wait_for_completed_deployment(service_name, multiservice_name=multiservice_name)
-    sdk_plan.wait_for_completed_recovery(service_name, multiservice_name=multiservice_name)
+    sdk_plan.wait_for_quiescence(service_name, multiservice_name=multiservice_name)
 
-    task_ids = set([t.id for t in get_summary(with_completed) if t.name == task_name])
+    task_ids = set([t.id for t in get_snapshot(with_completed).with_name(task_name)])
     assert old_task_id in task_ids, "Old task id {} was not found in task_ids {}".format(
         old_task_id, task_ids
     )
@@ -379,7 +633,9 @@ def check_tasks_updated(
         prefix_clause = ' starting with "{}"'.format(prefix)
 
     @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+        wait_func=sdk_task_watcher.get_wait_func(),
+        stop_max_delay=timeout_seconds * 1000,
+        retry_on_result=lambda res: not res,
     )
     def _check_tasks_updated():
         task_ids = get_task_ids(service_name, prefix)
@@ -424,8 +680,7 @@ def check_tasks_updated(
 
 
 def check_tasks_not_updated(service_name, prefix, old_task_ids):
-    sdk_plan.wait_for_completed_deployment(service_name)
-    sdk_plan.wait_for_completed_recovery(service_name)
+    sdk_plan.wait_for_quiescence(service_name)
     task_ids = get_task_ids(service_name, prefix)
     task_sets = "\n- Old tasks: {}\n- Current tasks: {}".format(
         sorted(old_task_ids), sorted(task_ids)
@@ -443,11 +698,13 @@ def wait_for_active_framework(service_name, timeout_seconds=DEFAULT_TIMEOUT_SECO
     log.info("Waiting until [{}] is active".format(service_name))
 
     @retrying.retry(
-        wait_fixed=1000, stop_max_delay=timeout_seconds * 1000, retry_on_result=lambda res: not res
+        wait_func=sdk_task_watcher.get_wait_func(),
+        stop_max_delay=timeout_seconds * 1000,
+        retry_on_result=lambda res: not res,
     )
     def _wait_for_active_framework():
         return len(list(filter(
             lambda fwk: fwk["name"] == service_name and fwk["active"],
-            sdk_cmd.cluster_request("GET", "/mesos/frameworks").json()["frameworks"]
+            _get_cluster_frameworks()
         ))) > 0
     _wait_for_active_framework()
@@ -11,6 +11,7 @@ import tempfile
 import traceback
 
 import sdk_cmd
+import sdk_cosmos
 import sdk_install
 import sdk_marathon
 import sdk_plan
@@ -106,7 +107,7 @@ def soak_upgrade_downgrade(
     timeout_seconds=TIMEOUT_SECONDS,
     wait_for_deployment=True,
 ):
-    sdk_cmd.run_cli("package install --cli {} --yes".format(package_name))
+    sdk_install.install_cli(package_name, check=False)
     version = "stub-universe"
     log.info("Upgrading to test version: {} {}".format(package_name, version))
     update_or_upgrade_or_downgrade(
@@ -134,8 +135,7 @@ def soak_upgrade_downgrade(
 
 
 def _get_universe_url():
-    _, stdout, _ = sdk_cmd.run_cli("package repo list --json")
-    repositories = json.loads(stdout)["repositories"]
+    repositories = sdk_repository.list_repos()
     for repo in repositories:
         if repo["name"] == "Universe":
             log.info("Found Universe URL: {}".format(repo["uri"]))
@@ -213,11 +213,7 @@ def _update_service_with_cli(
     if to_package_version:
         # we must manually upgrade the package CLI because it's not done automatically in this flow
         # (and why should it? that'd imply the package CLI replacing itself via a call to the main CLI...)
-        sdk_cmd.run_cli(
-            "package install --yes --cli --package-version={} {}".format(
-                to_package_version, package_name
-            )
-        )
+        sdk_install.install_cli(package_name, to_package_version, check=False)
 
 
 def _wait_for_deployment(package_name, service_name, initial_config, task_ids, timeout_seconds):
@@ -244,6 +240,17 @@ def _wait_for_deployment(package_name, service_name, initial_config, task_ids, t
     wait_fixed=1000, stop_max_delay=10 * 1000, retry_on_result=lambda result: result is None
 )
 def _get_pkg_version(package_name):
+    if sdk_cosmos.ENABLED:
+        try:
+            return _extract_pkg_version(sdk_cosmos.describe(package_name))
+        except Exception:
+            log.warning(
+                "Failed to get package version of {} via package API, falling back to CLI".format(
+                    package_name
+                )
+            )
+            log.warning(traceback.format_exc())
+
     cmd = "package describe {}".format(package_name)
     # Only log stdout/stderr if there's actually an error.
     rc, stdout, stderr = sdk_cmd.run_cli(cmd, print_output=False)
@@ -251,13 +258,7 @@ def _get_pkg_version(package_name):
         log.warning('Failed to run "{}":\nSTDOUT:\n{}\nSTDERR:\n{}'.format(cmd, stdout, stderr))
         return None
     try:
-        describe = json.loads(stdout)
-        # New location (either 1.10+ or 1.11+):
-        version = describe.get("package", {}).get("version", None)
-        if version is None:
-            # Old location (until 1.9 or until 1.10):
-            version = describe["version"]
-        return version
+        return _extract_pkg_version(json.loads(stdout))
     except Exception:
         log.warning(
             'Failed to extract package version from "{}":\nSTDOUT:\n{}\nSTDERR:\n{}'.format(
@@ -268,6 +269,15 @@ def _get_pkg_version(package_name):
         return None
 
 
+def _extract_pkg_version(describe):
+    # New location (either 1.10+ or 1.11+):
+    version = describe.get("package", {}).get("version", None)
+    if version is None:
+        # Old location (until 1.9 or until 1.10):
+        version = describe["version"]
+    return version
+
+
 @retrying.retry(
     wait_fixed=1000, stop_max_delay=60 * 1000, retry_on_result=lambda result: result is None
 )
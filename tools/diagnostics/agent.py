@@ -1,6 +1,9 @@
+import json
 import logging
 import os
 import re
+import shutil
+import threading
 from typing import List
 
 import sdk_cmd
@@ -9,6 +12,12 @@ import config
 
 logger = logging.getLogger(__name__)
 
+# The maximum number of bytes to request in each files/read call.
+READ_CHUNK_BYTES = 1024 * 1024
+
+# The number of bytes to compare when checking whether a file on an agent has only grown.
+IDENTITY_CHECK_BYTES = 4096
+
 
 def is_http_server_error(http_status_code: int) -> bool:
     return http_status_code >= 500 and http_status_code <= 599
@@ -79,8 +88,14 @@ def browse_task_sandbox(agent_id: str, executor_sandbox_path: str, task_id: str)
 
 @config.retry
 def download_agent_path(
-    agent_id: str, agent_file_path: str, output_file_path: str, chunk_size: int = 8192
+    agent_id: str,
+    agent_file_path: str,
+    output_file_path: str,
+    chunk_size: int = 8192,
+    max_bytes: int = None,
 ) -> None:
+    """Downloads the file from the agent. If max_bytes is provided, only that many bytes are kept,
+    e.g. to match the size listed by files/browse for a file which is still being written."""
     stream = sdk_cmd.cluster_request(
         "GET",
         "/slave/{}/files/download?path={}".format(agent_id, agent_file_path),
@@ -94,30 +109,214 @@ def download_agent_path(
         raise Exception(stream)
 
     if stream.status_code == 404:
+        # Release the pooled connection without reading the (unused) body.
+        stream.close()
         return
 
     if not stream.ok:
         # Retry.
         raise Exception(stream)
 
-    with open(output_file_path, "wb") as f:
-        for chunk in stream.iter_content(chunk_size=chunk_size):
-            f.write(chunk)
+    byte_count = 0
+    try:
+        with open(output_file_path, "wb") as f:
+            for chunk in stream.iter_content(chunk_size=chunk_size):
+                if max_bytes is not None:
+                    chunk = chunk[: max_bytes - byte_count]
+                f.write(chunk)
+                byte_count += len(chunk)
+                if max_bytes is not None and byte_count >= max_bytes:
+                    break
+    finally:
+        stream.close()
+
+
+def read_agent_path_range(agent_id: str, agent_file_path: str, offset: int, length: int):
+    """Yields the bytes [offset, offset + length) of the file on the agent in chunks, using the
+    agent's files/read API. Stops early if the file is shorter."""
+    end = offset + length
+    while offset < end:
+        response = sdk_cmd.cluster_request(
+            "GET",
+            "/slave/{}/files/read".format(agent_id),
+            params={
+                "path": agent_file_path,
+                "offset": offset,
+                "length": min(end - offset, READ_CHUNK_BYTES),
+            },
+            retry=False,
+            raise_on_error=False,
+            log_response=False,
+        )
+
+        if not response.ok:
+            # Retry.
+            raise Exception(response)
+
+        # The file's raw bytes are returned as a string with one character per byte.
+        data = response.json()["data"].encode("latin-1")
+        if not data:
+            break
+        yield data
+        offset += len(data)
+
+
+@config.retry
+def append_agent_path_range(
+    agent_id: str, agent_file_path: str, output_file_path: str, offset: int, length: int
+) -> None:
+    """Writes bytes [offset, offset + length) of the file on the agent to the same offset in the
+    existing output file."""
+    with open(output_file_path, "r+b") as f:
+        # Drop anything past the offset, e.g. from a prior attempt.
+        f.truncate(offset)
+        f.seek(offset)
+        for data in read_agent_path_range(agent_id, agent_file_path, offset, length):
+            f.write(data)
+
+
+@config.retry
+def agent_path_has_prefix(agent_id: str, agent_file_path: str, prefix_file_path: str) -> bool:
+    """Returns whether the file on the agent starts with the content of the local file, judging by
+    the last IDENTITY_CHECK_BYTES of the local file. This tells a file which has grown since it was
+    downloaded apart from a different file at the same path, e.g. a new 'stdout' after rotation."""
+    prefix_size = os.path.getsize(prefix_file_path)
+    offset = max(prefix_size - IDENTITY_CHECK_BYTES, 0)
+    with open(prefix_file_path, "rb") as f:
+        f.seek(offset)
+        expected = f.read()
+    actual = b"".join(
+        read_agent_path_range(agent_id, agent_file_path, offset, prefix_size - offset)
+    )
+    return actual == expected
+
+
+class SandboxManifest:
+    """Records the agent files which were downloaded into a bundle, along with their size and mtime
+    as listed by files/browse, in a SANDBOX_MANIFEST_FILE_NAME file in the bundle directory.
+
+    If a prior bundle directory is provided, files which are unchanged since that bundle (same
+    agent path, size, and mtime) are hard-linked from it instead of being downloaded again. Files
+    which have grown since are copied from it, and only the bytes after the prior size are fetched.
+    Files which were replaced since (e.g. 'stdout' and 'stdout.1' after a log rotation) are
+    downloaded in full, even if they're larger than before.
+    """
+
+    SANDBOX_MANIFEST_FILE_NAME = "sandbox_manifest.json"
+
+    def __init__(self, output_directory: str, since_bundle_directory: str = None):
+        self.output_directory = output_directory
+        self.since_bundle_directory = since_bundle_directory
+        # bundle-relative path => {"agent_id": ..., "path": ..., "size": ..., "mtime": ...}
+        self.files = {}
+        self.previous_files = {}
+        self.counts = {"downloaded": 0, "linked": 0, "appended": 0}
+        self._lock = threading.Lock()
+
+        if since_bundle_directory:
+            manifest_path = os.path.join(since_bundle_directory, self.SANDBOX_MANIFEST_FILE_NAME)
+            try:
+                with open(manifest_path) as f:
+                    self.previous_files = json.load(f)["files"]
+                logger.info(
+                    "Found %d files from prior bundle %s", len(self.previous_files), manifest_path
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(
+                    "Could not read prior bundle manifest %s, downloading all files: %s",
+                    manifest_path,
+                    e,
+                )
+
+    def download(self, agent_id: str, file_info: dict, output_file_path: str) -> None:
+        """Downloads the agent file described by the files/browse entry to the output path."""
+        relative_path = os.path.relpath(output_file_path, self.output_directory)
+        entry = {
+            "agent_id": agent_id,
+            "path": file_info["path"],
+            "size": file_info["size"],
+            "mtime": file_info["mtime"],
+        }
+        previous_entry = self.previous_files.get(relative_path)
+        previous_file_path = (
+            os.path.join(self.since_bundle_directory, relative_path) if previous_entry else None
+        )
+        if (
+            previous_entry
+            and previous_entry["agent_id"] == agent_id
+            and previous_entry["path"] == entry["path"]
+            and os.path.isfile(previous_file_path)
+            and os.path.getsize(previous_file_path) == previous_entry["size"]
+        ):
+            unchanged = previous_entry["size"] == entry["size"] and (
+                previous_entry["mtime"] == entry["mtime"]
+            )
+            if unchanged:
+                self._link_or_copy(previous_file_path, output_file_path)
+                self._record(relative_path, entry, "linked")
+                return
+            if entry["size"] > previous_entry["size"] and agent_path_has_prefix(
+                agent_id, entry["path"], previous_file_path
+            ):
+                shutil.copyfile(previous_file_path, output_file_path)
+                append_agent_path_range(
+                    agent_id,
+                    entry["path"],
+                    output_file_path,
+                    previous_entry["size"],
+                    entry["size"] - previous_entry["size"],
+                )
+                self._record(relative_path, entry, "appended")
+                return
+        download_agent_path(agent_id, entry["path"], output_file_path, max_bytes=entry["size"])
+        self._record(relative_path, entry, "downloaded")
+
+    def write(self) -> None:
+        manifest_path = os.path.join(self.output_directory, self.SANDBOX_MANIFEST_FILE_NAME)
+        with self._lock:
+            with open(manifest_path, "w") as f:
+                json.dump({"files": self.files}, f, indent=2, sort_keys=True)
+            logger.info(
+                "Wrote %s: %d files downloaded, %d unchanged files linked from prior bundle, "
+                + "%d grown files appended to",
+                manifest_path,
+                self.counts["downloaded"],
+                self.counts["linked"],
+                self.counts["appended"],
+            )
+
+    def _link_or_copy(self, source_path: str, output_file_path: str) -> None:
+        try:
+            os.link(source_path, output_file_path)
+        except OSError:
+            # e.g. the bundles are on different filesystems
+            shutil.copyfile(source_path, output_file_path)
+
+    def _record(self, relative_path: str, entry: dict, how: str) -> None:
+        with self._lock:
+            self.files[relative_path] = entry
+            self.counts[how] += 1
 
 
 def download_sandbox_files(
-    agent_id: str, sandbox: List[dict], output_base_path: str, patterns_to_download: List[str] = []
+    agent_id: str,
+    sandbox: List[dict],
+    output_base_path: str,
+    patterns_to_download: List[str] = [],
+    sandbox_manifest: SandboxManifest = None,
 ) -> List[dict]:
     if not os.path.exists(output_base_path):
-        os.makedirs(output_base_path)
+        os.makedirs(output_base_path, exist_ok=True)
 
     for task_file in sandbox:
         task_file_basename = os.path.basename(task_file["path"])
         for pattern in patterns_to_download:
             if re.match(pattern, task_file_basename):
-                download_agent_path(
-                    agent_id, task_file["path"], os.path.join(output_base_path, task_file_basename)
-                )
+                output_file_path = os.path.join(output_base_path, task_file_basename)
+                if sandbox_manifest:
+                    sandbox_manifest.download(agent_id, task_file, output_file_path)
+                else:
+                    download_agent_path(agent_id, task_file["path"], output_file_path)
 
 
 def download_task_files(
@@ -126,6 +325,7 @@ def download_task_files(
     task_id: str,
     base_path: str,
     patterns_to_download: List[str] = [],
+    sandbox_manifest: SandboxManifest = None,
 ) -> List[dict]:
     executor_sandbox = browse_executor_sandbox(agent_id, executor_sandbox_path)
     pod_task_sandbox = browse_task_sandbox(agent_id, executor_sandbox_path, task_id)
@@ -134,14 +334,24 @@ def download_task_files(
     if pod_task_sandbox:
         output_pod_task_directory = os.path.join(base_path, task_id, "task")
         download_sandbox_files(
-            agent_id, executor_sandbox, output_pod_task_directory, patterns_to_download
+            agent_id,
+            executor_sandbox,
+            output_pod_task_directory,
+            patterns_to_download,
+            sandbox_manifest,
         )
 
         output_executor_directory = os.path.join(base_path, task_id, "executor")
         download_sandbox_files(
-            agent_id, pod_task_sandbox, output_executor_directory, patterns_to_download
+            agent_id,
+            pod_task_sandbox,
+            output_executor_directory,
+            patterns_to_download,
+            sandbox_manifest,
         )
     # Scheduler task: no parent executor, only download files under its sandbox.
     else:
         output_directory = os.path.join(base_path, task_id)
-        download_sandbox_files(agent_id, executor_sandbox, output_directory, patterns_to_download)
+        download_sandbox_files(
+            agent_id, executor_sandbox, output_directory, patterns_to_download, sandbox_manifest
+        )
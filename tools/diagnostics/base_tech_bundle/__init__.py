@@ -1,14 +1,84 @@
+import re
+import uuid
+from typing import Dict, Tuple
+
 from service_bundle import ServiceBundle
 
 
 class BaseTechBundle(ServiceBundle):
-    def task_exec(self):
+    def task_exec(self, task_id, cmd):
         raise NotImplementedError
 
+    def task_exec_batch(self, task_id, commands: Dict[str, str]) -> Dict[str, Tuple[int, str, str]]:
+        """Runs several commands in a single task_exec() session, instead of one session each.
+
+        The output of each command is delimited with markers, and then split back out again.
+        Returns a mapping of each command's key to its (exit code, stdout, stderr). Commands whose
+        output couldn't be found (e.g. because the exec itself failed) get the exec's exit code (or
+        1 if that was 0), and its full stderr.
+        """
+        token = uuid.uuid4().hex
+        keys = list(commands.keys())
+        script = "{{ {}; }}".format(
+            "; ".join(
+                _BATCH_COMMAND.format(
+                    begin=_batch_marker(token, "BEGIN", index),
+                    end=_batch_marker(token, "END", index),
+                    cmd=commands[key],
+                )
+                for index, key in enumerate(keys)
+            )
+        )
+        rc, stdout, stderr = self.task_exec(task_id, script)
+
+        stdouts = _split_batch_output(token, stdout)
+        stderrs = _split_batch_output(token, stderr)
+        results = {}
+        for index, key in enumerate(keys):
+            if index in stdouts and stdouts[index][1] is not None:
+                command_stdout, command_rc = stdouts[index]
+                command_stderr = stderrs.get(index, ("", None))[0]
+                results[key] = (command_rc, command_stdout, command_stderr)
+            else:
+                results[key] = (rc or 1, stdouts.get(index, ("", None))[0], stderr)
+        return results
+
     def create(self):
         raise NotImplementedError
 
 
+# Surrounds a command in task_exec_batch() with markers in both stdout and stderr. The exit code of
+# the command is included in the end marker in stdout. The end markers are preceded by an extra
+# newline, so that they're on their own line even if the command's output doesn't end with one.
+_BATCH_COMMAND = (
+    'echo "{begin}"; echo "{begin}" >&2; {cmd}; __batch_rc=$?; '
+    + 'echo; echo "{end} $__batch_rc"; echo >&2; echo "{end}" >&2'
+)
+
+
+def _batch_marker(token: str, kind: str, index: int) -> str:
+    return "__BATCH_{}_{}_{}__".format(token, kind, index)
+
+
+def _split_batch_output(token: str, output: str) -> Dict[int, Tuple[str, int]]:
+    """Returns a mapping of command index => (output, exit code) from task_exec_batch() output.
+    The exit code is only available in stdout, and is None otherwise. The command's output is
+    returned as is, without the newline which was added before the end marker."""
+    pattern = re.compile(
+        r"{begin}\n(.*?)\n{end}(?: (\d+))?\n?".format(
+            begin=_batch_marker(token, "BEGIN", r"(\d+)"), end=_batch_marker(token, "END", r"\1")
+        ),
+        re.DOTALL,
+    )
+    return {
+        int(match.group(1)): (
+            match.group(2),
+            int(match.group(3)) if match.group(3) is not None else None,
+        )
+        for match in pattern.finditer(output or "")
+    }
+
+
 from .cassandra_bundle import CassandraBundle  # noqa: E402
 from .elastic_bundle import ElasticBundle  # noqa: E402
 from .hdfs_bundle import HdfsBundle  # noqa: E402
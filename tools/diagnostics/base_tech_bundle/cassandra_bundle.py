@@ -22,35 +22,35 @@ class CassandraBundle(BaseTechBundle):
 
         return sdk_cmd.marathon_task_exec(task_id, "bash -c '{}'".format(full_cmd))
 
-    def create_nodetool_status_file(self, task_id):
-        rc, stdout, stderr = self.task_exec(task_id, "${CASSANDRA_DIRECTORY}/bin/nodetool status")
-
-        if rc != 0 or stderr:
-            logger.error(
-                "Could not get Cassandra nodetool stats\nstdout: '%s'\nstderr: '%s'", stdout, stderr
-            )
-        else:
-            self.write_file("cassandra_nodetool_status_{}.txt".format(task_id), stdout)
-
-    def create_nodetool_tpstats_file(self, task_id):
-        rc, stdout, stderr = self.task_exec(task_id, "${CASSANDRA_DIRECTORY}/bin/nodetool tpstats")
-
-        if rc != 0 or stderr:
-            logger.error(
-                "Could not get Cassandra nodetool tpstats\nstdout: '%s'\nstderr: '%s'",
-                stdout,
-                stderr,
-            )
-        else:
-            self.write_file("cassandra_nodetool_tpstats_{}.txt".format(task_id), stdout)
-
-    def create_tasks_nodetool_status_files(self):
-        self.for_each_running_task_with_prefix("node", self.create_nodetool_status_file)
-
-    def create_tasks_nodetool_tpstats_files(self):
-        self.for_each_running_task_with_prefix("node", self.create_nodetool_tpstats_file)
+    # Filename prefix => nodetool subcommand. These are all run in a single exec session per task.
+    NODETOOL_COMMANDS = {
+        "cassandra_nodetool_status": "status",
+        "cassandra_nodetool_tpstats": "tpstats",
+    }
+
+    def create_nodetool_files(self, task_id):
+        results = self.task_exec_batch(
+            task_id,
+            {
+                prefix: "${{CASSANDRA_DIRECTORY}}/bin/nodetool {}".format(subcommand)
+                for prefix, subcommand in self.NODETOOL_COMMANDS.items()
+            },
+        )
+
+        for prefix, (rc, stdout, stderr) in results.items():
+            if rc != 0 or stderr:
+                logger.error(
+                    "Could not get Cassandra nodetool %s\nstdout: '%s'\nstderr: '%s'",
+                    self.NODETOOL_COMMANDS[prefix],
+                    stdout,
+                    stderr,
+                )
+            else:
+                self.write_file("{}_{}.txt".format(prefix, task_id), stdout)
+
+    def create_tasks_nodetool_files(self):
+        self.for_each_running_task_with_prefix("node", self.create_nodetool_files)
 
     def create(self):
         logger.info("Creating Cassandra bundle")
-        self.create_tasks_nodetool_status_files()
-        self.create_tasks_nodetool_tpstats_files()
+        self.create_tasks_nodetool_files()
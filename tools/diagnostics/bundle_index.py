@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+
+# Builds and queries a full-text index over a service diagnostics bundle directory.
+#
+# Usage:
+#   ./bundle_index.py build <bundle directory>
+#   ./bundle_index.py query <bundle directory> 'some words' [--context=3]
+#   ./bundle_index.py exceptions <bundle directory>
+#
+# The index is a SQLite database stored beside the bundle directory (e.g.
+# 'my-dcos-cluster_prod__cassandra_20180912T142246Z.index.sqlite'), so it isn't included when the
+# bundle is zipped, and is reused by later commands. Each command first re-indexes any files which
+# were added or changed since. Only depends on the Python standard library.
+
+from array import array
+from collections import Counter
+from typing import Dict, List, Tuple
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE_SUFFIX = ".index.sqlite"
+
+# Bundle-relative paths of the files to index.
+INDEXED_PATH_PATTERNS = [
+    r"^tasks/",
+    r"^service_plan_status_.*\.json$",
+    r"^service_v1_configuration_.*\.json$",
+]
+
+# Bump when the schema or tokenization changes, so that existing indexes are rebuilt.
+SCHEMA_VERSION = 1
+
+# Tokens are case-insensitive runs of word characters. Single characters (e.g. the 'a' in 'a.b')
+# would match nearly every line, and very long tokens are nearly always encoded data.
+TOKEN_PATTERN = re.compile(rb"[a-z0-9_]{2,64}")
+
+EXCEPTION_PATTERN = re.compile(
+    # e.g. 'java.lang.OutOfMemoryError', 'org.apache.cassandra.exceptions.UnavailableException'
+    rb"\b((?:[a-z_$][\w$]*\.)+[A-Z][\w$]*(?:Exception|Error|Throwable))\b"
+    # e.g. 'IOException', 'KeyError'
+    + rb"|\b([A-Z][\w$]*(?:Exception|Error))\b"
+)
+
+_SCHEMA = [
+    """
+    CREATE TABLE files (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        line_offsets BLOB NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE postings (
+        token TEXT NOT NULL,
+        file_id INTEGER NOT NULL,
+        lines BLOB NOT NULL,
+        PRIMARY KEY (token, file_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX postings_file_id ON postings (file_id)",
+    """
+    CREATE TABLE exceptions (
+        name TEXT NOT NULL,
+        file_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        first_line INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX exceptions_file_id ON exceptions (file_id)",
+]
+
+# Line numbers (0-based) within a file, and byte offsets of the start of each line.
+_LINES_TYPECODE = "I"
+_OFFSETS_TYPECODE = "Q"
+
+
+def index_path(bundle_directory: str) -> str:
+    return os.path.normpath(bundle_directory) + INDEX_FILE_SUFFIX
+
+
+def tokenize(data: bytes) -> List[str]:
+    return [token.decode("ascii") for token in TOKEN_PATTERN.findall(data.lower())]
+
+
+def find_exceptions(line: bytes) -> List[str]:
+    return [
+        (qualified or unqualified).decode("utf-8", "replace")
+        for qualified, unqualified in EXCEPTION_PATTERN.findall(line)
+    ]
+
+
+def list_bundle_files(bundle_directory: str) -> List[str]:
+    """Returns the bundle-relative paths of all files which should be indexed."""
+    patterns = [re.compile(pattern) for pattern in INDEXED_PATH_PATTERNS]
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(bundle_directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.relpath(os.path.join(dirpath, filename), bundle_directory)
+            path = path.replace(os.sep, "/")
+            if any(pattern.search(path) for pattern in patterns):
+                paths.append(path)
+    return paths
+
+
+def index_file(args: Tuple[str, str]) -> Tuple[str, int, float, bytes, Dict[str, bytes], dict]:
+    """Reads the file in a single streaming pass, and returns
+    (path, size, mtime, line offsets, token => line numbers, exception name => (count, first line)).
+
+    Runs in a worker process, so takes and returns picklable values only."""
+    bundle_directory, path = args
+    full_path = os.path.join(bundle_directory, path)
+    stat = os.stat(full_path)
+    line_offsets = array(_OFFSETS_TYPECODE)
+    postings = {}  # type: Dict[str, array]
+    exception_counts = Counter()  # type: Counter
+    exception_first_lines = {}  # type: Dict[str, int]
+    offset = 0
+    with open(full_path, "rb") as f:
+        for line_number, line in enumerate(f):
+            line_offsets.append(offset)
+            offset += len(line)
+            for token in set(tokenize(line)):
+                lines = postings.get(token)
+                if lines is None:
+                    lines = postings[token] = array(_LINES_TYPECODE)
+                lines.append(line_number)
+            for name in set(find_exceptions(line)):
+                exception_counts[name] += 1
+                exception_first_lines.setdefault(name, line_number)
+    # The end of the last line.
+    line_offsets.append(offset)
+    return (
+        path,
+        stat.st_size,
+        stat.st_mtime,
+        line_offsets.tobytes(),
+        {token: lines.tobytes() for token, lines in postings.items()},
+        {name: (count, exception_first_lines[name]) for name, count in exception_counts.items()},
+    )
+
+
+def open_index(bundle_directory: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(index_path(bundle_directory))
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        if version != 0:
+            log.info("Index schema version %d is outdated, rebuilding", version)
+        for (table,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall():
+            connection.execute("DROP TABLE {}".format(table))
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        connection.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        connection.commit()
+    return connection
+
+
+def build(bundle_directory: str, workers: int = None) -> sqlite3.Connection:
+    """Creates or updates the bundle's index. Files which are unchanged since they were last
+    indexed (same size and mtime) are skipped, so this is cheap to run on an existing index."""
+    start = time.time()
+    connection = open_index(bundle_directory)
+    connection.execute("PRAGMA synchronous = OFF")
+
+    indexed = {
+        path: (file_id, size, mtime)
+        for file_id, path, size, mtime in connection.execute(
+            "SELECT id, path, size, mtime FROM files"
+        )
+    }
+    paths = list_bundle_files(bundle_directory)
+    removed_paths = set(indexed.keys()).difference(paths)
+    stale_file_ids = [indexed[path][0] for path in removed_paths]
+    to_index = []
+    for path in paths:
+        stat = os.stat(os.path.join(bundle_directory, path))
+        if path in indexed:
+            file_id, size, mtime = indexed[path]
+            if size == stat.st_size and mtime == stat.st_mtime:
+                continue
+            stale_file_ids.append(file_id)
+        to_index.append(path)
+
+    with connection:
+        for file_id in stale_file_ids:
+            _delete_file(connection, file_id)
+
+    if to_index:
+        log.info("Indexing %d of %d files in %s", len(to_index), len(paths), bundle_directory)
+        workers = max(1, min(workers or os.cpu_count() or 1, len(to_index)))
+        with multiprocessing.Pool(workers) as pool:
+            # Larger files first, so that a large file at the end doesn't leave workers idle.
+            to_index.sort(key=lambda path: -os.path.getsize(os.path.join(bundle_directory, path)))
+            results = pool.imap_unordered(
+                index_file, [(bundle_directory, path) for path in to_index]
+            )
+            with connection:
+                for result in results:
+                    _insert_file(connection, *result)
+
+    if to_index or removed_paths:
+        log.info(
+            "Updated index %s: %d files indexed, %d files removed in %.1fs",
+            index_path(bundle_directory),
+            len(to_index),
+            len(removed_paths),
+            time.time() - start,
+        )
+    return connection
+
+
+def _delete_file(connection: sqlite3.Connection, file_id: int) -> None:
+    connection.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+    connection.execute("DELETE FROM exceptions WHERE file_id = ?", (file_id,))
+    connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+
+def _insert_file(
+    connection: sqlite3.Connection,
+    path: str,
+    size: int,
+    mtime: float,
+    line_offsets: bytes,
+    postings: Dict[str, bytes],
+    exceptions: dict,
+) -> None:
+    file_id = connection.execute(
+        "INSERT INTO files (path, size, mtime, line_offsets) VALUES (?, ?, ?, ?)",
+        (path, size, mtime, line_offsets),
+    ).lastrowid
+    connection.executemany(
+        "INSERT INTO postings (token, file_id, lines) VALUES (?, ?, ?)",
+        ((token, file_id, lines) for token, lines in postings.items()),
+    )
+    connection.executemany(
+        "INSERT INTO exceptions (name, file_id, count, first_line) VALUES (?, ?, ?, ?)",
+        ((name, file_id, count, first_line) for name, (count, first_line) in exceptions.items()),
+    )
+
+
+def _to_array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def search(
+    connection: sqlite3.Connection, query: str, limit: int = None
+) -> List[Tuple[int, str, int]]:
+    """Returns (file id, path, 0-based line number) for lines which contain all of the query's
+    tokens, ordered by path and line number."""
+    tokens = sorted(set(tokenize(query.encode("utf-8"))))
+    if not tokens:
+        raise ValueError("Query '{}' doesn't contain any searchable words".format(query))
+
+    postings_by_token = []
+    for token in tokens:
+        postings = dict(
+            connection.execute(
+                "SELECT file_id, lines FROM postings WHERE token = ?", (token,)
+            ).fetchall()
+        )
+        if not postings:
+            return []
+        postings_by_token.append(postings)
+    # Start with the rarest token, which narrows down the files the most.
+    postings_by_token.sort(key=len)
+
+    lines_by_file_id = {}  # type: Dict[int, set]
+    for file_id, lines in postings_by_token[0].items():
+        matching_lines = set(_to_array(_LINES_TYPECODE, lines))
+        for postings in postings_by_token[1:]:
+            if file_id not in postings:
+                matching_lines = None
+                break
+            matching_lines.intersection_update(_to_array(_LINES_TYPECODE, postings[file_id]))
+            if not matching_lines:
+                break
+        if matching_lines:
+            lines_by_file_id[file_id] = matching_lines
+
+    paths = dict(
+        connection.execute(
+            "SELECT id, path FROM files WHERE id IN ({})".format(
+                ",".join(str(file_id) for file_id in lines_by_file_id.keys())
+            )
+        ).fetchall()
+    )
+    matches = sorted(
+        (paths[file_id], line_number, file_id)
+        for file_id, lines in lines_by_file_id.items()
+        for line_number in lines
+    )
+    return [(file_id, path, line_number) for path, line_number, file_id in matches[:limit]]
+
+
+def print_matches(
+    connection: sqlite3.Connection,
+    bundle_directory: str,
+    matches: List[Tuple[int, str, int]],
+    context: int,
+) -> None:
+    """Prints the matching lines and the lines around them, in the same format as 'grep -n -C'.
+    Only the printed lines are read from the bundle, using the indexed line offsets."""
+    lines_by_file_id = {}  # type: Dict[int, List[int]]
+    paths = {}  # type: Dict[int, str]
+    for file_id, path, line_number in matches:
+        lines_by_file_id.setdefault(file_id, []).append(line_number)
+        paths[file_id] = path
+
+    first_range = True
+    for file_id, line_numbers in lines_by_file_id.items():
+        path = paths[file_id]
+        line_offsets = _to_array(
+            _OFFSETS_TYPECODE,
+            connection.execute(
+                "SELECT line_offsets FROM files WHERE id = ?", (file_id,)
+            ).fetchone()[0],
+        )
+        line_count = len(line_offsets) - 1
+        matching_lines = set(line_numbers)
+        for first_line, last_line in _merge_ranges(line_numbers, context, line_count):
+            if context and not first_range:
+                print("--")
+            first_range = False
+            start = line_offsets[first_line]
+            with open(os.path.join(bundle_directory, path), "rb") as f:
+                f.seek(start)
+                data = f.read(line_offsets[last_line + 1] - start)
+            # Split as when indexing, i.e. only on '\n' (unlike splitlines(), which splits on '\r').
+            lines = data.split(b"\n")
+            if lines[-1] == b"":
+                lines.pop()
+            for line_number, line in enumerate(lines, start=first_line):
+                separator = ":" if line_number in matching_lines else "-"
+                print(
+                    "{}{}{}{}{}".format(
+                        path,
+                        separator,
+                        line_number + 1,
+                        separator,
+                        line.decode("utf-8", "replace"),
+                    )
+                )
+
+
+def _merge_ranges(line_numbers: List[int], context: int, line_count: int) -> List[Tuple[int, int]]:
+    """Returns the (first, last) line ranges to print for the sorted line numbers, merging ranges
+    which overlap or are adjacent."""
+    ranges = []  # type: List[Tuple[int, int]]
+    for line_number in line_numbers:
+        first_line = max(line_number - context, 0)
+        last_line = min(line_number + context, line_count - 1)
+        if ranges and first_line <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], last_line)
+        else:
+            ranges.append((first_line, last_line))
+    return ranges
+
+
+def rank_exceptions(connection: sqlite3.Connection, limit: int = None) -> List[tuple]:
+    """Returns (name, lines, files, first path, first line number) for each exception name found
+    in the bundle, most frequent first."""
+    rows = connection.execute(
+        """
+        SELECT name, SUM(count), COUNT(*) FROM exceptions
+        GROUP BY name
+        ORDER BY SUM(count) DESC, name
+        LIMIT ?
+        """,
+        (-1 if limit is None else limit,),
+    ).fetchall()
+    ranked = []
+    for name, count, file_count in rows:
+        # Report the occurrence in the file where the exception is most frequent.
+        path, first_line = connection.execute(
+            """
+            SELECT files.path, exceptions.first_line FROM exceptions
+            JOIN files ON files.id = exceptions.file_id
+            WHERE exceptions.name = ?
+            ORDER BY exceptions.count DESC, files.path
+            LIMIT 1
+            """,
+            (name,),
+        ).fetchone()
+        ranked.append((name, count, file_count, path, first_line + 1))
+    return ranked
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index and search a service diagnostics bundle")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    def add_parser(name, help_text):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("bundle_directory", type=str, help="The bundle directory")
+        subparser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="The number of processes to index files with (default: the number of CPUs)",
+        )
+        return subparser
+
+    add_parser("build", "Create or update the bundle's index")
+
+    query_parser = add_parser("query", "Print lines containing all words of the query")
+    query_parser.add_argument("query", type=str, help="The words to search for")
+    query_parser.add_argument(
+        "-C",
+        "--context",
+        type=int,
+        default=2,
+        help="The number of lines to print before and after each match (default: %(default)s)",
+    )
+    query_parser.add_argument(
+        "--limit",
+        type=int,
+        default=100,
+        help="The maximum number of matching lines to print (default: %(default)s)",
+    )
+
+    exceptions_parser = add_parser("exceptions", "Rank exceptions by number of occurrences")
+    exceptions_parser.add_argument(
+        "--limit",
+        type=int,
+        default=25,
+        help="The maximum number of exceptions to print (default: %(default)s)",
+    )
+
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(
+        format="[%(asctime)s|%(name)s|%(levelname)s]: %(message)s",
+        level=logging.INFO,
+        stream=sys.stderr,
+    )
+    args = parse_args()
+    bundle_directory = args.bundle_directory
+    if not os.path.isdir(bundle_directory):
+        log.error("Bundle directory '%s' does not exist", bundle_directory)
+        return 1
+
+    # Brings the index up to date first, so that line offsets match the current files.
+    connection = build(bundle_directory, args.workers)
+    if args.command == "build":
+        connection.close()
+        return 0
+
+    start = time.time()
+    if args.command == "query":
+        try:
+            matches = search(connection, args.query, args.limit)
+        except ValueError as e:
+            log.error(e)
+            return 1
+        print_matches(connection, bundle_directory, matches, args.context)
+        log.info(
+            "Found %d matching lines in %.1fms", len(matches), (time.time() - start) * 1000
+        )
+    else:
+        ranked = rank_exceptions(connection, args.limit)
+        name_width = max([len(name) for name, _, _, _, _ in ranked] + [len("exception")])
+        print("{:<{}}  {:>7}  {:>5}  {}".format("exception", name_width, "lines", "files", "e.g."))
+        for name, count, file_count, path, line_number in ranked:
+            print(
+                "{:<{}}  {:>7}  {:>5}  {}:{}".format(
+                    name, name_width, count, file_count, path, line_number
+                )
+            )
+    connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
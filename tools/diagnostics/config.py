@@ -4,6 +4,9 @@ import retrying
 DEFAULT_RETRY_WAIT_MS = 1000
 DEFAULT_RETRY_MAX_ATTEMPTS = 5
 
+DEFAULT_PIPELINE_WORKERS = 8
+DEFAULT_COLLECTOR_TIMEOUT_SECONDS = 600
+
 
 def retry(fn):
     @functools.wraps(fn)
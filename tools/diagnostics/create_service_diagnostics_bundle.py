@@ -11,9 +11,11 @@ from typing import Any
 import argparse
 import json
 import logging
+import os
 import sys
 
 from full_bundle import FullBundle
+import config
 import sdk_cmd
 
 log = logging.getLogger(__name__)
@@ -133,6 +135,22 @@ def parse_args() -> dict:
         help="The directory where bundles will be written to",
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.DEFAULT_PIPELINE_WORKERS,
+        help="The maximum number of artifacts to collect concurrently (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--since-bundle",
+        type=str,
+        default=None,
+        help="A prior bundle directory for the same service. Log files which are unchanged since "
+        + "that bundle are linked from it instead of being downloaded again, and only the new "
+        + "content of grown log files is downloaded",
+    )
+
     parser.add_argument(
         "--yes",
         action="store_true",
@@ -149,6 +167,16 @@ def preflight_check() -> (int, dict):
     bundles_directory = args.bundles_directory
     should_prompt_user = not args.yes
 
+    since_bundle_directory = args.since_bundle
+    if since_bundle_directory and not os.path.isdir(since_bundle_directory):
+        # Also allow the name of a bundle in the bundles directory, e.g. when running in Docker.
+        since_bundle_directory = os.path.join(
+            bundles_directory, os.path.basename(since_bundle_directory.rstrip("/"))
+        )
+        if not os.path.isdir(since_bundle_directory):
+            log.error("Prior bundle directory '%s' does not exist", args.since_bundle)
+            return (1, {})
+
     (is_authenticated, message) = is_authenticated_to_dcos_cluster()
     if not is_authenticated:
         log.error(
@@ -205,6 +233,8 @@ def preflight_check() -> (int, dict):
             "dcos_version": cluster["version"],
             "cluster_url": cluster["url"],
             "should_prompt_user": should_prompt_user,
+            "workers": args.workers,
+            "since_bundle_directory": since_bundle_directory,
         },
     )
 
@@ -220,6 +250,8 @@ def main(argv) -> int:
     print("  Service name:    {}".format(args.get("service_name")))
     print("  DC/OS version:   {}".format(args.get("dcos_version")))
     print("  Cluster URL:     {}".format(args.get("cluster_url")))
+    if args.get("since_bundle_directory"):
+        print("  Since bundle:    {}".format(args.get("since_bundle_directory")))
 
     if args.get("should_prompt_user"):
         answer = input("\nProceed? [Y/n]: ")
@@ -227,7 +259,11 @@ def main(argv) -> int:
             return 0
 
     rc, _ = FullBundle(
-        args.get("package_name"), args.get("service_name"), args.get("bundles_directory")
+        args.get("package_name"),
+        args.get("service_name"),
+        args.get("bundles_directory"),
+        workers=args.get("workers"),
+        since_bundle_directory=args.get("since_bundle_directory"),
     ).create()
 
     return rc
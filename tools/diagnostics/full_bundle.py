@@ -73,10 +73,19 @@ def directory_date_string() -> str:
 
 
 class FullBundle(Bundle):
-    def __init__(self, package_name, service_name, bundles_directory):
+    def __init__(
+        self,
+        package_name,
+        service_name,
+        bundles_directory,
+        workers=config.DEFAULT_PIPELINE_WORKERS,
+        since_bundle_directory=None,
+    ):
         self.package_name = package_name
         self.service_name = service_name
         self.bundles_directory = bundles_directory
+        self.workers = workers
+        self.since_bundle_directory = since_bundle_directory
         self.output_directory = self._create_bundle_directory()
 
     def _configure_logging(self):
@@ -158,6 +167,8 @@ class FullBundle(Bundle):
             scheduler_tasks,
             active_service,
             self.output_directory,
+            workers=self.workers,
+            since_bundle_directory=self.since_bundle_directory,
         ).create()
 
         if base_tech.is_package_supported(self.package_name):
@@ -169,6 +180,7 @@ class FullBundle(Bundle):
                 scheduler_tasks,
                 active_service,
                 self.output_directory,
+                workers=self.workers,
             ).create()
         else:
             log.info(
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List
+
+import config
+
+log = logging.getLogger(__name__)
+
+
+class CollectorResult:
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    TIMED_OUT = "timed out"
+    SKIPPED = "skipped"
+
+    def __init__(self, name: str, status: str, start: float, duration: float, error=None):
+        self.name = name
+        self.status = status
+        self.start = start
+        self.duration = duration
+        self.error = error
+
+
+class _Collector:
+    def __init__(self, name: str, fn: Callable, depends_on: List[str], timeout_seconds: float):
+        self.name = name
+        self.fn = fn
+        self.depends_on = depends_on
+        self.timeout_seconds = timeout_seconds
+        self.thread = None
+        self.start = None
+
+
+class Pipeline:
+    """Runs bundle collectors concurrently, while respecting their dependencies on each other.
+
+    Each collector is a function which writes some part of the bundle. Collectors start as soon as
+    all the collectors that they depend on have succeeded, with at most `workers` running at once.
+    A collector which fails or times out doesn't affect other collectors, except that any collectors
+    depending on it are skipped. Collectors may add further collectors while the pipeline is
+    running, e.g. one per plan once the list of plans is known.
+
+    Retries are left to the collectors themselves (see config.retry). A timed out collector can't be
+    interrupted, so it's abandoned and left to finish in the background, and no longer counts
+    towards `workers`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workers: int = config.DEFAULT_PIPELINE_WORKERS,
+        timeout_seconds: float = config.DEFAULT_COLLECTOR_TIMEOUT_SECONDS,
+    ):
+        self.name = name
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self._collectors = {}  # type: Dict[str, _Collector]
+        self._results = {}  # type: Dict[str, CollectorResult]
+        self._running = set()  # names of started collectors which haven't finished or timed out
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def add(
+        self,
+        name: str,
+        fn: Callable,
+        depends_on: Iterable[str] = (),
+        timeout_seconds: float = None,
+    ) -> str:
+        """Adds a collector to the pipeline, which may already be running. Returns the name."""
+        with self._lock:
+            if name in self._collectors:
+                raise ValueError("Duplicate collector name: {}".format(name))
+            self._collectors[name] = _Collector(
+                name,
+                fn,
+                list(depends_on),
+                timeout_seconds if timeout_seconds is not None else self.timeout_seconds,
+            )
+            self._changed.notify_all()
+        return name
+
+    def run(self) -> Dict[str, CollectorResult]:
+        """Runs all collectors to completion, logs a timing summary, and returns the results."""
+        start = time.time()
+        with self._lock:
+            while len(self._results) < len(self._collectors):
+                self._check_timeouts()
+                self._start_ready_collectors()
+                if len(self._results) < len(self._collectors):
+                    self._changed.wait(timeout=1)
+        self._log_summary(time.time() - start)
+        return dict(self._results)
+
+    def _start_ready_collectors(self):
+        for collector in list(self._collectors.values()):
+            if len(self._running) >= self.workers:
+                return
+            if collector.thread is not None or collector.name in self._results:
+                continue
+            unknown = [name for name in collector.depends_on if name not in self._collectors]
+            if unknown:
+                self._finish(
+                    collector,
+                    CollectorResult.SKIPPED,
+                    "unknown dependencies: {}".format(", ".join(unknown)),
+                )
+                continue
+            dependency_results = [self._results.get(name) for name in collector.depends_on]
+            if None in dependency_results:
+                continue  # wait for dependencies
+            unsuccessful = [
+                result.name
+                for result in dependency_results
+                if result.status != CollectorResult.SUCCEEDED
+            ]
+            if unsuccessful:
+                self._finish(
+                    collector,
+                    CollectorResult.SKIPPED,
+                    "depends on unsuccessful {}".format(", ".join(unsuccessful)),
+                )
+                continue
+            # Each collector gets its own thread, so that one which times out doesn't hold up
+            # others. Daemon threads, so that a hung collector doesn't prevent exiting.
+            collector.start = time.time()
+            collector.thread = threading.Thread(
+                target=self._run_collector,
+                args=(collector,),
+                name="bundle-{}".format(collector.name),
+                daemon=True,
+            )
+            self._running.add(collector.name)
+            collector.thread.start()
+
+    def _run_collector(self, collector: _Collector):
+        try:
+            collector.fn()
+            status, error = CollectorResult.SUCCEEDED, None
+        except Exception as e:
+            log.exception("Collector '%s' failed", collector.name)
+            status, error = CollectorResult.FAILED, e
+        with self._lock:
+            if collector.name not in self._results:  # i.e. not timed out
+                self._finish(collector, status, error)
+
+    def _check_timeouts(self):
+        now = time.time()
+        for collector in self._collectors.values():
+            if (
+                collector.start is not None
+                and collector.name not in self._results
+                and now - collector.start > collector.timeout_seconds
+            ):
+                log.error(
+                    "Collector '%s' timed out after %ds", collector.name, collector.timeout_seconds
+                )
+                self._finish(collector, CollectorResult.TIMED_OUT, None)
+
+    def _finish(self, collector: _Collector, status: str, error):
+        """Records the result of a collector. Must be called with the lock held."""
+        self._running.discard(collector.name)
+        start = collector.start
+        duration = time.time() - start if start is not None else 0
+        self._results[collector.name] = CollectorResult(
+            collector.name, status, start, duration, error
+        )
+        self._changed.notify_all()
+
+    def _log_summary(self, wall_seconds: float):
+        results = sorted(
+            self._results.values(),
+            key=lambda result: (result.start is None, result.start or 0, result.name),
+        )
+        name_width = max([len(result.name) for result in results] + [len("collector")])
+        lines = ["{:<{}}  {:>9}  {}".format("collector", name_width, "seconds", "status")]
+        for result in results:
+            status = result.status
+            if result.error:
+                status = "{} ({})".format(status, result.error)
+            lines.append(
+                "{:<{}}  {:>9.1f}  {}".format(result.name, name_width, result.duration, status)
+            )
+        log.info(
+            "%s: ran %d collectors with %d workers in %.1fs (%.1fs of collector time):\n%s",
+            self.name,
+            len(results),
+            self.workers,
+            wall_seconds,
+            sum(result.duration for result in results),
+            "\n".join(lines),
+        )
@@ -1,3 +1,4 @@
+import concurrent.futures
 import functools
 import json
 import logging
@@ -10,6 +11,7 @@ import sdk_diag
 import sdk_hosts
 
 from bundle import Bundle
+from pipeline import Pipeline
 import agent
 import config
 
@@ -19,13 +21,27 @@ log = logging.getLogger(__name__)
 class ServiceBundle(Bundle):
     DOWNLOAD_FILES_WITH_PATTERNS = ["^stdout(\.\d+)?$", "^stderr(\.\d+)?$"]
 
-    def __init__(self, package_name, service_name, scheduler_tasks, service, output_directory):
+    def __init__(
+        self,
+        package_name,
+        service_name,
+        scheduler_tasks,
+        service,
+        output_directory,
+        workers=config.DEFAULT_PIPELINE_WORKERS,
+        since_bundle_directory=None,
+    ):
         self.package_name = package_name
         self.service_name = service_name
         self.scheduler_tasks = scheduler_tasks
         self.service = service
         self.framework_id = service.get("id")
         self.output_directory = output_directory
+        self.workers = workers
+        self.since_bundle_directory = since_bundle_directory
+        self.sandbox_manifest = None
+        self.pipeline = None
+        self.adminrouter_denied = False
 
     @config.retry
     def install_cli(self):
@@ -43,8 +59,19 @@ class ServiceBundle(Bundle):
         return self.tasks_with_state("TASK_RUNNING")
 
     def run_on_tasks(self, fn, task_ids):
-        for task_id in task_ids:
-            fn(task_id)
+        """Invokes fn for each task id, with up to `workers` tasks at once. A failure for one task
+        is logged and doesn't affect the others."""
+
+        def run_on_task(task_id):
+            try:
+                fn(task_id)
+            except Exception:
+                log.exception("Failed to collect diagnostics from task '%s'", task_id)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(self.workers, len(task_ids)))
+        ) as executor:
+            list(executor.map(run_on_task, task_ids))
 
     def for_each_running_task_with_prefix(self, prefix, fn):
         task_ids = [t["id"] for t in self.running_tasks() if t["name"].startswith(prefix)]
@@ -99,7 +126,17 @@ class ServiceBundle(Bundle):
         else:
             plans = json.loads(stdout)
             for plan in plans:
-                self.create_plan_status_file(plan)
+                self.run_or_add(
+                    "plan status {}".format(plan),
+                    functools.partial(self.create_plan_status_file, plan),
+                )
+
+    def run_or_add(self, name, fn):
+        """Adds fn as a collector to the running pipeline, or runs it directly if there isn't one."""
+        if self.pipeline:
+            self.pipeline.add(name, fn)
+        else:
+            fn()
 
     def download_log_files(self):
         all_tasks = self.scheduler_tasks + self.tasks()
@@ -108,27 +145,29 @@ class ServiceBundle(Bundle):
 
         agent_id_by_task_id = dict(map(lambda task: (task["id"], task["slave_id"]), all_tasks))
 
-        agent_executor_paths = {}
-        for agent_id in tasks_by_agent_id.keys():
-            agent_executor_paths[agent_id] = agent.debug_agent_files(agent_id)
-
         task_executor_sandbox_paths = {}
         for agent_id, tasks in tasks_by_agent_id.items():
+            sandbox_index = sdk_diag.AgentSandboxIndex(agent.debug_agent_files(agent_id))
             for task in tasks:
-                task_executor_sandbox_paths[task["id"]] = sdk_diag._find_matching_executor_path(
-                    agent_executor_paths[agent_id], sdk_diag._TaskEntry(task)
+                task_executor_sandbox_paths[task["id"]] = sandbox_index.get_task_executor_path(
+                    task["id"], task["executor_id"]
                 )
 
         for task_id, task_executor_sandbox_path in task_executor_sandbox_paths.items():
             agent_id = agent_id_by_task_id[task_id]
 
             if task_executor_sandbox_path:
-                agent.download_task_files(
-                    agent_id,
-                    task_executor_sandbox_path,
-                    task_id,
-                    os.path.join(self.output_directory, "tasks"),
-                    self.DOWNLOAD_FILES_WITH_PATTERNS,
+                self.run_or_add(
+                    "logs {}".format(task_id),
+                    functools.partial(
+                        agent.download_task_files,
+                        agent_id,
+                        task_executor_sandbox_path,
+                        task_id,
+                        os.path.join(self.output_directory, "tasks"),
+                        self.DOWNLOAD_FILES_WITH_PATTERNS,
+                        self.sandbox_manifest,
+                    ),
                 )
             else:
                 log.warn(
@@ -137,64 +176,65 @@ class ServiceBundle(Bundle):
                     task_id,
                 )
 
-    @config.retry
-    def create_offers_file(self):
+    def scheduler_get(self, path) -> str:
+        """Returns the content of a GET against the scheduler's HTTP API, e.g. 'v1/debug/offers'.
+
+        Requests go through adminrouter using the pooled cluster session. If adminrouter denies
+        access (e.g. due to the user's permissions), requests are instead made with curl inside the
+        scheduler task, which requires a task exec session per request."""
+        if not self.adminrouter_denied:
+            response = sdk_cmd.service_request(
+                "GET",
+                self.service_name.strip("/"),
+                path,
+                retry=False,
+                raise_on_error=False,
+                log_args=False,
+            )
+            if response.ok:
+                return response.text
+            if response.status_code not in (401, 403):
+                raise Exception(
+                    "Could not get scheduler '{}' endpoint: {} {}".format(
+                        path, response.status_code, response.text[:100]
+                    )
+                )
+            log.info(
+                "Access to scheduler via adminrouter denied (%s), using task exec instead",
+                response.status_code,
+            )
+            self.adminrouter_denied = True
+        return self.scheduler_exec_get(path)
+
+    def scheduler_exec_get(self, path) -> str:
         scheduler_vip = sdk_hosts.scheduler_vip_host(self.service_name, "api")
         scheduler = self.scheduler_tasks[0]
 
         rc, stdout, stderr = sdk_cmd.marathon_task_exec(
-            scheduler["id"], "curl -s {}/v1/debug/offers".format(scheduler_vip), print_output=False
+            scheduler["id"], "curl -s {}/{}".format(scheduler_vip, path), print_output=False
         )
 
         if rc != 0 or stderr:
-            log.error(
-                "Could not get scheduler offers\nstdout: '%s'\nstderr: '%s'", stdout[:100], stderr
+            raise Exception(
+                "Could not get scheduler '{}' endpoint\nstdout: '{}'\nstderr: '{}'".format(
+                    path, stdout[:100], stderr
+                )
             )
-        else:
-            self.write_file("service_v1_debug_offers.html", stdout)
+        return stdout
+
+    @config.retry
+    def create_offers_file(self):
+        self.write_file("service_v1_debug_offers.html", self.scheduler_get("v1/debug/offers"))
 
     @functools.lru_cache()
     @config.retry
     def configuration_ids(self) -> List[str]:
-        scheduler_vip = sdk_hosts.scheduler_vip_host(self.service_name, "api")
-        scheduler = self.scheduler_tasks[0]
-
-        rc, stdout, stderr = sdk_cmd.marathon_task_exec(
-            scheduler["id"],
-            "curl -s {}/v1/configurations".format(scheduler_vip),
-            print_output=False,
-        )
-
-        if rc != 0 or stderr:
-            raise Exception(
-                "Could not get scheduler configuration IDs\nstdout: '%s'\nstderr: '%s'",
-                stdout,
-                stderr,
-            )
-        else:
-            return json.loads(stdout)
+        return json.loads(self.scheduler_get("v1/configurations"))
 
     @functools.lru_cache()
     @config.retry
     def configuration(self, configuration_id) -> dict:
-        scheduler_vip = sdk_hosts.scheduler_vip_host(self.service_name, "api")
-        scheduler = self.scheduler_tasks[0]
-
-        rc, stdout, stderr = sdk_cmd.marathon_task_exec(
-            scheduler["id"],
-            "curl -s {}/v1/configurations/{}".format(scheduler_vip, configuration_id),
-            print_output=False,
-        )
-
-        if rc != 0 or stderr:
-            raise Exception(
-                "Could not get scheduler configuration with ID '{}'\nstdout: '%s'\nstderr: '%s'",
-                configuration_id,
-                stdout,
-                stderr,
-            )
-        else:
-            return json.loads(stdout)
+        return json.loads(self.scheduler_get("v1/configurations/{}".format(configuration_id)))
 
     @config.retry
     def create_configuration_ids_file(self):
@@ -203,20 +243,37 @@ class ServiceBundle(Bundle):
         )
 
     @config.retry
+    def create_configuration_file_for_id(self, configuration_id):
+        self.write_file(
+            "service_v1_configuration_{}.json".format(configuration_id),
+            self.configuration(configuration_id),
+            serialize_to_json=True,
+        )
+
     def create_configuration_files(self):
         for configuration_id in self.configuration_ids():
-            self.write_file(
-                "service_v1_configuration_{}.json".format(configuration_id),
-                self.configuration(configuration_id),
-                serialize_to_json=True,
+            self.run_or_add(
+                "configuration {}".format(configuration_id),
+                functools.partial(self.create_configuration_file_for_id, configuration_id),
             )
 
     def create(self):
-        self.install_cli()
-        self.create_configuration_file()
-        self.create_pod_status_file()
-        self.create_plans_status_files()
-        self.create_offers_file()
-        self.create_configuration_ids_file()
-        self.create_configuration_files()
-        self.download_log_files()
+        self.sandbox_manifest = agent.SandboxManifest(
+            self.output_directory, self.since_bundle_directory
+        )
+        self.pipeline = Pipeline("Service bundle", workers=self.workers)
+        # The service CLI is needed by the 'dcos <service> ...' collectors. Everything else only
+        # talks to the cluster, and can start right away.
+        cli = self.pipeline.add("install CLI", self.install_cli)
+        self.pipeline.add("describe", self.create_configuration_file, depends_on=[cli])
+        self.pipeline.add("pod status", self.create_pod_status_file, depends_on=[cli])
+        self.pipeline.add("plans", self.create_plans_status_files, depends_on=[cli])
+        self.pipeline.add("offers", self.create_offers_file)
+        ids = self.pipeline.add("configuration IDs", self.create_configuration_ids_file)
+        self.pipeline.add("configurations", self.create_configuration_files, depends_on=[ids])
+        self.pipeline.add("logs", self.download_log_files)
+        try:
+            self.pipeline.run()
+        finally:
+            self.pipeline = None
+        self.sandbox_manifest.write()
@@ -0,0 +1,103 @@
+import json
+import os
+from unittest import mock
+
+import agent
+
+
+class FakeAgentFiles:
+    """Serves files/download and files/read requests for files held in memory."""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    def cluster_request(self, method, path, params=None, **kwargs):
+        self.requests.append(path)
+        response = mock.Mock(ok=True, status_code=200)
+        if "/files/download?path=" in path:
+            content = self.files[path.split("path=", 1)[1]]
+            response.iter_content = lambda chunk_size: [content]
+        else:
+            content = self.files[params["path"]]
+            data = content[params["offset"] : params["offset"] + params["length"]]
+            response.json = lambda: {"data": data.decode("latin-1"), "offset": params["offset"]}
+        return response
+
+    def browse(self, mtime):
+        return [
+            {"path": path, "size": len(content), "mtime": mtime}
+            for path, content in sorted(self.files.items())
+        ]
+
+
+def create_bundle(tmpdir, name, agent_files, mtime, since_bundle_directory=None):
+    bundle_directory = str(tmpdir.join(name))
+    manifest = agent.SandboxManifest(bundle_directory, since_bundle_directory)
+    with mock.patch("sdk_cmd.cluster_request", agent_files.cluster_request):
+        agent.download_sandbox_files(
+            "agent-1",
+            agent_files.browse(mtime),
+            os.path.join(bundle_directory, "tasks", "task-1"),
+            ["^stdout(\\.\\d+)?$"],
+            manifest,
+        )
+    manifest.write()
+    return bundle_directory, manifest
+
+
+def read_task_file(bundle_directory, name):
+    with open(os.path.join(bundle_directory, "tasks", "task-1", name), "rb") as f:
+        return f.read()
+
+
+def test_grown_file_is_appended_to(tmpdir):
+    agent_files = FakeAgentFiles({"/sandbox/stdout": b"first \xe9\n"})
+    first_bundle, _ = create_bundle(tmpdir, "first", agent_files, mtime=1)
+
+    agent_files.files["/sandbox/stdout"] += b"second \xe9\n"
+    agent_files.requests = []
+    second_bundle, manifest = create_bundle(
+        tmpdir, "second", agent_files, mtime=2, since_bundle_directory=first_bundle
+    )
+
+    assert read_task_file(second_bundle, "stdout") == b"first \xe9\nsecond \xe9\n"
+    assert manifest.counts == {"downloaded": 0, "linked": 0, "appended": 1}
+    assert not any("/files/download" in path for path in agent_files.requests)
+
+
+def test_unchanged_file_is_linked(tmpdir):
+    agent_files = FakeAgentFiles({"/sandbox/stdout": b"first\n"})
+    first_bundle, _ = create_bundle(tmpdir, "first", agent_files, mtime=1)
+
+    agent_files.requests = []
+    second_bundle, manifest = create_bundle(
+        tmpdir, "second", agent_files, mtime=1, since_bundle_directory=first_bundle
+    )
+
+    assert read_task_file(second_bundle, "stdout") == b"first\n"
+    assert manifest.counts == {"downloaded": 0, "linked": 1, "appended": 0}
+    assert agent_files.requests == []
+
+
+def test_rotated_files_are_downloaded_in_full(tmpdir):
+    agent_files = FakeAgentFiles(
+        {"/sandbox/stdout": b"old line 1\n", "/sandbox/stdout.1": b"x\n"}
+    )
+    first_bundle, _ = create_bundle(tmpdir, "first", agent_files, mtime=1)
+
+    # After rotation, 'stdout.1' holds what was in 'stdout', and 'stdout' is a new file. Both are
+    # larger than the files with the same names in the first bundle.
+    agent_files.files = {
+        "/sandbox/stdout": b"new line 1\nnew line 2\n",
+        "/sandbox/stdout.1": b"old line 1\nold line 2\n",
+    }
+    second_bundle, manifest = create_bundle(
+        tmpdir, "second", agent_files, mtime=2, since_bundle_directory=first_bundle
+    )
+
+    assert read_task_file(second_bundle, "stdout") == b"new line 1\nnew line 2\n"
+    assert read_task_file(second_bundle, "stdout.1") == b"old line 1\nold line 2\n"
+    assert manifest.counts == {"downloaded": 2, "linked": 0, "appended": 0}
+    with open(os.path.join(second_bundle, agent.SandboxManifest.SANDBOX_MANIFEST_FILE_NAME)) as f:
+        assert json.load(f)["files"]["tasks/task-1/stdout"]["size"] == 22
@@ -0,0 +1,87 @@
+import subprocess
+
+from base_tech_bundle import BaseTechBundle
+
+
+class ShellBundle(BaseTechBundle):
+    """Runs task_exec() commands in a local shell, rather than in a task."""
+
+    def __init__(self):
+        self.scripts = []
+
+    def task_exec(self, task_id, cmd):
+        self.scripts.append(cmd)
+        result = subprocess.run(
+            ["bash", "-c", cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+        )
+        return result.returncode, result.stdout.decode(), result.stderr.decode()
+
+
+class FailingExecBundle(BaseTechBundle):
+    """Fails the exec itself, before any of the commands are run."""
+
+    def __init__(self):
+        pass
+
+    def task_exec(self, task_id, cmd):
+        return 1, "", "Error: task not found"
+
+
+def test_commands_are_run_in_one_exec():
+    bundle = ShellBundle()
+    results = bundle.task_exec_batch(
+        "task-1",
+        {
+            "first": "echo first",
+            "failing": "echo oops >&2; (exit 3)",
+            "last": "echo last",
+        },
+    )
+
+    assert len(bundle.scripts) == 1
+    assert results == {
+        "first": (0, "first\n", ""),
+        "failing": (3, "", "oops\n"),
+        "last": (0, "last\n", ""),
+    }
+
+
+def test_interleaved_stderr_is_split_by_command():
+    results = ShellBundle().task_exec_batch(
+        "task-1",
+        {
+            "a": "echo out-a-1; echo err-a-1 >&2; echo out-a-2; echo err-a-2 >&2",
+            "b": "echo err-b >&2; echo out-b",
+        },
+    )
+
+    assert results == {
+        "a": (0, "out-a-1\nout-a-2\n", "err-a-1\nerr-a-2\n"),
+        "b": (0, "out-b\n", "err-b\n"),
+    }
+
+
+def test_output_without_trailing_newline_is_kept_as_is():
+    results = ShellBundle().task_exec_batch(
+        "task-1",
+        {
+            "no_newline": "printf 'no newline'; printf 'err' >&2",
+            "blank_lines": "printf 'line\\n\\n'",
+            "empty": "true",
+        },
+    )
+
+    assert results == {
+        "no_newline": (0, "no newline", "err"),
+        "blank_lines": (0, "line\n\n", ""),
+        "empty": (0, "", ""),
+    }
+
+
+def test_failed_exec_returns_its_error_for_every_command():
+    results = FailingExecBundle().task_exec_batch("task-1", {"a": "echo a", "b": "echo b"})
+
+    assert results == {
+        "a": (1, "", "Error: task not found"),
+        "b": (1, "", "Error: task not found"),
+    }
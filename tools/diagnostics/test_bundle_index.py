@@ -0,0 +1,73 @@
+import bundle_index
+
+
+def create_bundle(tmpdir, files):
+    bundle_directory = tmpdir.mkdir("bundle")
+    for path, content in files.items():
+        bundle_directory.join(path).write_binary(content, ensure=True)
+    return str(bundle_directory)
+
+
+def query(bundle_directory, words, context):
+    connection = bundle_index.build(bundle_directory, workers=1)
+    try:
+        bundle_index.print_matches(
+            connection, bundle_directory, bundle_index.search(connection, words), context
+        )
+    finally:
+        connection.close()
+
+
+def test_query_prints_matches_with_context(tmpdir, capsys):
+    bundle_directory = create_bundle(
+        tmpdir,
+        {"tasks/task-1/stdout": b"one\ntwo match\nthree\nfour\nfive\nsix match\nseven\neight\n"},
+    )
+
+    query(bundle_directory, "MATCH", context=1)
+
+    assert capsys.readouterr().out.splitlines() == [
+        "tasks/task-1/stdout-1-one",
+        "tasks/task-1/stdout:2:two match",
+        "tasks/task-1/stdout-3-three",
+        "--",
+        "tasks/task-1/stdout-5-five",
+        "tasks/task-1/stdout:6:six match",
+        "tasks/task-1/stdout-7-seven",
+    ]
+
+
+def test_query_only_splits_lines_on_newlines(tmpdir, capsys):
+    bundle_directory = create_bundle(
+        tmpdir, {"tasks/task-1/stdout": b"first\nfoo\rbar baz\nlast baz"}
+    )
+
+    query(bundle_directory, "baz", context=0)
+
+    assert capsys.readouterr().out.split("\n") == [
+        "tasks/task-1/stdout:2:foo\rbar baz",
+        "tasks/task-1/stdout:3:last baz",
+        "",
+    ]
+
+
+def test_exceptions_are_ranked_by_occurrences(tmpdir):
+    bundle_directory = create_bundle(
+        tmpdir,
+        {
+            "tasks/task-1/stderr": b"java.io.IOException: a\nKeyError: 'b'\njava.io.IOException\n",
+            "service_plan_status_deploy.json": b'{"message": "java.io.IOException"}\n',
+            "service_pod_status.json": b"KeyError KeyError KeyError\n",
+        },
+    )
+
+    connection = bundle_index.build(bundle_directory, workers=1)
+    try:
+        ranked = bundle_index.rank_exceptions(connection)
+    finally:
+        connection.close()
+
+    assert ranked == [
+        ("java.io.IOException", 3, 2, "tasks/task-1/stderr", 1),
+        ("KeyError", 1, 1, "tasks/task-1/stderr", 2),
+    ]
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from pipeline import CollectorResult, Pipeline
+
+
+def test_dependencies_run_in_order():
+    order = []
+    pipeline = Pipeline("test", workers=2)
+    pipeline.add("second", lambda: order.append("second"), depends_on=["first"])
+    pipeline.add("first", lambda: order.append("first"))
+
+    results = pipeline.run()
+
+    assert order == ["first", "second"]
+    assert results["second"].status == CollectorResult.SUCCEEDED
+
+
+def test_failed_dependency_skips_dependents():
+    def fail():
+        raise Exception("failed")
+
+    pipeline = Pipeline("test", workers=2)
+    pipeline.add("first", fail)
+    pipeline.add("second", lambda: None, depends_on=["first"])
+    pipeline.add("other", lambda: None)
+
+    results = pipeline.run()
+
+    assert results["first"].status == CollectorResult.FAILED
+    assert results["second"].status == CollectorResult.SKIPPED
+    assert results["other"].status == CollectorResult.SUCCEEDED
+
+
+def test_timed_out_collector_frees_its_worker():
+    hung = threading.Event()
+    pipeline = Pipeline("test", workers=1, timeout_seconds=1)
+    pipeline.add("hang", lambda: hung.wait(30))
+    pipeline.add("noop", lambda: None)
+
+    start = time.time()
+    try:
+        results = pipeline.run()
+    finally:
+        hung.set()
+
+    assert results["hang"].status == CollectorResult.TIMED_OUT
+    assert results["noop"].status == CollectorResult.SUCCEEDED
+    # The no-op starts once the hung collector times out, instead of waiting for it to finish.
+    assert time.time() - start < 5